@@ -1,3 +1,6 @@
+import autograd.numpy as np
+
+
 class Agent:
     def __init__(self):
         pass
@@ -40,6 +43,32 @@ class Agent:
         """
         raise NotImplementedError()
 
+    def choose_actions(self, observations):
+        """Choose an action for each of an array of observations.
+        Calls choose_action on each observation; agents that can
+        choose all actions at once override this.
+
+        :param observations: Observations, one per row
+        :return: array of actions
+        """
+        return np.array([self.choose_action(obs) for obs in observations])
+
+    def get_probs_these_actions(self, observations, actions):
+        """Get the probability of each action given each observation.
+        Calls get_prob_this_action on each pair; agents that can
+        compute all probabilities at once override this.
+
+        :param observations: Observations, one per row
+        :param actions: Actions, one per observation
+        :return: array of probabilities
+        """
+        return np.array(
+            [
+                self.get_prob_this_action(obs, action)
+                for obs, action in zip(observations, actions)
+            ]
+        )
+
     def set_new_params(self, theta):
         """Update the parameters of the agent's policy
 
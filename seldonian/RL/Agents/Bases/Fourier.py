@@ -90,11 +90,24 @@ class Fourier:
         ret_matrix = np.cos(pi * ret_matrix)
         return ret_matrix
 
+    def get_features_batch(self, observations):
+        """Get the basis features of a block of observations at once
+
+        :param observations: Observations, one per row
+        :type observations: numpy ndarray of shape (N, num_observation_dims)
+        :return: Features, one row per observation
+        :rtype: numpy ndarray of shape (N, num_features)
+        """
+        normalized_obs = self.get_normalized_observations(observations)
+        return np.cos(pi * np.dot(normalized_obs, self.basis_matrix.T))
+
     def get_normalized_observation(self, obs):
         """Get the normalized observation given an observation"""
-        norm_obs = np.zeros(self.num_observation_dims)
-        for obs_dim in range(self.num_observation_dims):
-            norm_obs[obs_dim] = (obs[obs_dim] - self.mins[obs_dim]) / self.ranges[
-                obs_dim
-            ]
-        return norm_obs
+        obs = np.asarray(obs, dtype=float)[: self.num_observation_dims]
+        return (obs - self.mins) / self.ranges
+
+    def get_normalized_observations(self, observations):
+        """Get the normalized observations given observations, one per row"""
+        observations = np.asarray(observations, dtype=float)
+        observations = observations.reshape(len(observations), -1)
+        return (observations[:, : self.num_observation_dims] - self.mins) / self.ranges
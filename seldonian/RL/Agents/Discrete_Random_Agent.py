@@ -22,8 +22,16 @@ class Discrete_Random_Agent(Agent):
             self.min_action, self.max_action + 1
         )  # +1 because this function's high is exclusive
 
+    def choose_actions(self, observations):
+        return np.random.randint(
+            self.min_action, self.max_action + 1, size=len(observations)
+        )
+
     def update(self, observation, next_observation, reward, terminated):
         pass
 
     def get_prob_this_action(self, observation, action):
         return 1.0 / self.num_actions
+
+    def get_probs_these_actions(self, observations, actions):
+        return np.full(len(actions), 1.0 / self.num_actions)
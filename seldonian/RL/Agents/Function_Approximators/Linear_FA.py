@@ -15,6 +15,11 @@ class Linear_FA(Function_Approximator):
 
 
 class Linear_state_action_value_FA(Linear_FA):
+    # Features of up to this many state arrays,
+    # taking up to this many bytes in total, are cached
+    max_features_cache_entries = 16
+    max_features_cache_bytes = 256 * 2**20
+
     def __init__(self, basis, env_description):
         """A linear state action value function approximator.
 
@@ -24,12 +29,66 @@ class Linear_state_action_value_FA(Linear_FA):
         :type env_description: :py:class:`.Env_Description`
         """
         super().__init__(basis, env_description)
+        self.features_cache = []
 
     def get_action_values_given_state(self, state):
         return self.get_action_values_given_features(self.get_features(state))
 
+    def get_action_values_given_states(self, states):
+        """Get the action values for each of an array of states
+        with a single matrix product
+
+        :param states: Array of states, one per row
+        :return: array of action values, one row per state
+        """
+        return self.get_action_values_given_features(self.get_features_batch(states))
+
     def get_action_values_given_features(self, features):
         return np.dot(features, self.weights)
 
+    def get_features_batch(self, states):
+        """Get the features of each of an array of states, one row per state.
+        The states of a dataset never change, so the features are cached
+        by the identity of the states array and computed once per array.
+        The oldest features are evicted when the cache holds more than
+        max_features_cache_entries arrays or max_features_cache_bytes bytes,
+        and features larger than max_features_cache_bytes are not cached.
+
+        :param states: Array of states, one per row
+        :return: array of features, one row per state
+        """
+        if not hasattr(self, "features_cache"):
+            self.features_cache = []
+        for cached_states, cached_features in self.features_cache:
+            if cached_states is states:
+                return cached_features
+
+        if hasattr(self.basis, "get_features_batch"):
+            features = self.basis.get_features_batch(states)
+        else:
+            features = np.array([self.get_features(state) for state in states])
+
+        if features.nbytes > self.max_features_cache_bytes:
+            return features
+        # Keeping a reference to the states means their id cannot be reused
+        self.features_cache.append((states, features))
+        while (
+            len(self.features_cache) > self.max_features_cache_entries
+            or sum(cached[1].nbytes for cached in self.features_cache)
+            > self.max_features_cache_bytes
+        ):
+            self.features_cache.pop(0)
+        return features
+
+    def clear_features_cache(self):
+        """Forget all cached features"""
+        self.features_cache = []
+
+    def __getstate__(self):
+        # Don't pickle (or deepcopy) cached features
+        state = self.__dict__.copy()
+        state.pop("features_cache", None)
+        return state
+
     def get_features(self, state):
         return self.basis.get_features(state)
@@ -64,6 +64,19 @@ class Q_Table(Table):
         """
         return self.weights[zero_indexed_state_number, :]
 
+    def get_action_values_given_states(self, states_not_zero_indexed):
+        """Get possible Q-table values for each of an array of environmental
+        observations with a single gather
+
+        :param states_not_zero_indexed: The environment-specific obs numbers
+        :type states_not_zero_indexed: numpy ndarray(int)
+        :return: array of possible Q-table values, one row per obs
+        """
+        zero_indexed_state_numbers = self.from_environment_state_to_0_indexed_state(
+            np.asarray(states_not_zero_indexed).astype(int)
+        )
+        return self.weights[zero_indexed_state_numbers, :]
+
 
 def construct_Q_Table_From_Env_Description(env_description):
     """Create a Q table given an environment description
@@ -40,6 +40,14 @@ class Parameterized_non_learning_softmax_agent(Agent):
         """
         return self.softmax.choose_action(obs)
 
+    def choose_actions(self, observations):
+        """Select an action for each of an array of observations at once
+
+        :param observations: Observations, one per row
+        :return: array of actions
+        """
+        return self.softmax.choose_actions(observations)
+
     def update(self, observation, next_observation, reward, terminated):
         """
         Updates agent's parameters according to the learning rule.
@@ -66,6 +74,15 @@ class Parameterized_non_learning_softmax_agent(Agent):
         """
         return self.softmax.get_prob_this_action(observation, action)
 
+    def get_probs_these_actions(self, observations, actions):
+        """Get the probability of each action given each observation at once
+
+        :param observations: Observations, one per row
+        :param actions: Actions, one per observation
+        :return: array of probabilities
+        """
+        return self.softmax.get_probs(self.get_params(), observations, actions)
+
     def set_new_params(self, new_params):
         """Set the parameters of the agent
 
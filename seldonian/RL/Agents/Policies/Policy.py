@@ -26,6 +26,20 @@ class Policy:
         """Get probability of taking an action given an observation"""
         raise NotImplementedError()
 
+    def get_probs(self, new_params, observations, actions):
+        """Get the probability of taking each action given each observation
+        using new_params. Calls get_prob_this_action on each step;
+        policies that can compute all steps at once override this.
+
+        :param new_params: Parameter weights to use
+        :param observations: Array of observations
+        :param actions: Array of actions
+
+        :return: Array of probabilities
+        """
+        self.set_new_params(new_params)
+        return np.array(list(map(self.get_prob_this_action, observations, actions)))
+
 
 class Discrete_Action_Policy(Policy):
     def __init__(self, hyperparam_and_setting_dict, env_description):
@@ -110,6 +124,11 @@ class Discrete_Action_Policy(Policy):
         """Get all parameter weights possible in a given observation"""
         return self.FA.get_action_values_given_state(obs)
 
+    def get_action_values_given_states(self, observations):
+        """Get all parameter weights possible in each of an array of
+        observations, one row per observation"""
+        return self.FA.get_action_values_given_states(observations)
+
     def set_new_params(self, new_params):
         """Set the parameters of the agent
 
@@ -50,6 +50,29 @@ class Softmax(Discrete_Action_Policy):
         print(action_probs)
         error("reached the end of SoftMax.choose_action(), this should never happen")
 
+    def choose_actions(self, observations):
+        """Select an action for each of an array of observations at once
+
+        :param observations: Observations, one per row
+
+        :return: array of actions
+        """
+        action_values = self.get_action_values_given_states(observations)
+        e_to_the_something_terms = np.exp(
+            action_values - np.max(action_values, axis=1, keepdims=True)
+        )
+        action_probs = e_to_the_something_terms / np.sum(
+            e_to_the_something_terms, axis=1, keepdims=True
+        )
+        # Roulette wheel for each observation: the first action
+        # whose cumulative probability reaches the stop value
+        stop_values = np.random.rand(len(action_probs))
+        actions_zero_indexed = np.sum(
+            np.cumsum(action_probs, axis=1) < stop_values[:, None], axis=1
+        )
+        actions_zero_indexed = np.minimum(actions_zero_indexed, self.num_actions - 1)
+        return self.from_0_indexed_action_to_environment_action(actions_zero_indexed)
+
     def get_action_probs_from_action_values(self, action_values):
         """Get action probabilities given a list of action values (param weights)"""
         e_to_the_something_terms = self.get_e_to_the_something_terms(action_values)
@@ -78,6 +101,29 @@ class Softmax(Discrete_Action_Policy):
         this_action = self.from_environment_action_to_0_indexed_action(action)
         return action_probs[this_action]
 
+    def get_probs(self, new_params, observations, actions):
+        """Get the probability of taking each action given each observation
+        using new_params, for all steps at once: one lookup of the
+        action values of all observations followed by a
+        row-wise log-sum-exp. Differentiable with respect to new_params.
+
+        :param new_params: Parameter weights to use
+        :param observations: Array of observations
+        :param actions: Array of actions
+
+        :return: Array of probabilities
+        """
+        self.set_new_params(new_params)
+        action_values = self.get_action_values_given_states(observations)
+        these_actions = self.from_environment_action_to_0_indexed_action(
+            np.asarray(actions).astype(int)
+        )
+        # subtract max for numerical stability
+        max_values = np.max(action_values, axis=1, keepdims=True)
+        log_denoms = np.log(np.sum(np.exp(action_values - max_values), axis=1))
+        these_action_values = action_values[np.arange(len(these_actions)), these_actions]
+        return np.exp(these_action_values - max_values[:, 0] - log_denoms)
+
 
 class DiscreteSoftmax(Softmax):
     def __init__(self, hyperparam_and_setting_dict, env_description):
@@ -116,3 +162,25 @@ class DiscreteSoftmax(Softmax):
         :rtype: float
         """
         return np.exp(self._arg(observation, action)) / self._denom(observation)
+
+    def get_probs(self, new_params, observations, actions):
+        """Get the probability of taking each action given each observation
+        using new_params, for all steps at once. Like
+        :py:meth:`get_prob_this_action`, indexes the Q table directly
+        with the observations and actions. Differentiable with respect to new_params.
+
+        :param new_params: Parameter weights to use
+        :param observations: Array of observations
+        :param actions: Array of actions
+
+        :return: Array of probabilities
+        """
+        self.set_new_params(new_params)
+        observations = np.asarray(observations).astype(int)
+        actions = np.asarray(actions).astype(int)
+        action_values = self.FA.weights[observations, :]
+        # subtract max for numerical stability
+        max_values = np.max(action_values, axis=1, keepdims=True)
+        log_denoms = np.log(np.sum(np.exp(action_values - max_values), axis=1))
+        these_action_values = action_values[np.arange(len(actions)), actions]
+        return np.exp(these_action_values - max_values[:, 0] - log_denoms)
@@ -31,14 +31,16 @@ class RL_model(SeldonianModel):  # consist of agent, env
 
         :return: Array of probabilities
         """
-        self.policy.set_new_params(new_params)
         num_probs = len(observations)
         if num_probs != len(actions):
             error(
                 f"different number of observations ({observations}) and actions ({actions})"
             )
 
-        probs = list(map(self.policy.get_prob_this_action, observations, actions))
+        if num_probs == 0:
+            return np.array([])
+
+        probs = self.policy.get_probs(new_params, observations, actions)
         # If the policy uses a cache, make sure to clear it
         # This is necessary because cache is only correct
         # for a given set of param weights
@@ -48,7 +50,14 @@ class RL_model(SeldonianModel):  # consist of agent, env
         except:
             pass
 
-        return np.array(probs)
+        return probs
+
+    def clear_features_cache(self):
+        """Forget the features the policy's function
+        approximator cached for the states of a dataset, if any"""
+        FA = getattr(self.policy, "FA", None)
+        if hasattr(FA, "clear_features_cache"):
+            FA.clear_features_cache()
 
     def get_prob_this_action(self, observation, action):
         """Get action probability given a single observation, action
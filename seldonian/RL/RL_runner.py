@@ -8,13 +8,19 @@ from seldonian.RL.environments.mountaincar import *
 from seldonian.RL.environments.n_step_mountaincar import *
 from seldonian.RL.environments.simglucose_env import *
 
-from seldonian.dataset import Episode
+from seldonian.dataset import Episode, EpisodeStore, EpisodeWriter
+from seldonian.utils.parallel_utils import get_fork_context
 
-import multiprocessing as mp
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
 
+# Set once in each worker process by _init_trial_worker()
+_trial_worker_state = {}
 
-def run_all_trials(hyperparameter_and_setting_dict):
+
+def run_all_trials(
+    hyperparameter_and_setting_dict, parallel=False, n_workers=8, seed=None
+):
     """Run many trials, each of which consist
     of the same number of episodes.
 
@@ -22,29 +28,69 @@ def run_all_trials(hyperparameter_and_setting_dict):
         environment, agent, number of episodes per trial,
         and number of trials
     :type hyperparameter_and_setting_dict: dict
+    :param parallel: Whether to generate the episodes of each
+        trial in parallel, see :py:func:`run_trial`
+    :param n_workers: Number of cpus if using parallel processing
+    :param seed: If parallel, the seed from which the seeds of
+        all trials are derived
 
     :return: List((List of episodes, agent)_i) for i trials
     """
     num_trials = hyperparameter_and_setting_dict["num_trials"]
+    if parallel:
+        if seed is None:
+            seed = np.random.randint(2**31)
+        trial_seeds = np.random.SeedSequence(seed).spawn(num_trials)
     trials = []
     for trial_num in range(num_trials):
-        trials.append(run_trial(hyperparameter_and_setting_dict)[0])
+        if parallel:
+            trial = run_trial(
+                hyperparameter_and_setting_dict,
+                parallel=True,
+                n_workers=n_workers,
+                seed=trial_seeds[trial_num],
+            )
+        else:
+            trial = run_trial(hyperparameter_and_setting_dict)
+        trials.append(trial[0])
     return trials
 
 
 def run_trial(
-    hyperparameter_and_setting_dict, model_params=None, parallel=False, n_workers=8
+    hyperparameter_and_setting_dict,
+    model_params=None,
+    parallel=False,
+    n_workers=8,
+    seed=None,
+    chunk_size=100,
+    episodes_dirname=None,
 ):
     """Run a single trial consists of an arbitrary number of episodes.
 
+    If parallel, the episodes are generated in chunks of chunk_size
+    by :py:func:`run_episode_chunks`, which makes the trial
+    reproducible for a given seed whatever the number of workers.
+
+    If episodes_dirname is given, the episodes are written there
+    by an :py:class:`.EpisodeWriter` as they are produced instead of
+    being kept in memory, and the returned episodes are memory-mapped.
+    If the trial fails, any episodes already in the directory are kept.
+
     :param hyperparameter_and_setting_dict: Specifies the
         environment, agent and number of episodes to run
     :type hyperparameter_and_setting_dict: dict
     :model_params: Policy parameters to set before running the trial
     :parallel: Whether to use parallel processing
     :n_workers: Number of cpus if using parallel processing
-
-    :return: (List of episodes, agent)
+    :seed: If parallel, the seed (or seed sequence) from which the
+        seed of each chunk is derived. If None, it is drawn from
+        numpy's global random state
+    :chunk_size: If parallel, the number of episodes in each chunk
+    :episodes_dirname: Directory to write the episodes to
+
+    :return: (List of episodes, agent). If parallel or writing
+        the episodes, the episodes are an :py:class:`.EpisodeStore`
+        where possible
     """
     episodes = []
     num_episodes = hyperparameter_and_setting_dict["num_episodes"]
@@ -59,25 +105,275 @@ def run_trial(
     if hyperparameter_and_setting_dict["vis"]:
         env.start_visualizing()
 
-    if parallel:
-        from concurrent.futures import ProcessPoolExecutor
-        import multiprocessing as mp
+    if episodes_dirname is not None:
+        writer_context = EpisodeWriter(episodes_dirname)
+    else:
+        writer_context = nullcontext()
+
+    # The writer is aborted if generating the episodes fails
+    with writer_context as writer:
+        if parallel:
+            episodes = run_episode_chunks(
+                hyperparameter_and_setting_dict,
+                num_episodes,
+                model_params=model_params,
+                n_workers=n_workers,
+                seed=seed,
+                chunk_size=chunk_size,
+                episode_writer=writer,
+            )
+        else:
+            for episode_num in range(num_episodes):
+                episode = run_episode(agent, env)
+                if writer is not None:
+                    writer.append(episode)
+                else:
+                    episodes.append(episode)
+
+    if episodes_dirname is not None:
+        episodes = EpisodeStore.from_directory(episodes_dirname)
+    return episodes, agent
 
-        param1 = (hyperparameter_and_setting_dict for _ in range(num_episodes))
-        param2 = (model_params for _ in range(num_episodes))
-        # run_episode_from_dict(hyperparameter_and_setting_dict,model_params)
+
+def _init_trial_worker(hyperparameter_and_setting_dict, model_params):
+    """Build the agent and environment once per worker process"""
+    agent = create_agent(hyperparameter_and_setting_dict)
+    if model_params is not None:
+        agent.set_new_params(model_params)
+    _trial_worker_state["agent"] = agent
+    _trial_worker_state["env"] = hyperparameter_and_setting_dict["env"]
+
+
+def _run_episode_chunk(chunk_seed, num_episodes):
+    """Run a chunk of episodes in a worker process with the agent
+    and environment built by _init_trial_worker(), after seeding
+    numpy's global random state (used by agents and environments)
+    with chunk_seed. When run in the calling process, the caller
+    must save and restore the global random state. The episodes are sent back as an
+    :py:class:`.EpisodeStore` where possible, which only holds a few arrays
+    """
+    np.random.seed(chunk_seed)
+    agent = _trial_worker_state["agent"]
+    env = _trial_worker_state["env"]
+    episodes = [run_episode(agent, env) for _ in range(num_episodes)]
+    try:
+        return EpisodeStore.from_episodes(episodes)
+    except (ValueError, AttributeError):
+        # e.g., observations of different shapes
+        return episodes
+
+
+def run_episode_chunks(
+    hyperparameter_and_setting_dict,
+    num_episodes,
+    model_params=None,
+    n_workers=8,
+    seed=None,
+    chunk_size=100,
+    episode_writer=None,
+):
+    """Run num_episodes episodes in chunks of chunk_size on a pool of
+    n_workers processes. Each worker builds its agent and environment
+    once. Each chunk gets its own seed, spawned from a SeedSequence in
+    chunk order, so for agents that do not learn the episodes are the same
+    whatever the number of workers. Chunks are collected as they complete
+    and put back in order.
+
+    If an episode_writer is given, each chunk is written as soon
+    as all chunks before it have been, and then dropped from memory.
+
+    :param hyperparameter_and_setting_dict: Specifies the
+        environment and agent
+    :type hyperparameter_and_setting_dict: dict
+    :param num_episodes: Number of episodes to run
+    :param model_params: Policy parameters to set before running the episodes
+    :param n_workers: Number of processes. If 1, or if processes can't
+        be forked on this platform, the chunks are run in this process,
+        leaving numpy's global random state as it was
+    :param seed: Seed (or seed sequence) from which the seed of
+        each chunk is derived. If None, it is drawn from numpy's
+        global random state
+    :type seed: int or numpy.random.SeedSequence
+    :param chunk_size: Number of episodes in each chunk
+    :param episode_writer: Writer to stream the chunks to
+    :type episode_writer: :py:class:`.EpisodeWriter`
+
+    :return: Episodes, in an :py:class:`.EpisodeStore` if
+        every chunk could be stored in one, otherwise a list.
+        None if the episodes were written to episode_writer
+    """
+    if seed is None:
+        seed = np.random.randint(2**31)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    chunk_sizes = [
+        min(chunk_size, num_episodes - start)
+        for start in range(0, num_episodes, chunk_size)
+    ]
+    chunk_seeds = [
+        child.generate_state(1)[0] for child in seed.spawn(len(chunk_sizes))
+    ]
+
+    chunks = [None] * len(chunk_sizes)
+    n_written = 0
+
+    def collect(chunk_index, chunk):
+        nonlocal n_written
+        chunks[chunk_index] = chunk
+        if episode_writer is None:
+            return
+        while n_written < len(chunks) and chunks[n_written] is not None:
+            episode_writer.append(chunks[n_written])
+            chunks[n_written] = []
+            n_written += 1
+
+    mp_context = get_fork_context(n_workers)
+    if mp_context is not None:
         with ProcessPoolExecutor(
-            max_workers=n_workers, mp_context=mp.get_context("fork")
+            max_workers=n_workers,
+            mp_context=mp_context,
+            initializer=_init_trial_worker,
+            initargs=(hyperparameter_and_setting_dict, model_params),
         ) as ex:
-            results = ex.map(run_episode_from_dict, param1, param2)
-            for ep in results:
-                episodes.append(ep)
+            futures = {
+                ex.submit(_run_episode_chunk, chunk_seed, n_chunk): chunk_index
+                for chunk_index, (chunk_seed, n_chunk) in enumerate(
+                    zip(chunk_seeds, chunk_sizes)
+                )
+            }
+            for future in as_completed(futures):
+                collect(futures[future], future.result())
     else:
-        for episode_num in range(num_episodes):
-            episodes.append(run_episode(agent, env))
+        random_state = np.random.get_state()
+        _init_trial_worker(hyperparameter_and_setting_dict, model_params)
+        try:
+            for chunk_index, (chunk_seed, n_chunk) in enumerate(
+                zip(chunk_seeds, chunk_sizes)
+            ):
+                collect(chunk_index, _run_episode_chunk(chunk_seed, n_chunk))
+        finally:
+            _trial_worker_state.clear()
+            np.random.set_state(random_state)
+
+    if episode_writer is not None:
+        return None
+    if all(isinstance(chunk, EpisodeStore) for chunk in chunks):
+        return EpisodeStore.concatenate(chunks)
+    return [episode for chunk in chunks for episode in chunk]
+
+
+def run_vectorized_trial(
+    hyperparameter_and_setting_dict, model_params=None, num_envs=1000
+):
+    """Like :py:func:`run_trial`, but steps num_envs copies of the
+    environment at once, using the environment's vectorized variant
+    (see e.g. :py:meth:`.Gridworld.make_vectorized`)
+    and the agent's batched methods.
+
+    Only for generating behavior data with a fixed policy:
+    unlike :py:func:`run_trial`, the agent's update() is never called,
+    so an agent that learns would keep its initial policy.
+    Use :py:func:`run_trial` for learning agents.
+
+    :param hyperparameter_and_setting_dict: Specifies the
+        environment, agent and number of episodes to run
+    :type hyperparameter_and_setting_dict: dict
+    :model_params: Policy parameters to set before running the trial
+    :num_envs: Number of copies of the environment to step at once
+
+    :return: (Episodes, agent)
+    :rtype: (:py:class:`.EpisodeStore`, agent)
+    """
+    num_episodes = hyperparameter_and_setting_dict["num_episodes"]
+    agent = create_agent(hyperparameter_and_setting_dict)
+    if model_params is not None:
+        agent.set_new_params(model_params)
+
+    env = hyperparameter_and_setting_dict["env"]
+    episodes = run_vectorized_episodes(
+        agent, env.make_vectorized(min(num_envs, num_episodes)), num_episodes
+    )
     return episodes, agent
 
 
+def run_vectorized_episodes(agent, vec_env, num_episodes):
+    """Run num_episodes episodes, vec_env.num_envs at a time.
+    The timesteps are written into preallocated arrays and
+    returned as a columnar episode store, without creating any
+    per-step (or per-episode) Python objects.
+
+    The agent's policy stays fixed: unlike :py:func:`run_episode`,
+    agent.update() is never called, so this is only for generating
+    behavior data with agents that don't learn.
+
+    :param agent: RL Agent with batched choose_actions and
+        get_probs_these_actions methods
+    :param vec_env: Vectorized RL Environment
+    :type vec_env: :py:class:`.Vectorized_Environment`
+    :param num_episodes: Number of episodes to run
+
+    :return: The episodes
+    :rtype: :py:class:`.EpisodeStore`
+    """
+    columns = {"observations": [], "actions": [], "rewards": [], "action_probs": []}
+    all_lengths = []
+    num_envs = vec_env.num_envs
+    n_done = 0
+    while n_done < num_episodes:
+        vec_env.reset()
+        n_this_round = min(num_envs, num_episodes - n_done)
+
+        buffers = None
+        lengths = np.zeros(num_envs, dtype=int)
+        t = 0
+        while not vec_env.all_terminated():
+            observations = vec_env.get_observation()
+            active = ~vec_env.terminated()
+            actions = agent.choose_actions(observations)
+            action_probs = agent.get_probs_these_actions(observations, actions)
+            rewards = vec_env.transition(actions)
+
+            if buffers is None:
+                # One row per timestep, one column per copy
+                buffers = {
+                    name: np.zeros((vec_env.max_time,) + np.shape(arr), dtype=dtype)
+                    for name, arr, dtype in [
+                        ("observations", observations, observations.dtype),
+                        ("actions", actions, actions.dtype),
+                        ("rewards", rewards, float),
+                        ("action_probs", action_probs, float),
+                    ]
+                }
+            for name, arr in [
+                ("observations", observations),
+                ("actions", actions),
+                ("rewards", rewards),
+                ("action_probs", action_probs),
+            ]:
+                buffers[name][t] = arr
+            lengths += active
+            t += 1
+
+        # Copy-major order, keeping only the steps each copy took
+        lengths = lengths[:n_this_round]
+        step_mask = np.arange(t)[:, None] < lengths[None, :]
+        for name in columns:
+            columns[name].append(
+                np.swapaxes(buffers[name][:t, :n_this_round], 0, 1)[step_mask.T]
+            )
+        all_lengths.append(lengths)
+        n_done += n_this_round
+
+    offsets = np.concatenate([[0], np.cumsum(np.concatenate(all_lengths))]).astype(int)
+    return EpisodeStore(
+        np.concatenate(columns["observations"]),
+        np.concatenate(columns["actions"]),
+        np.concatenate(columns["rewards"]),
+        np.concatenate(columns["action_probs"]),
+        offsets,
+    )
+
+
 def run_trial_given_agent_and_env(agent, env, num_episodes):
     """A wrapper for run_trial() where parameters
     are specified explicity rather than via a dictionary.
@@ -1,3 +1,6 @@
+import autograd.numpy as np
+
+
 class Environment:
     """Base class for all RL environments"""
 
@@ -44,3 +47,27 @@ class Environment:
     def stop_visualizing(self):
         """Turn off visualization debugger"""
         self.vis = False
+
+
+class Vectorized_Environment(Environment):
+    """Base class for RL environments that step num_envs
+    independent copies at once, with the state of all
+    copies held in numpy arrays. Copies that have terminated
+    stay terminated and are not stepped until the next reset.
+    Override get_observation(), transition() and reset()
+    in child class implementation, where get_observation()
+    returns the observations of all copies, one per row, and
+    transition() takes an array of actions, one per copy, and
+    returns the array of rewards (0 for terminated copies).
+    """
+
+    def terminated(self):
+        """Get whether each copy is in the terminal obs
+
+        :rtype: numpy ndarray(bool)
+        """
+        return self.terminal_state
+
+    def all_terminated(self):
+        """Get whether every copy is in the terminal obs"""
+        return bool(np.all(self.terminal_state))
@@ -102,6 +102,17 @@ class Gridworld(Environment):
         """
         return self.state == self.num_states - 1
 
+    def make_vectorized(self, num_envs):
+        """Create a :py:class:`.Vectorized_gridworld` with the same
+        size and maximum time as this environment
+
+        :param num_envs: The number of copies of the environment
+        """
+        vec_env = Vectorized_gridworld(num_envs, size=self.size)
+        vec_env.max_time = self.max_time
+        vec_env.gamma = self.gamma
+        return vec_env
+
     def visualize(self):
         """Print out current obs information"""
         print_state = 0
@@ -114,3 +125,63 @@ class Gridworld(Environment):
                 print_state += 1
             print()
         print()
+
+
+class Vectorized_gridworld(Vectorized_Environment):
+    def __init__(self, num_envs, size=3):
+        """num_envs independent copies of :py:class:`.Gridworld`,
+        stepped together
+
+        :param num_envs: The number of copies of the environment
+        :param size: The number of grid cells on a side
+        """
+        self.num_envs = num_envs
+        self.size = size
+        self.num_states = size * size
+        self.env_description = Gridworld.create_env_description(
+            self, self.num_states
+        )
+        self.max_time = 101
+        self.vis = False
+        self.gamma = 0.9
+        self.reset()
+
+    def reset(self):
+        """Send every copy back to initial obs and timestep"""
+        self.state = np.zeros(self.num_envs, dtype=int)
+        self.time = np.zeros(self.num_envs, dtype=int)
+        self.terminal_state = np.zeros(self.num_envs, dtype=bool)
+
+    def transition(self, actions):
+        """Transition each copy that has not terminated given its action
+
+        :param actions: One action per copy
+        :type actions: numpy ndarray(int)
+        :return: reward of each copy
+        :rtype: numpy ndarray(float)
+        """
+        actions = np.asarray(actions)
+        active = ~self.terminal_state
+        if np.any(active & ((actions < 0) | (actions > 3))):
+            raise Exception(f"invalid gridworld action in {actions[active]}")
+        rewards = np.zeros(self.num_envs)
+        self.time = np.where(active, self.time + 1, self.time)
+
+        state = self.state
+        up = (actions == 0) & (state >= self.size)
+        right = (actions == 1) & ((state + 1) % self.size != 0)
+        down = (actions == 2) & (state < self.num_states - self.size)
+        left = (actions == 3) & (state % self.size != 0)
+        new_state = state - self.size * up + right + self.size * down - left
+        self.state = np.where(active, new_state, state)
+
+        in_goal = self.state == self.num_states - 1
+        newly_terminal = active & (in_goal | (self.time >= self.max_time - 1))
+        rewards[newly_terminal & in_goal] = 1.0
+        rewards[active & (self.state == 7)] = -1.0
+        self.terminal_state = self.terminal_state | newly_terminal
+        return rewards
+
+    def get_observation(self):
+        """Get the current obs of every copy"""
+        return self.state
@@ -59,6 +59,16 @@ class Mountaincar(Environment):
         if self.time >= self.max_time:
             self.terminal_state = True
 
+    def make_vectorized(self, num_envs):
+        """Create a :py:class:`.Vectorized_mountaincar` with the same
+        maximum time as this environment
+
+        :param num_envs: The number of copies of the environment
+        """
+        vec_env = Vectorized_mountaincar(num_envs)
+        vec_env.max_time = self.max_time
+        return vec_env
+
     def visualize(self):
         error("mountain car visualize method not implemented")
 
@@ -68,3 +78,64 @@ class Mountaincar(Environment):
 
     def get_observation(self):
         return np.array([self.position, self.velocity])
+
+
+class Vectorized_mountaincar(Vectorized_Environment):
+    def __init__(self, num_envs):
+        """num_envs independent copies of :py:class:`.Mountaincar`,
+        stepped together
+
+        :param num_envs: The number of copies of the environment
+        """
+        self.num_envs = num_envs
+        self.env_description = Mountaincar.create_env_description(self)
+        self.max_time = 1000
+        self.vis = False
+        self.reset()
+
+    def reset(self):
+        """Send every copy back to initial obs and timestep"""
+        self.position = np.full(self.num_envs, -0.5)
+        self.velocity = np.zeros(self.num_envs)
+        self.time = np.zeros(self.num_envs, dtype=int)
+        self.terminal_state = np.zeros(self.num_envs, dtype=bool)
+
+    def transition(self, actions):
+        """Transition each copy that has not terminated given its action
+
+        :param actions: One action per copy
+        :type actions: numpy ndarray(int)
+        :return: reward of each copy
+        :rtype: numpy ndarray(float)
+        """
+        actions = np.asarray(actions)
+        active = ~self.terminal_state
+        if np.any(active & (actions != -1) & (actions != 0) & (actions != 1)):
+            raise (Exception(f"invalid action in {actions[active]}"))
+        self.time = np.where(active, self.time + 1, self.time)
+
+        bounds = self.env_description.observation_space.bounds
+        velocity = np.clip(
+            self.velocity + 0.001 * actions - 0.0025 * np.cos(3.0 * self.position),
+            bounds[1][0],
+            bounds[1][1],
+        )
+        position = self.position + velocity
+        at_lower_bound = position <= bounds[0][0]
+        position = np.where(at_lower_bound, bounds[0][0], position)
+        velocity = np.where(at_lower_bound, 0.0, velocity)
+        self.position = np.where(active, position, self.position)
+        self.velocity = np.where(active, velocity, self.velocity)
+
+        newly_terminal = active & (
+            (~at_lower_bound & (position >= bounds[0][1]))
+            | (self.time >= self.max_time)
+        )
+        self.terminal_state = self.terminal_state | newly_terminal
+        rewards = np.where(active, -1.0, 0.0)
+        rewards[newly_terminal] = 0.0
+        return rewards
+
+    def get_observation(self):
+        """Get the current obs of every copy, one per row"""
+        return np.stack([self.position, self.velocity], axis=1)
@@ -1,13 +1,20 @@
 """ Candidate selection module """
 
-import os, pickle
+import os, pickle, copy
 import autograd.numpy as np  # Thinly-wrapped version of Numpy
 import math
 import pandas as pd
 from functools import partial
 
 from seldonian.models import objectives
-from seldonian.dataset import SupervisedDataSet, RLDataSet
+from seldonian.dataset import SupervisedDataSet, RLDataSet, EpisodeStore
+from seldonian.parse_tree.nodes import BaseNodeRegistry
+from seldonian.utils.parallel_utils import get_fork_context
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Set once in each worker process by _init_multistart_worker()
+_multistart_worker_state = {}
 
 
 class CandidateSelection(object):
@@ -76,6 +83,8 @@ class CandidateSelection(object):
             self.labels = self.candidate_dataset.labels
 
         self.parse_trees = parse_trees
+        # Shares base node estimates across parse trees
+        self.base_node_registry = BaseNodeRegistry()
         self.primary_objective = (
             primary_objective  # must accept theta, features, labels
         )
@@ -88,83 +97,181 @@ class CandidateSelection(object):
         if "reg_coef" in kwargs:
             self.reg_coef = kwargs["reg_coef"]
 
+        # Set by calculate_batches()
+        self.batch_dataset = None
+        self.batch_features = None
+        self.batch_labels = None
+        self.batch_sensitive_attrs = None
+        self.batch_datasets = None
+        self.batch_datasets_size = None
+        self.shuffle_batches = False
+        self.batch_rng = np.random.default_rng()
+        self.batch_order = None
+        self.batch_rng_rows_state = None
+
     def calculate_batches(self, batch_index, batch_size):
-        """Create a batch dataset to be used in gradient descent.
-        Does not return anything, instead sets self.batch_dataset.
+        """Set the batch dataset to be used in gradient descent.
+        Does not create any data, instead sets self.batch_dataset
+        (and the batch features and labels) to one of
+        the batch datasets made by :py:meth:`make_batch_datasets`.
+        The same batch datasets are reused every epoch,
+        so the masked data they cache persist across epochs.
+        If batch_size covers the whole candidate dataset,
+        the batch dataset is the candidate dataset itself.
+
+        If self.shuffle_batches is True, the batches are
+        visited in a new random order each epoch.
 
         :param batch_index: The batch number (0-indexed)
         :type batch_index: int
         :param batch_size: The size of the batches 
         :type batch_size: int
         
-        :return: None
+        :return: Whether this is a trailing batch smaller than
+            batch_size, in which case a candidate solution
+            should not be taken from it.
+        :rtype: bool
         """
-        batch_start = batch_index * batch_size
-        batch_end = batch_start + batch_size
-
-        num_datapoints = self.candidate_dataset.num_datapoints
-        if self.regime == "supervised_learning":
-            if batch_size < num_datapoints:
-                if type(self.features) == list:
-                    self.batch_features = [
-                        x[batch_start:batch_end] for x in self.features
-                    ]
-                    batch_num_datapoints = len(self.batch_features[0])
-                else:
-                    self.batch_features = self.features[batch_start:batch_end]
-                    batch_num_datapoints = len(self.batch_features)
-
-                self.batch_labels = self.labels[batch_start:batch_end]
-                self.batch_sensitive_attrs = self.candidate_dataset.sensitive_attrs[
-                    batch_start:batch_end
-                ]
+        if batch_size >= self.candidate_dataset.num_datapoints:
+            batch_number = 0
+            batch_dataset = self.candidate_dataset
+        else:
+            if self.batch_datasets is None or self.batch_datasets_size != batch_size:
+                self.make_batch_datasets(batch_size)
+            if self.shuffle_batches:
+                # New epoch, new order
+                if batch_index == 0:
+                    self.batch_order = self.batch_rng.permutation(
+                        len(self.batch_datasets)
+                    )
+                batch_number = self.batch_order[batch_index]
             else:
-                self.batch_features = self.features
-                self.batch_labels = self.labels
-                self.batch_sensitive_attrs = self.candidate_dataset.sensitive_attrs
-                self.batch_dataset = self.candidate_dataset
-                batch_num_datapoints = num_datapoints
-
-            self.batch_dataset = SupervisedDataSet(
-                self.batch_features,
-                self.batch_labels,
-                self.batch_sensitive_attrs,
-                num_datapoints=batch_num_datapoints,
-                meta_information=self.candidate_dataset.meta_information,
-            )
+                batch_number = batch_index
+            batch_dataset = self.batch_datasets[batch_number]
+
+        if batch_dataset is not self.batch_dataset:
+            self.batch_dataset = batch_dataset
+            if self.regime == "supervised_learning":
+                self.batch_features = batch_dataset.features
+                self.batch_labels = batch_dataset.labels
+            self.batch_sensitive_attrs = batch_dataset.sensitive_attrs
+            # Data cached in the parse trees belong to a different dataset
+            for pt in self.parse_trees:
+                pt.reset_base_node_dict(reset_data=True)
 
-        elif self.regime == "reinforcement_learning":
-            if batch_size < num_datapoints:
-                batch_episodes = self.candidate_dataset.episodes[batch_start:batch_end]
-                batch_num_datapoints = len(batch_episodes)
-                self.batch_sensitive_attrs = self.candidate_dataset.sensitive_attrs[
-                    batch_start:batch_end
-                ]
-            else:
-                batch_episodes = self.candidate_dataset.episodes
-                batch_num_datapoints = num_datapoints
-                self.batch_sensitive_attrs = self.candidate_dataset.sensitive_attrs
-
-            self.batch_dataset = RLDataSet(
-                episodes=batch_episodes,
-                sensitive_attrs=self.batch_sensitive_attrs,
-                num_datapoints=batch_num_datapoints,
-                meta_information=self.candidate_dataset.meta_information,
-            )
         # If this batch is smaller than the batch size and not the first batch
         # then that means we shouldn't consider a candidate solution calculated from it 
-        print(batch_index,batch_start,batch_end,batch_num_datapoints)
-        if batch_index > 0 and (batch_num_datapoints < batch_size):
+        if batch_number > 0 and (batch_dataset.num_datapoints < batch_size):
             return True
         else: 
             return False
 
+    def make_batch_datasets(self, batch_size):
+        """Split the candidate dataset into batch datasets of
+        size batch_size (the last one may be smaller).
+        Batches are slices, i.e. views, of the candidate data. 
+        If self.shuffle_batches is True, the rows are
+        permuted once before splitting.
+        Sets self.batch_datasets
+
+        :param batch_size: The size of the batches 
+        :type batch_size: int
+        """
+        num_datapoints = self.candidate_dataset.num_datapoints
+        sensitive_attrs = self.candidate_dataset.sensitive_attrs
+        # So that the same batches can be made again on resume
+        self.batch_rng_rows_state = copy.deepcopy(self.batch_rng.bit_generator.state)
+        if self.shuffle_batches:
+            permutation = self.batch_rng.permutation(num_datapoints)
+            if len(sensitive_attrs) > 0:
+                sensitive_attrs = sensitive_attrs[permutation]
+
+        if self.regime == "supervised_learning":
+            features = self.features
+            labels = self.labels
+            if self.shuffle_batches:
+                if type(features) == list:
+                    features = [x[permutation] for x in features]
+                else:
+                    features = features[permutation]
+                labels = labels[permutation]
+        elif self.regime == "reinforcement_learning":
+            episodes = self.candidate_dataset.episodes
+            if self.shuffle_batches:
+                if isinstance(episodes, EpisodeStore):
+                    episodes = episodes[permutation]
+                else:
+                    episodes = [episodes[ii] for ii in permutation]
+
+        self.batch_datasets = []
+        for batch_start in range(0, num_datapoints, batch_size):
+            batch_end = batch_start + batch_size
+            if self.regime == "supervised_learning":
+                if type(features) == list:
+                    batch_features = [x[batch_start:batch_end] for x in features]
+                    batch_num_datapoints = len(batch_features[0])
+                else:
+                    batch_features = features[batch_start:batch_end]
+                    batch_num_datapoints = len(batch_features)
+
+                batch_dataset = SupervisedDataSet(
+                    batch_features,
+                    labels[batch_start:batch_end],
+                    sensitive_attrs[batch_start:batch_end],
+                    num_datapoints=batch_num_datapoints,
+                    meta_information=self.candidate_dataset.meta_information,
+                )
+
+            elif self.regime == "reinforcement_learning":
+                batch_episodes = episodes[batch_start:batch_end]
+                batch_dataset = RLDataSet(
+                    episodes=batch_episodes,
+                    sensitive_attrs=sensitive_attrs[batch_start:batch_end],
+                    num_datapoints=len(batch_episodes),
+                    meta_information=self.candidate_dataset.meta_information,
+                )
+            self.batch_datasets.append(batch_dataset)
+
+        self.batch_datasets_size = batch_size
+
+    def get_batch_state(self):
+        """The state needed to visit the batches in the same order
+        after resuming gradient descent from a checkpoint
+
+        :rtype: dict
+        """
+        return {
+            "batch_datasets_size": self.batch_datasets_size,
+            "batch_rng_rows_state": self.batch_rng_rows_state,
+            "batch_rng_state": copy.deepcopy(self.batch_rng.bit_generator.state),
+            "batch_order": self.batch_order,
+        }
+
+    def set_batch_state(self, state):
+        """Restore the state from :py:meth:`get_batch_state`,
+        remaking the batch datasets with the same rows
+
+        :param state: The state of the batches
+        :type state: dict
+        """
+        if state["batch_datasets_size"] is not None:
+            self.batch_rng.bit_generator.state = state["batch_rng_rows_state"]
+            self.make_batch_datasets(state["batch_datasets_size"])
+        self.batch_rng.bit_generator.state = state["batch_rng_state"]
+        self.batch_order = state["batch_order"]
+
     def run(self, **kwargs):
         """Run candidate selection
 
         :return: Optimized model weights or 'NSF'
         :rtype: array or str
         """
+        if (
+            self.optimization_technique == "gradient_descent"
+            and kwargs.get("n_starts", 1) > 1
+        ):
+            return self.run_multistart(**kwargs)
+
         if self.optimization_technique == "gradient_descent":
             if self.optimizer != "adam":
                 raise NotImplementedError(
@@ -181,6 +288,10 @@ class CandidateSelection(object):
 
             if kwargs["use_batches"] == True:
                 batch_size = kwargs["batch_size"]
+                if "shuffle_batches" in kwargs:
+                    self.shuffle_batches = kwargs["shuffle_batches"]
+                if "seed" in kwargs:
+                    self.batch_rng = np.random.default_rng(kwargs["seed"])
                 n_batches = math.ceil(
                     self.candidate_dataset.num_datapoints / batch_size
                 )
@@ -213,6 +324,28 @@ class CandidateSelection(object):
                 verbose=kwargs["verbose"],
                 debug=kwargs["debug"],
             )
+            # Option to evaluate f and g separately from their gradients
+            if "fused_gradients" in kwargs:
+                gd_kwargs["fused_gradients"] = kwargs["fused_gradients"]
+            # Options for the history of the optimization
+            # and for stopping before n_epochs are done
+            for key in [
+                "history",
+                "history_every",
+                "history_size",
+                "history_theta",
+                "history_logfile",
+                "tol_grad_norm",
+                "tol_rel_L",
+                "patience",
+                "checkpoint_file",
+                "checkpoint_every",
+                "resume",
+            ]:
+                if key in kwargs:
+                    gd_kwargs[key] = kwargs[key]
+            gd_kwargs["checkpoint_extra"] = (self.get_batch_state, self.set_batch_state)
+
             # Option to use builtin primary gradient (could be faster than autograd)
             if "use_builtin_primary_gradient_fn" in kwargs:
                 if kwargs["use_builtin_primary_gradient_fn"] == True:
@@ -272,21 +405,7 @@ class CandidateSelection(object):
             res["n_epochs"] = n_epochs
 
             if self.write_logfile:
-                log_counter = 0
-                logdir = os.path.join(os.getcwd(), "logs")
-                os.makedirs(logdir, exist_ok=True)
-                filename = os.path.join(
-                    logdir, f"candidate_selection_log{log_counter}.p"
-                )
-
-                while os.path.exists(filename):
-                    filename = filename.replace(
-                        f"log{log_counter}", f"log{log_counter+1}"
-                    )
-                    log_counter += 1
-                with open(filename, "wb") as outfile:
-                    pickle.dump(res, outfile)
-                    print(f"Wrote {filename} with candidate selection log info")
+                self.write_optimization_log(res)
 
             candidate_solution = res["candidate_solution"]
 
@@ -335,15 +454,185 @@ class CandidateSelection(object):
                 f"Optimization technique: {self.optimization_technique} is not implemented"
             )
 
-        # Reset parse tree base node dicts,
-        # including data and datasize attributes
-        for pt in self.parse_trees:
-            pt.reset_base_node_dict(reset_data=True)
-
-        # Unset data and datasize on base nodes
+        self.release_data()
         # Return the candidate solution we believe will pass the safety test
         return candidate_solution
 
+    def run_multistart(
+        self,
+        n_starts,
+        start_scale=0.1,
+        start_hyperparams=None,
+        n_workers=1,
+        **kwargs,
+    ):
+        """Run gradient descent from several starting points
+        and keep the best candidate solution. Called by :py:meth:`run`
+        when the optimization hyperparameters contain n_starts > 1.
+
+        The first start uses self.initial_solution and the others
+        perturb it with Gaussian noise. Each start can also override
+        some of the optimization hyperparameters, e.g., alpha_theta or
+        lambda_init. With n_workers > 1 the starts run in a pool of
+        forked processes, which share the candidate data with this one.
+        On platforms that can't fork processes they run in this one.
+
+        The candidate solutions of all starts are evaluated on the
+        full candidate dataset. The one with the lowest primary objective
+        among those predicted to pass the safety test
+        (all constraint upper bounds <= 0) is returned. If there is none,
+        the one with the lowest norm of the upper bounds is returned.
+
+        :param n_starts: The number of starting points
+        :type n_starts: int
+        :param start_scale: The standard deviation of the noise
+                added to the initial solution for each start but the first
+        :type start_scale: float
+        :param start_hyperparams: Optimization hyperparameters
+                overriding kwargs, one dict per start. Reused cyclically
+                if there are fewer dicts than starts.
+        :type start_hyperparams: List(dict)
+        :param n_workers: The number of worker processes
+        :type n_workers: int
+
+        :return: Optimized model weights or 'NSF'
+        :rtype: array or str
+        """
+        # One stream for the perturbations, one per start
+        # for the order of the batches
+        seed_sequences = np.random.SeedSequence(kwargs.get("seed")).spawn(
+            n_starts + 1
+        )
+        rng = np.random.default_rng(seed_sequences[0])
+        initial_solution = self.initial_solution
+        # Gradient descent updates theta in place, so every start
+        # gets its own copy and initial_solution is left as it was
+        theta_init = np.array(initial_solution, dtype=float, copy=True)
+
+        starts = []
+        for start_index in range(n_starts):
+            start_kwargs = dict(kwargs)
+            if start_hyperparams:
+                start_kwargs.update(
+                    start_hyperparams[start_index % len(start_hyperparams)]
+                )
+            if "seed" in kwargs:
+                start_kwargs["seed"] = seed_sequences[start_index + 1]
+            if "checkpoint_file" in kwargs:
+                root, ext = os.path.splitext(kwargs["checkpoint_file"])
+                start_kwargs["checkpoint_file"] = f"{root}_start{start_index}{ext}"
+            if start_index == 0:
+                start_theta = theta_init.copy()
+            else:
+                start_theta = theta_init + start_scale * rng.normal(
+                    size=theta_init.shape
+                )
+            starts.append((start_theta, start_kwargs))
+
+        # Only the chosen result is written to the log
+        write_logfile = self.write_logfile
+        self.write_logfile = False
+        results = [None] * n_starts
+        mp_context = get_fork_context(n_workers)
+        try:
+            if mp_context is not None:
+                with ProcessPoolExecutor(
+                    max_workers=n_workers,
+                    mp_context=mp_context,
+                    initializer=_init_multistart_worker,
+                    initargs=(self, starts),
+                ) as ex:
+                    futures = {
+                        ex.submit(_run_start, start_index): start_index
+                        for start_index in range(n_starts)
+                    }
+                    for future in as_completed(futures):
+                        results[futures[future]] = future.result()
+            else:
+                _init_multistart_worker(self, starts)
+                for start_index in range(n_starts):
+                    results[start_index] = _run_start(start_index)
+        finally:
+            _multistart_worker_state.clear()
+            self.write_logfile = write_logfile
+            self.initial_solution = initial_solution
+
+        # Compare the solutions on the full candidate dataset
+        self.calculate_batches(
+            batch_index=0, batch_size=self.candidate_dataset.num_datapoints
+        )
+        f_vals = np.full(n_starts, np.inf)
+        g_vals = np.full((n_starts, len(self.parse_trees)), np.inf)
+        for start_index, res in enumerate(results):
+            if isinstance(res["candidate_solution"], str):
+                # NSF
+                continue
+            f_vals[start_index] = self.evaluate_primary_objective(
+                res["candidate_solution"]
+            )
+            g_vals[start_index] = self.get_constraint_upper_bounds(
+                res["candidate_solution"]
+            )
+        f_vals[np.isnan(f_vals)] = np.inf
+        g_vals[np.isnan(g_vals)] = np.inf
+
+        feasible = np.all(g_vals <= 0, axis=1)
+        if np.any(feasible):
+            best_start = np.flatnonzero(feasible)[np.argmin(f_vals[feasible])]
+        else:
+            best_start = np.argmin(np.linalg.norm(g_vals, axis=1))
+
+        res = results[best_start]
+        res["start_index"] = int(best_start)
+        res["start_f_vals"] = f_vals
+        res["start_g_vals"] = g_vals
+        self.optimization_result = res
+        if self.write_logfile:
+            self.write_optimization_log(res)
+
+        self.release_data()
+        return res["candidate_solution"]
+
+    def write_optimization_log(self, res):
+        """Pickle the result of gradient descent to
+        the first unused logs/candidate_selection_log{N}.p file
+        in the current working directory
+
+        :param res: The result of gradient descent
+        :type res: dict
+        """
+        log_counter = 0
+        logdir = os.path.join(os.getcwd(), "logs")
+        os.makedirs(logdir, exist_ok=True)
+        filename = os.path.join(logdir, f"candidate_selection_log{log_counter}.p")
+
+        while os.path.exists(filename):
+            filename = filename.replace(f"log{log_counter}", f"log{log_counter+1}")
+            log_counter += 1
+        with open(filename, "wb") as outfile:
+            pickle.dump(res, outfile)
+            print(f"Wrote {filename} with candidate selection log info")
+
+    def release_data(self):
+        """Reset parse tree base node dicts,
+        including data and datasize attributes, and release
+        the batches and the candidate dataset, along with
+        the masked data and (RL) features cached for them,
+        and the estimates and predictions cached for the last theta
+        """
+        for pt in self.parse_trees:
+            pt.reset_base_node_dict(reset_data=True)
+        self.batch_dataset = None
+        self.batch_datasets = None
+        self.batch_features = None
+        self.batch_labels = None
+        self.batch_sensitive_attrs = None
+        self.candidate_dataset.clear_masked_data_cache()
+        if hasattr(self.model, "clear_features_cache"):
+            self.model.clear_features_cache()
+        self.base_node_registry.reset()
+        objectives.prediction_cache.clear()
+
     def objective_with_barrier(self, theta):
         """The objective function to be optimized if
         minimization_technique == 'barrier'. Adds in a
@@ -379,6 +668,7 @@ class CandidateSelection(object):
         # Prediction of what the safety test will return.
         # Initialized to pass
         predictSafetyTest = True
+        self.base_node_registry.reset()
         for tree_i, pt in enumerate(self.parse_trees):
             # before we propagate, reset the bounds on all base nodes
             pt.reset_base_node_dict()
@@ -390,6 +680,7 @@ class CandidateSelection(object):
                 branch="candidate_selection",
                 n_safety=self.n_safety,
                 regime=self.regime,
+                base_node_registry=self.base_node_registry,
             )
 
             pt.propagate_bounds(**bounds_kwargs)
@@ -469,6 +760,7 @@ class CandidateSelection(object):
         """
 
         upper_bounds = []
+        self.base_node_registry.reset()
 
         for pt in self.parse_trees:
             pt.reset_base_node_dict()
@@ -480,9 +772,27 @@ class CandidateSelection(object):
                 branch="candidate_selection",
                 n_safety=self.n_safety,
                 regime=self.regime,
+                base_node_registry=self.base_node_registry,
             )
 
             pt.propagate_bounds(**bounds_kwargs)
             upper_bounds.append(pt.root.upper)
 
         return np.array(upper_bounds, dtype="float")
+
+
+def _init_multistart_worker(candidate_selection, starts):
+    """Keep the candidate selection object and the starts in
+    the worker process. With fork they are inherited, not pickled"""
+    _multistart_worker_state["candidate_selection"] = candidate_selection
+    _multistart_worker_state["starts"] = starts
+
+
+def _run_start(start_index):
+    """Run gradient descent from one of the starts
+    and return the result"""
+    cs = _multistart_worker_state["candidate_selection"]
+    start_theta, start_kwargs = _multistart_worker_state["starts"][start_index]
+    cs.initial_solution = start_theta
+    cs.run(**start_kwargs)
+    return cs.optimization_result
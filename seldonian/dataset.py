@@ -1,9 +1,13 @@
 """ Build and load datasets for running Seldonian algorithms """
 
+import os
 import autograd.numpy as np
 import pandas as pd
 import pickle
-from seldonian.utils.io_utils import load_json, load_pickle
+from seldonian.utils.io_utils import load_json, load_pickle, save_json
+
+# Columns of an EpisodeStore, in the order of its constructor
+episode_columns = ["observations", "actions", "rewards", "action_probs"]
 
 
 class DataSetLoader:
@@ -16,9 +20,25 @@ class DataSetLoader:
         """
         self.regime = regime
 
-    def load_supervised_dataset(self, filename, metadata_filename, file_type="csv"):
+    def load_supervised_dataset(
+        self, filename, metadata_filename, file_type="csv", feature_dtype=None
+    ):
         """Create SupervisedDataSet object from file
 
+        Supported file types:
+
+        - 'csv': The columns in metadata["all_col_names"], without a header.
+          Dtypes of columns can be given in metadata["dtypes"],
+          a dictionary mapping column names to dtypes
+        - 'npy': A 2D array whose columns are metadata["all_col_names"].
+          The array is memory-mapped and the features, labels and
+          sensitive attributes are views into it if their columns
+          are contiguous
+        - 'npz': An archive with the arrays "features", "labels"
+          and, if there are sensitive columns, "sensitive_attrs"
+        - 'parquet': The columns in metadata["all_col_names"].
+          Requires pyarrow or fastparquet
+
         :param filename: The file
                 containing the features, labels and sensitive attributes
         :type filename: str
@@ -27,6 +47,10 @@ class DataSetLoader:
         :type metadata_filename: str
         :param file_type: the file extension of filename
         :type file_type: str, defaults to 'csv'
+        :param feature_dtype: If given, the dtype of the features,
+                e.g. 'float32'. Converting them makes a copy if their
+                dtype is different
+        :type feature_dtype: str
         """
         # Load metadata
         (
@@ -45,18 +69,44 @@ class DataSetLoader:
         meta_information["sensitive_col_names"] = sensitive_col_names
         meta_information["sub_regime"] = sub_regime
 
-        if file_type.lower() == "csv":
-            df = pd.read_csv(filename, header=None, names=all_col_names)
+        file_type = file_type.lower()
+        if file_type in ["csv", "parquet"]:
+            dtypes = load_json(metadata_filename).get("dtypes", None)
+            if file_type == "csv":
+                df = pd.read_csv(
+                    filename, header=None, names=all_col_names, dtype=dtypes
+                )
+            else:
+                df = pd.read_parquet(filename, columns=all_col_names)
+                if dtypes:
+                    df = df.astype(dtypes)
             # separate out features, labels, and sensitive attrs
             features = df.loc[:, feature_col_names].values
-            labels = np.squeeze(
-                df.loc[:, label_col_names].values
-            )  # converts shape from (N,1) -> (N,) if only a single label column.
+            labels = df.loc[:, label_col_names].values
             sensitive_attrs = df.loc[:, sensitive_col_names].values
-            num_datapoints = len(df)
+        elif file_type == "npy":
+            table = np.load(filename, mmap_mode="r")
+            features, labels, sensitive_attrs = [
+                get_columns(table, [all_col_names.index(col) for col in col_names])
+                for col_names in [feature_col_names, label_col_names, sensitive_col_names]
+            ]
+        elif file_type == "npz":
+            with np.load(filename) as archive:
+                features = archive["features"]
+                labels = archive["labels"]
+                if sensitive_col_names:
+                    sensitive_attrs = archive["sensitive_attrs"]
+                else:
+                    sensitive_attrs = np.zeros((len(labels), 0))
         else:
             raise NotImplementedError(f"File type: {file_type} not supported")
 
+        if feature_dtype is not None:
+            features = features.astype(feature_dtype, copy=False)
+        # converts shape from (N,1) -> (N,) if only a single label column.
+        labels = np.squeeze(labels)
+        num_datapoints = len(labels)
+
         return SupervisedDataSet(
             features=features,
             labels=labels,
@@ -65,19 +115,33 @@ class DataSetLoader:
             meta_information=meta_information,
         )
 
-    def load_RL_dataset_from_csv(self, filename, metadata_filename=None):
+    def load_RL_dataset_from_csv(
+        self, filename, metadata_filename=None, dtype=None, chunksize=None
+    ):
         """Create RLDataSet object from file
         containing the episodes as a CSV with format:
         episode_index,obs,action,reward,probability_of_action.
 
+        The rows are grouped by episode in a single pass, keeping the
+        order in which the episodes first appear, and the episodes
+        are stored in an :py:class:`.EpisodeStore`.
+
         :param filename: The file
                 containing the data you want to load
         :type filename: str
         :param metadata_filename: Name of metadata file
         :type metadata_filename: str
+        :param dtype: Column name to dtype, overriding the defaults
+                of int64 for the episode index and float64 for the
+                reward and action probability. The other dtypes are inferred
+        :type dtype: dict
+        :param chunksize: If given, read the file in chunks of
+                this many rows to reduce peak memory
+        :type chunksize: int
         """
 
         # Load metadata
+        metadata_dict = {}
         if metadata_filename:
             metadata_dict = load_json(metadata_filename)
             column_names = metadata_dict["columns"]
@@ -92,19 +156,36 @@ class DataSetLoader:
         else:
             meta_information["sensitive_col_names"] = []
 
-        df = pd.read_csv(filename, header=None)
-        df.columns = column_names
-        episodes = []
-
-        for episode_index in df.episode_index.unique():
-            df_ep = df.loc[df.episode_index == episode_index]
-            episode = Episode(
-                observations=df_ep.iloc[:, 1].values,
-                actions=df_ep.iloc[:, 2].values,
-                rewards=df_ep.iloc[:, 3].values,
-                action_probs=df_ep.iloc[:, 4].values,
-            )
-            episodes.append(episode)
+        column_dtypes = {
+            column_names[0]: "int64",
+            column_names[3]: "float64",
+            column_names[4]: "float64",
+        }
+        if dtype is not None:
+            column_dtypes.update(dtype)
+
+        reader = pd.read_csv(
+            filename,
+            header=None,
+            names=column_names,
+            dtype=column_dtypes,
+            chunksize=chunksize,
+        )
+        chunks = [reader] if chunksize is None else reader
+        columns = [[] for _ in range(5)]
+        for df in chunks:
+            for ii in range(5):
+                columns[ii].append(df.iloc[:, ii].values)
+        columns = [np.concatenate(column) for column in columns]
+
+        # Rows of each episode, in order of first appearance
+        codes, _ = pd.factorize(columns[0])
+        if np.any(np.diff(codes) < 0):
+            order = np.argsort(codes, kind="stable")
+            columns = [column[order] for column in columns]
+        lengths = np.bincount(codes)
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+        episodes = EpisodeStore(*columns[1:], offsets)
 
         return RLDataSet(episodes=episodes, meta_information=meta_information)
 
@@ -112,11 +193,15 @@ class DataSetLoader:
         """Create RLDataSet object from file
 
         :param filename: The file
-                containing the pickled lists of :py:class:`.Episode` objects
+                containing the pickled lists of :py:class:`.Episode` objects,
+                or a directory written by :py:class:`.EpisodeWriter`,
+                whose columns are memory-mapped rather than read into memory
         :type filename: str
         """
-
-        episodes = load_pickle(filename)
+        if os.path.isdir(filename):
+            episodes = EpisodeStore.from_directory(filename)
+        else:
+            episodes = load_pickle(filename)
         return RLDataSet(episodes=episodes)
 
 
@@ -135,6 +220,53 @@ class DataSet(object):
         self.num_datapoints = num_datapoints
         self.meta_information = meta_information
         self.regime = regime
+        # Row indices and masked data for each
+        # combination of conditional columns
+        self.conditional_indices_cache = {}
+        self.masked_data_cache = {}
+
+    def get_conditional_indices(self, conditional_columns):
+        """Get the rows (episodes for RL) where each of
+        the conditional columns is 1. Computed once per
+        combination of conditional columns and then cached.
+
+        :param conditional_columns:
+            List of columns for which to create
+            the joint AND mask on the dataset
+        :type conditional_columns: List(str)
+
+        :return: The selected rows. A slice if they are contiguous,
+            otherwise a sorted array of row indices
+        """
+        if not hasattr(self, "conditional_indices_cache"):
+            # e.g., a dataset pickled before these caches existed
+            self.conditional_indices_cache = {}
+            self.masked_data_cache = {}
+
+        key = tuple(conditional_columns)
+        if key not in self.conditional_indices_cache:
+            # Figure out indices of sensitive attributes from their column names
+            sensitive_col_indices = [
+                self.sensitive_col_names.index(col) for col in conditional_columns
+            ]
+            joint_mask = np.all(
+                self.sensitive_attrs[:, sensitive_col_indices] == 1, axis=1
+            )
+            indices = np.flatnonzero(joint_mask)
+            if len(indices) > 0 and indices[-1] - indices[0] + 1 == len(indices):
+                # Slicing gives views rather than copies
+                indices = slice(indices[0], indices[-1] + 1)
+            self.conditional_indices_cache[key] = indices
+
+        return self.conditional_indices_cache[key]
+
+    def clear_masked_data_cache(self):
+        """Drop the masked data cached by get_masked_data(),
+        e.g., once candidate selection or the safety test
+        is done with them. The row indices of each combination
+        of conditional columns are kept.
+        """
+        self.masked_data_cache = {}
 
 
 class SupervisedDataSet(DataSet):
@@ -165,6 +297,42 @@ class SupervisedDataSet(DataSet):
         self.n_labels = len(self.label_col_names)
         self.n_sensitive_attrs = len(self.sensitive_col_names)
 
+    def get_masked_data(self, conditional_columns):
+        """Get the features and labels of the rows where
+        each of the conditional columns is 1. The masked
+        data are computed once per combination of conditional columns
+        and the same arrays are handed out on every call,
+        so they must not be modified.
+
+        :param conditional_columns:
+            List of columns for which to create
+            the joint AND mask on the dataset
+        :type conditional_columns: List(str)
+
+        :return: masked_features, masked_labels, n_masked
+        """
+        indices = self.get_conditional_indices(conditional_columns)
+        key = tuple(conditional_columns)
+        if key not in self.masked_data_cache:
+            masked_labels = self.labels[indices]
+            if type(self.features) == list:
+                masked_features = [x[indices] for x in self.features]
+                # If possible, convert to numpy array. Not always possible,
+                # e.g., if features are of different dimensions.
+                try:
+                    masked_features = np.array(masked_features)
+                    n_masked = len(masked_features)
+                except Exception as e:
+                    # masked_features stay as a list
+                    n_masked = len(masked_features[0])
+            else:
+                # numpy array
+                masked_features = self.features[indices]
+                n_masked = len(masked_features)
+            self.masked_data_cache[key] = (masked_features, masked_labels, n_masked)
+
+        return self.masked_data_cache[key]
+
 
 class RLDataSet(DataSet):
     def __init__(
@@ -179,13 +347,21 @@ class RLDataSet(DataSet):
     ):
         """Object for holding RL dataframe and dataset metadata
 
-        :param episodes: List of episodes
-        :type episodes: list(:py:class:`.Episode`)
+        :param episodes: Episodes, converted to an
+                :py:class:`.EpisodeStore` if given as a list
+        :type episodes: list(:py:class:`.Episode`) or :py:class:`.EpisodeStore`
         :param meta_information: List of attribute names in each Episode,
                 e.g. ['o','a','r','pi_b']
         :type meta_information: list(str)
         """
 
+        if not isinstance(episodes, EpisodeStore):
+            try:
+                episodes = EpisodeStore.from_episodes(episodes)
+            except (ValueError, AttributeError):
+                # e.g., observations of different shapes or episodes
+                # pickled with other attribute names. Keep the list
+                pass
         self.episodes = episodes
         self.sensitive_attrs = sensitive_attrs
         self.sensitive_col_names = meta_information["sensitive_col_names"]
@@ -195,6 +371,29 @@ class RLDataSet(DataSet):
             regime="reinforcement_learning",
         )
 
+    def get_masked_data(self, conditional_columns):
+        """Get the episodes where each of the conditional columns is 1.
+        The masked episodes are computed once per combination
+        of conditional columns and then cached.
+
+        :param conditional_columns:
+            List of columns for which to create
+            the joint AND mask on the dataset
+        :type conditional_columns: List(str)
+
+        :return: masked_episodes, n_masked
+        """
+        indices = self.get_conditional_indices(conditional_columns)
+        key = tuple(conditional_columns)
+        if key not in self.masked_data_cache:
+            if isinstance(self.episodes, EpisodeStore):
+                masked_episodes = self.episodes[indices]
+            else:
+                masked_episodes = np.asarray(self.episodes)[indices]
+            self.masked_data_cache[key] = (masked_episodes, len(masked_episodes))
+
+        return self.masked_data_cache[key]
+
 
 class Episode(object):
     def __init__(self, observations, actions, rewards, action_probs):
@@ -222,6 +421,315 @@ class Episode(object):
         )
 
 
+class EpisodeStore(object):
+    def __init__(self, observations, actions, rewards, action_probs, offsets):
+        """Columnar container for RL episodes. The timesteps of all episodes
+        are concatenated into one array per attribute and episode i
+        consists of timesteps offsets[i] to offsets[i+1].
+
+        Behaves like a list of :py:class:`.Episode` objects:
+        indexing with an integer gives an Episode whose arrays are views
+        into the store, and iterating yields such Episodes.
+        Indexing with a slice gives a store sharing the same arrays
+        (without copying), and indexing with an array of indices or
+        a boolean mask gives a store with the selected episodes.
+
+        :param observations: Observations of all timesteps
+        :param actions: Actions of all timesteps
+        :param rewards: Rewards of all timesteps
+        :param action_probs: Action probabilities from the
+                behavior policy of all timesteps
+        :param offsets: Timestep at which each episode starts,
+                followed by the total number of timesteps
+        :type offsets: numpy ndarray(int)
+        """
+        self.observations = observations
+        self.actions = actions
+        self.rewards = rewards
+        self.action_probs = action_probs
+        self.offsets = offsets
+
+    @classmethod
+    def from_episodes(cls, episodes):
+        """Make an EpisodeStore from a list of :py:class:`.Episode` objects
+
+        :param episodes: List of episodes
+        :type episodes: list(:py:class:`.Episode`)
+        """
+        episodes = list(episodes)
+        lengths = [len(ep.rewards) for ep in episodes]
+        offsets = np.concatenate([[0], np.cumsum(lengths, dtype=int)]).astype(int)
+        columns = []
+        for attr in episode_columns:
+            if len(episodes) == 0:
+                columns.append(np.array([]))
+            else:
+                columns.append(
+                    np.concatenate([np.asarray(getattr(ep, attr)) for ep in episodes])
+                )
+        return cls(*columns, offsets)
+
+    @classmethod
+    def concatenate(cls, stores):
+        """Make one EpisodeStore holding the episodes of several, in order
+
+        :param stores: The stores to concatenate
+        :type stores: list(:py:class:`.EpisodeStore`)
+        """
+        offsets = [np.zeros(1, dtype=int)]
+        n_timesteps = 0
+        for store in stores:
+            offsets.append(store.offsets[1:] + n_timesteps)
+            n_timesteps += store.offsets[-1]
+        columns = [
+            np.concatenate([getattr(store, attr) for store in stores])
+            for attr in episode_columns
+        ]
+        return cls(*columns, np.concatenate(offsets).astype(int))
+
+    @classmethod
+    def from_directory(cls, dirname, mmap=True):
+        """Open the episodes written to a directory
+        by :py:class:`.EpisodeWriter`
+
+        :param dirname: The directory
+        :type dirname: str
+        :param mmap: Whether to memory-map the columns (read-only)
+                rather than read them into memory
+        :type mmap: bool, defaults to True
+        """
+        header = load_json(os.path.join(dirname, EpisodeWriter.header_filename))
+        n_timesteps = header["n_timesteps"]
+        columns = []
+        for attr in episode_columns + ["offsets"]:
+            column_filename = os.path.join(dirname, f"{attr}.bin")
+            dtype = header["dtypes"][attr]
+            if attr == "offsets":
+                shape = (header["n_episodes"] + 1,)
+            else:
+                shape = (n_timesteps,) + tuple(header["shapes"][attr])
+            if mmap and n_timesteps > 0:
+                column = np.memmap(column_filename, dtype=dtype, mode="r", shape=shape)
+            else:
+                column = np.fromfile(
+                    column_filename, dtype=dtype, count=int(np.prod(shape))
+                ).reshape(shape)
+            columns.append(column)
+        return cls(*columns)
+
+    def save(self, dirname):
+        """Write the episodes to a directory with
+        :py:class:`.EpisodeWriter`
+
+        :param dirname: The directory
+        :type dirname: str
+        """
+        with EpisodeWriter(dirname) as writer:
+            writer.append(self)
+
+    @property
+    def lengths(self):
+        """Number of timesteps in each episode"""
+        return np.diff(self.offsets)
+
+    @property
+    def episode_index(self):
+        """Index of the episode each timestep belongs to"""
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    @property
+    def time_index(self):
+        """Index of each timestep within its episode"""
+        return np.arange(self.offsets[-1]) - np.repeat(self.offsets[:-1], self.lengths)
+
+    def to_episodes(self):
+        """List of :py:class:`.Episode` objects (views into the store)"""
+        return list(self)
+
+    def _get_episode(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        # Bypass Episode.__init__, which would copy the arrays
+        episode = Episode.__new__(Episode)
+        episode.observations = self.observations[start:end]
+        episode.actions = self.actions[start:end]
+        episode.rewards = self.rewards[start:end]
+        episode.action_probs = self.action_probs[start:end]
+        return episode
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._get_episode(index)
+
+    def __getitem__(self, key):
+        n_episodes = len(self)
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += n_episodes
+            if not 0 <= key < n_episodes:
+                raise IndexError(f"Episode index {key} out of range")
+            return self._get_episode(key)
+
+        if isinstance(key, slice):
+            start, stop, step = key.indices(n_episodes)
+            if step == 1:
+                stop = max(start, stop)
+                t_start, t_stop = self.offsets[start], self.offsets[stop]
+                return EpisodeStore(
+                    self.observations[t_start:t_stop],
+                    self.actions[t_start:t_stop],
+                    self.rewards[t_start:t_stop],
+                    self.action_probs[t_start:t_stop],
+                    self.offsets[start : stop + 1] - t_start,
+                )
+
+        # Fancy indexing, boolean mask or strided slice
+        indices = np.arange(n_episodes)[key]
+        lengths = self.lengths[indices]
+        offsets = np.concatenate([[0], np.cumsum(lengths, dtype=int)]).astype(int)
+        timesteps = np.repeat(self.offsets[indices] - offsets[:-1], lengths) + np.arange(
+            offsets[-1]
+        )
+        return EpisodeStore(
+            self.observations[timesteps],
+            self.actions[timesteps],
+            self.rewards[timesteps],
+            self.action_probs[timesteps],
+            offsets,
+        )
+
+
+class EpisodeWriter(object):
+    header_filename = "episodes.json"
+
+    def __init__(self, dirname):
+        """Writes episodes to disk as they are produced, in the columnar
+        layout of :py:class:`.EpisodeStore`. Each column is appended to
+        a flat binary file in dirname, next to a file with the offsets
+        of the episodes and a JSON header with the dtypes and shapes.
+        The directory can be opened (memory-mapped) with
+        :py:meth:`.EpisodeStore.from_directory`.
+
+        The dtypes and per-timestep shapes are those of the
+        first episodes written. Can be used as a context manager,
+        which closes the writer at the end of the block, or aborts
+        it if the block raises an exception.
+
+        The columns are written to temporary files, which replace
+        the files of any episodes already in the directory on
+        :py:meth:`close`, or are deleted on :py:meth:`abort`.
+        Stores still memory-mapping the old files remain valid.
+
+        :param dirname: The directory to write to. Created if it
+                does not exist, and existing episodes in it are overwritten
+        :type dirname: str
+        """
+        os.makedirs(dirname, exist_ok=True)
+        self.dirname = dirname
+        self.n_episodes = 0
+        self.n_timesteps = 0
+        self.dtypes = None
+        self.shapes = None
+        self.files = {
+            attr: open(os.path.join(dirname, f"{attr}.bin.partial"), "wb")
+            for attr in episode_columns + ["offsets"]
+        }
+        np.zeros(1, dtype="int64").tofile(self.files["offsets"])
+
+    def append(self, episodes):
+        """Write episodes
+
+        :param episodes: An episode or episodes
+        :type episodes: :py:class:`.Episode`, list(:py:class:`.Episode`)
+                or :py:class:`.EpisodeStore`
+        """
+        if isinstance(episodes, Episode):
+            episodes = [episodes]
+        if not isinstance(episodes, EpisodeStore):
+            episodes = EpisodeStore.from_episodes(episodes)
+        if len(episodes) == 0:
+            return
+
+        if self.dtypes is None:
+            self.dtypes = {"offsets": "int64"}
+            self.shapes = {}
+            for attr in episode_columns:
+                column = np.asarray(getattr(episodes, attr))
+                if column.dtype == object:
+                    raise ValueError(f"Cannot write {attr} of dtype object")
+                self.dtypes[attr] = column.dtype.str
+                self.shapes[attr] = list(column.shape[1:])
+
+        # Check all columns before writing any, so that
+        # the files stay consistent if one doesn't match
+        columns = {attr: np.asarray(getattr(episodes, attr)) for attr in episode_columns}
+        for attr, column in columns.items():
+            if list(column.shape[1:]) != self.shapes[attr]:
+                raise ValueError(
+                    f"{attr} have shape {column.shape[1:]} per timestep, "
+                    f"but shape {tuple(self.shapes[attr])} was written before"
+                )
+        for attr, column in columns.items():
+            np.ascontiguousarray(column, dtype=self.dtypes[attr]).tofile(
+                self.files[attr]
+            )
+        offsets = np.asarray(episodes.offsets[1:], dtype="int64") + self.n_timesteps
+        offsets.tofile(self.files["offsets"])
+        self.n_episodes += len(episodes)
+        self.n_timesteps += int(episodes.offsets[-1])
+
+    def abort(self):
+        """Delete the columns written so far, leaving any
+        episodes already in the directory as they were"""
+        for attr, f in self.files.items():
+            f.close()
+            partial_filename = os.path.join(self.dirname, f"{attr}.bin.partial")
+            if os.path.exists(partial_filename):
+                os.remove(partial_filename)
+
+    def close(self):
+        """Move the columns in place and write the header"""
+        for attr, f in self.files.items():
+            f.close()
+            filename = os.path.join(self.dirname, f"{attr}.bin")
+            os.replace(f"{filename}.partial", filename)
+        header = {
+            "n_episodes": self.n_episodes,
+            "n_timesteps": self.n_timesteps,
+            "dtypes": self.dtypes
+            or dict({attr: "<f8" for attr in episode_columns}, offsets="int64"),
+            "shapes": self.shapes or {attr: [] for attr in episode_columns},
+        }
+        save_json(os.path.join(self.dirname, self.header_filename), header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def get_columns(table, indices):
+    """Get columns of a 2D array, as a view
+    if the columns are contiguous
+
+    :param table: The array
+    :type table: numpy ndarray
+    :param indices: Indices of the columns, in order
+    :type indices: list(int)
+    """
+    if len(indices) > 0 and list(indices) == list(
+        range(indices[0], indices[0] + len(indices))
+    ):
+        return table[:, indices[0] : indices[0] + len(indices)]
+    return table[:, indices]
+
+
 def load_supervised_metadata(filename):
     """Load metadata from JSON file into a dictionary
 
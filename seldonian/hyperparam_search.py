@@ -4,10 +4,35 @@ from sklearn.model_selection import train_test_split
 import autograd.numpy as np
 
 import warnings
-from seldonian.dataset import SupervisedDataSet, RLDataSet
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from seldonian.dataset import SupervisedDataSet, RLDataSet, EpisodeStore
 from seldonian.candidate_selection.candidate_selection import CandidateSelection
 from seldonian.safety_test.safety_test import SafetyTest
 from seldonian.models import objectives
+from seldonian.utils.stats_utils import diff_proportion_interval
+from seldonian.utils.parallel_utils import get_fork_context
+
+# Set once in each worker process by _init_bootstrap_worker()
+_bootstrap_worker_state = {}
+
+
+def _init_bootstrap_worker(hyperparam_search, all_trial_kwargs):
+    """Store the search object (including the spec) and the
+    arguments of the bootstrap trials of each estimate in the worker,
+    so that they are not sent again with every trial
+    """
+    _bootstrap_worker_state["hyperparam_search"] = hyperparam_search
+    _bootstrap_worker_state["all_trial_kwargs"] = all_trial_kwargs
+
+
+def _run_bootstrap_trial_in_worker(estimate_index, trial_seed):
+    """Run a single bootstrap trial of one of the estimates
+    in a worker process using the state stored by _init_bootstrap_worker()"""
+    hyperparam_search = _bootstrap_worker_state["hyperparam_search"]
+    return hyperparam_search.run_bootstrap_trial(
+        trial_seed, **_bootstrap_worker_state["all_trial_kwargs"][estimate_index]
+    )
 
 
 class HyperparamSearch:
@@ -180,7 +205,11 @@ class HyperparamSearch:
             )
 
         elif self.regime == "reinforcement_learning":
-            bs_episodes = np.random.choice(dataset.episodes, n_bootstrap)
+            bs_indices = np.random.choice(len(dataset.episodes), n_bootstrap)
+            if isinstance(dataset.episodes, EpisodeStore):
+                bs_episodes = dataset.episodes[bs_indices]
+            else:
+                bs_episodes = [dataset.episodes[ii] for ii in bs_indices]
             bs_dataset = RLDataSet(
                 episodes=bs_episodes, meta_information=self.column_names
             )
@@ -382,10 +411,41 @@ class HyperparamSearch:
 
         return passed_safety, solution
 
-    def find_best_hyperparams(self, write_cs_logfile=False, debug=False):
+    def find_best_hyperparams(
+        self,
+        write_cs_logfile=False,
+        debug=False,
+        n_workers=1,
+        seed=None,
+        bootstrap_iter=100,
+        sequential=False,
+        sequential_batch_iter=10,
+        sequential_confidence=0.95,
+    ):
         """Find the best hyperparameter values to use for the Seldonian algorithm.
         Note: currently only implemented for frac_data_in_safety.
 
+        :param n_workers: Number of processes to use to run the
+                bootstrap trials of each probability estimate
+        :type n_workers: int
+        :param seed: Seed from which the seeds of all bootstrap trials are derived.
+                If None, it is drawn from numpy's global random state
+        :type seed: int
+        :param bootstrap_iter: (Maximum) number of bootstrap trials
+                per probability estimate
+        :type bootstrap_iter: int
+        :param sequential: Whether to compare the probabilities of passing
+                with :py:meth:`sequential_prob_pass_better`, which stops
+                as soon as the comparison is decided, rather than always
+                running bootstrap_iter trials for each
+        :type sequential: bool
+        :param sequential_batch_iter: Number of trials added to each
+                estimate between checks in sequential mode
+        :type sequential_batch_iter: int
+        :param sequential_confidence: Confidence level of each
+                comparison in sequential mode
+        :type sequential_confidence: float
+
         :return: (frac_data_in_safety, candidate_dataset, safety_dataset). frac_data_in_safety
                 indicates the percentage of total data that is included in the safety dataset.
                 candidate_dataset and safety_dataset are dataset objects containing data from
@@ -396,6 +456,11 @@ class HyperparamSearch:
         # Sort from lowest amount of data in candidate selection from lowest to highest.
         self.all_frac_data_in_candidate_selection.sort()
 
+        # Each probability estimate gets its own child seed sequence
+        if seed is None:
+            seed = np.random.randint(2**31)
+        seed_sequence = np.random.SeedSequence(seed)
+
         for (
             rho
         ) in (
@@ -411,37 +476,61 @@ class HyperparamSearch:
                 n_safety,
             ) = self.create_dataset(self.dataset, frac_data_in_safety, shuffle=False)
 
-            # Estimate probability of passing.
-            rho_prob_pass = self.est_prob_pass(
+            # Estimate probability of passing. The same estimate is
+            # used (and in sequential mode extended) in every comparison
+            rho_estimate = self.new_prob_pass_estimate(
                 rho,
                 candidate_dataset,
-                safety_dataset,
-                n_candidate,
-                n_safety,
                 write_cs_logfile,
-                debug,
-            )  #
-
-            # Estimate if any of the future splits of data lead to higher P(pass)
-            rho_prime_better = False
-            for rho_prime in self.all_frac_data_in_candidate_selection:
-                if rho_prime <= rho:  # Only look at larger rho.
-                    continue
-
-                rho_prime_prob_pass = self.est_prob_pass(
+                n_workers=n_workers,
+                seed=seed_sequence.spawn(1)[0],
+            )
+            # Only look at larger rho.
+            rho_prime_estimates = [
+                self.new_prob_pass_estimate(
                     rho_prime,
                     candidate_dataset,
-                    safety_dataset,
-                    n_candidate,
-                    n_safety,
                     write_cs_logfile,
-                    debug,
+                    n_workers=n_workers,
+                    seed=seed_sequence.spawn(1)[0],
                 )
-                if (
-                    rho_prime_prob_pass > rho_prob_pass
-                ):  # Predict a future split is better.
-                    rho_prime_better = True
-                    break
+                for rho_prime in self.all_frac_data_in_candidate_selection
+                if rho_prime > rho
+            ]
+            # One pool of workers runs the trials of all comparisons with rho
+            pool = self.make_bootstrap_pool(
+                [rho_estimate] + rho_prime_estimates, n_workers
+            )
+            try:
+                if not sequential:
+                    self.extend_prob_pass_estimate(
+                        rho_estimate, bootstrap_iter, pool=pool
+                    )
+
+                # Estimate if any of the future splits of data lead to higher P(pass)
+                rho_prime_better = False
+                for rho_prime_estimate in rho_prime_estimates:
+                    if sequential:
+                        rho_prime_better = self.sequential_prob_pass_better(
+                            rho_estimate,
+                            rho_prime_estimate,
+                            max_iter=bootstrap_iter,
+                            batch_iter=sequential_batch_iter,
+                            confidence=sequential_confidence,
+                            pool=pool,
+                        )
+                    else:
+                        self.extend_prob_pass_estimate(
+                            rho_prime_estimate, bootstrap_iter, pool=pool
+                        )
+                        rho_prime_better = (
+                            rho_prime_estimate["prob_pass"] > rho_estimate["prob_pass"]
+                        )
+                    if rho_prime_better:  # Predict a future split is better.
+                        break
+            finally:
+                if pool is not None:
+                    pool.shutdown()
 
             # If do not predict any greater rho is better, return rho and datasplit.
             if rho_prime_better is False:
@@ -461,6 +550,8 @@ class HyperparamSearch:
         write_cs_logfile=False,
         debug=False,
         bootstrap_iter=100,
+        n_workers=1,
+        seed=None,
     ):
         """Estimates probability of returning a solution with rho_prime fraction of data
             in candidate selection.
@@ -476,16 +567,252 @@ class HyperparamSearch:
         :type n_safety: int
         :param n_safety: size of safety dataset
         :type n_safety: int
+        :param bootstrap_iter: Number of bootstrap trials
+        :type bootstrap_iter: int
+        :param n_workers: Number of processes to run the trials in.
+                If 1, or if processes can't be forked on this platform,
+                the trials are run serially in this process
+        :type n_workers: int
+        :param seed: Seed (or seed sequence) from which the seed of each trial
+                is derived, so that the estimate does not depend on n_workers.
+                If None, it is drawn from numpy's global random state
+        :type seed: int or numpy.random.SeedSequence
+        """
+        estimate = self.new_prob_pass_estimate(
+            rho_prime,
+            candidate_dataset,
+            write_cs_logfile,
+            n_workers=n_workers,
+            seed=seed,
+        )
+        self.extend_prob_pass_estimate(estimate, bootstrap_iter)
+
+        return estimate["prob_pass"]
+
+    def new_prob_pass_estimate(
+        self, rho_prime, candidate_dataset, write_cs_logfile=False, n_workers=1, seed=None
+    ):
+        """Make an (empty) estimate of the probability of returning a solution
+        with rho_prime fraction of data in candidate selection.
+        Trials are added to it with :py:meth:`extend_prob_pass_estimate`.
+
+        :param rho_prime: fraction of data in candidate selection that we want to estimate
+                        the probabiilty of returning a solution for
+        :type rho_prime: float
+        :param candidate_dataset: a dataset object containing candidate solution dataset
+        :type candidate_dataset: :py:class:`.DataSet` object
+        :param n_workers: Number of processes to run the trials in
+        :type n_workers: int
+        :param seed: Seed (or seed sequence) from which the seed of each trial
+                is derived. If None, it is drawn from numpy's global random state
+        :type seed: int or numpy.random.SeedSequence
+
+        :return: Dictionary with the number of trials and passes so far
+                and what is needed to run more trials
+        :rtype: dict
         """
         frac_data_in_safety_prime = 1 - rho_prime
 
         # Size of bootstrapped datasets according to rho'.
-        total_data = len(self.dataset.df)
+        total_data = self.dataset.num_datapoints
         bs_n_candidate = int(total_data * rho_prime)
         bs_n_safety = total_data - bs_n_candidate
 
+        if seed is None:
+            seed = np.random.randint(2**31)
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+
+        estimate = {
+            "rho_prime": rho_prime,
+            "n_trials": 0,
+            "n_pass": 0,
+            "prob_pass": None,
+            "seed_sequence": seed,
+            "n_workers": n_workers,
+            "trial_kwargs": dict(
+                candidate_dataset=candidate_dataset,
+                frac_data_in_safety=frac_data_in_safety_prime,
+                bs_n_candidate=bs_n_candidate,
+                bs_n_safety=bs_n_safety,
+                write_cs_logfile=write_cs_logfile,
+            ),
+        }
+        return estimate
+
+    def make_bootstrap_pool(self, estimates, n_workers):
+        """Make a pool of worker processes that can run the bootstrap
+        trials of any of estimates. The spec and the datasets are
+        inherited by the forked workers when they start, after which
+        only the trial seeds are sent to them. The caller
+        must shut the pool down when done with it.
+
+        :param estimates: Estimates made by :py:meth:`new_prob_pass_estimate`
+        :type estimates: List(dict)
+        :param n_workers: Number of processes
+        :type n_workers: int
+
+        :return: The pool, or None if n_workers is 1 or processes
+                can't be forked on this platform, in which case
+                the trials are run in this process
+        :rtype: concurrent.futures.ProcessPoolExecutor
+        """
+        mp_context = get_fork_context(n_workers)
+        if mp_context is None:
+            return None
+        for estimate_index, estimate in enumerate(estimates):
+            estimate["pool_index"] = estimate_index
+        return ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=mp_context,
+            initializer=_init_bootstrap_worker,
+            initargs=(self, [estimate["trial_kwargs"] for estimate in estimates]),
+        )
+
+    def extend_prob_pass_estimate(self, estimate, n_new_trials, pool=None):
+        """Run n_new_trials more bootstrap trials and add them to estimate.
+        Each trial gets the next child of the estimate's seed sequence,
+        so running the trials in several steps gives the same result as
+        running them all at once.
+
+        :param estimate: Estimate made by :py:meth:`new_prob_pass_estimate`
+        :type estimate: dict
+        :param n_new_trials: Number of trials to add
+        :type n_new_trials: int
+        :param pool: Pool made by :py:meth:`make_bootstrap_pool`
+                for a list of estimates including this one. If None,
+                a pool is made for these trials only if the estimate
+                has more than one worker
+        """
+        if n_new_trials <= 0:
+            return
+        if pool is None:
+            pool = self.make_bootstrap_pool([estimate], estimate["n_workers"])
+            if pool is not None:
+                with pool:
+                    self.extend_prob_pass_estimate(estimate, n_new_trials, pool=pool)
+                return
+
+        trial_seeds = [
+            child.generate_state(1)[0]
+            for child in estimate["seed_sequence"].spawn(n_new_trials)
+        ]
+
         pass_count = 0
-        for i in range(bootstrap_iter):
+        if pool is not None:
+            futures = [
+                pool.submit(
+                    _run_bootstrap_trial_in_worker, estimate["pool_index"], trial_seed
+                )
+                for trial_seed in trial_seeds
+            ]
+            for future in as_completed(futures):
+                if future.result():
+                    pass_count += 1
+        else:
+            for trial_seed in trial_seeds:
+                if self.run_bootstrap_trial(trial_seed, **estimate["trial_kwargs"]):
+                    pass_count += 1
+
+        estimate["n_trials"] += n_new_trials
+        estimate["n_pass"] += pass_count
+        estimate["prob_pass"] = estimate["n_pass"] / estimate["n_trials"]
+
+    def sequential_prob_pass_better(
+        self,
+        rho_estimate,
+        rho_prime_estimate,
+        max_iter=100,
+        batch_iter=10,
+        confidence=0.95,
+        pool=None,
+    ):
+        """Decide whether rho_prime has a higher probability of passing than rho,
+        adding batch_iter trials at a time to both estimates and stopping as
+        soon as the confidence interval on the difference of the
+        probabilities (:py:func:`.diff_proportion_interval`) excludes zero.
+        If it never does, falls back on comparing the two estimates
+        after max_iter trials each. rho_estimate may already contain
+        trials from earlier comparisons, which are reused.
+
+        Since the interval is checked up to ceil(max_iter/batch_iter) times,
+        each check uses a confidence level of
+        1-(1-confidence)/ceil(max_iter/batch_iter) (Bonferroni correction),
+        so that the probability of stopping on a wrong decision
+        is at most 1-confidence.
+
+        :param rho_estimate: Estimate for rho, made by :py:meth:`new_prob_pass_estimate`
+        :type rho_estimate: dict
+        :param rho_prime_estimate: Estimate for rho_prime
+        :type rho_prime_estimate: dict
+        :param max_iter: Maximum number of trials in each estimate
+        :type max_iter: int
+        :param batch_iter: Number of trials added between checks
+        :type batch_iter: int
+        :param confidence: Confidence level of the decision,
+                over all checks
+        :type confidence: float
+        :param pool: Pool made by :py:meth:`make_bootstrap_pool`
+                for a list of estimates including both estimates
+        :return: Whether rho_prime is predicted to be better
+        :rtype: bool
+        """
+        n_checks = int(np.ceil(max_iter / batch_iter))
+        check_confidence = 1 - (1 - confidence) / n_checks
+        while True:
+            n_target = min(max_iter, rho_prime_estimate["n_trials"] + batch_iter)
+            for estimate in [rho_estimate, rho_prime_estimate]:
+                self.extend_prob_pass_estimate(
+                    estimate, n_target - estimate["n_trials"], pool=pool
+                )
+
+            lower, upper = diff_proportion_interval(
+                rho_prime_estimate["n_pass"],
+                rho_prime_estimate["n_trials"],
+                rho_estimate["n_pass"],
+                rho_estimate["n_trials"],
+                confidence=check_confidence,
+            )
+            if lower > 0:
+                return True
+            if upper < 0:
+                return False
+            if n_target >= max_iter:
+                return rho_prime_estimate["prob_pass"] > rho_estimate["prob_pass"]
+
+    def run_bootstrap_trial(
+        self,
+        trial_seed,
+        candidate_dataset,
+        frac_data_in_safety,
+        bs_n_candidate,
+        bs_n_safety,
+        write_cs_logfile=False,
+    ):
+        """Run a single bootstrap trial of :py:meth:`est_prob_pass`:
+        bootstrap candidate and safety datasets from candidate_dataset
+        and run the Seldonian algorithm on them.
+
+        :param trial_seed: Seed for numpy's global random state used in this trial.
+                The global random state from before the trial is restored afterwards
+        :type trial_seed: int
+        :param candidate_dataset: a dataset object containing candidate solution dataset
+        :type candidate_dataset: :py:class:`.DataSet` object
+        :param frac_data_in_safety: fraction of data used in safety test
+        :type frac_data_in_safety: float
+        :param bs_n_candidate: size of bootstrapped candidate dataset
+        :type bs_n_candidate: int
+        :param bs_n_safety: size of bootstrapped safety dataset
+        :type bs_n_safety: int
+        :return: Whether the safety test was passed
+        :rtype: bool
+        """
+        # The splits and bootstrap samples (and possibly the
+        # optimization) draw from numpy's global random state.
+        # Don't disturb the caller's random state, e.g., when running serially
+        random_state = np.random.get_state()
+        np.random.seed(trial_seed)
+        try:
             # Split candidate_dataset into pools for bootstraping samplinhg.
             (
                 candidate_pool,
@@ -493,7 +820,7 @@ class HyperparamSearch:
                 pool_n_candidate,
                 pool_n_safety,
             ) = self.create_dataset(
-                candidate_dataset, frac_data_in_safety_prime, shuffle=True
+                candidate_dataset, frac_data_in_safety, shuffle=True
             )
 
             # Bootstrap sample datasets approximating candidate and safety datasets.
@@ -507,14 +834,11 @@ class HyperparamSearch:
                 bs_candidate_dataset,
                 bs_safety_dataset,
                 bs_n_safety,
-                frac_data_in_safety_prime,
+                frac_data_in_safety,
                 write_cs_logfile,
                 debug=False,
             )
+        finally:
+            np.random.set_state(random_state)
 
-            if passed_safety:
-                pass_count += 1
-
-        bs_prob_pass = pass_count / bootstrap_iter
-
-        return bs_prob_pass
+        return passed_safety
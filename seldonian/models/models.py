@@ -48,6 +48,19 @@ class LinearRegressionModel(RegressionModel):
         """
         return theta[0] + (X @ theta[1:])
 
+    def predict_many(self, thetas, X):
+        """Predict labels for several parameter weights
+        at once, with a single matrix product
+
+        :param thetas: The parameter weights, one row per solution
+        :type thetas: numpy ndarray of shape (k,j)
+        :param X: The features
+        :type X: numpy ndarray
+        :return: predicted labels, one row per solution
+        :rtype: numpy ndarray of shape (k,i)
+        """
+        return thetas[:, :1] + (thetas[:, 1:] @ X.T)
+
     def fit(self, X, Y):
         """Train the model using the feature,label pairs
 
@@ -118,6 +131,23 @@ class BoundedLinearRegressionModel(LinearRegressionModel):
         :return: predicted labels
         :rtype: numpy ndarray
         """
+        Z = theta[0] + (X @ theta[1:])
+        return self._squash(Z)
+
+    def predict_many(self, thetas, X):
+        """Overrides the original predict_many
+        function to squash predictions
+
+        :param thetas: The parameter weights, one row per solution
+        :type thetas: numpy ndarray of shape (k,j)
+        :param X: The features
+        :type X: numpy ndarray
+        :return: predicted labels, one row per solution
+        :rtype: numpy ndarray of shape (k,i)
+        """
+        return self._squash(super().predict_many(thetas, X))
+
+    def _squash(self, Z):
         y_min, y_max = -3, 3
         # Want range of Y_hat to be twice that of Y
         # and want size of interval on either side of Y_min and Y_max
@@ -125,7 +155,6 @@ class BoundedLinearRegressionModel(LinearRegressionModel):
         s = 2.0  # 1 gives you the same bound size as y
         y_hat_min = y_min * (1 + s) / 2 + y_max * (1 - s) / 2
         y_hat_max = y_max * (1 + s) / 2 + y_min * (1 - s) / 2
-        Z = theta[0] + (X @ theta[1:])
         return self._sigmoid(Z) * (y_hat_max - y_hat_min) + y_hat_min
 
 
@@ -195,6 +224,23 @@ class BinaryLogisticRegressionModel(BaseLogisticRegressionModel):
         Y_pred = 1 / (1 + np.exp(-Z))
         return Y_pred
 
+    def predict_many(self, thetas, X):
+        """Predict the probability of the positive class
+        for several parameter weights at once, with a single
+        matrix product. Let:
+                m = number of solutions
+
+        :param thetas: The parameter weights, one row per solution
+        :type thetas: array of shape (m,j)
+        :param X: The features
+        :type X: array of shape (i,j)
+        :return: predictions for each solution each observation
+        :rtype: array of shape (m,i)
+        """
+        Z = thetas[:, :1] + (thetas[:, 1:] @ X.T)  # (m,j) x (j,i) -> (m,i)
+        Y_pred = 1 / (1 + np.exp(-Z))
+        return Y_pred
+
 
 class MultiClassLogisticRegressionModel(BaseLogisticRegressionModel):
     def __init__(self):
@@ -223,6 +269,24 @@ class MultiClassLogisticRegressionModel(BaseLogisticRegressionModel):
 
         return Y_pred
 
+    def predict_many(self, thetas, X):
+        """Predict the probability of
+        having each class label for each data point
+        in X for several parameter weights at once. Let:
+                m = number of solutions
+
+        :param thetas: The parameter weights, one per solution
+        :type thetas: array of shape (m,j,k)
+        :param X: The features
+        :type X: array of shape (i,j)
+        :return: predictions for each solution each class each observation
+        :rtype: array of shape (m,i,k)
+        """
+        Z = thetas[:, :1] + (X @ thetas[:, 1:])  # (i,j) x (m,j,k) -> (m,i,k)
+        Y_pred = np.exp(Z) / np.sum(np.exp(Z), axis=-1, keepdims=True)
+
+        return Y_pred
+
 
 class DummyClassifierModel(ClassificationModel):
     def __init__(self):
@@ -1,13 +1,126 @@
 """ Objective functions """
 
 import autograd.numpy as np  # Thinly-wrapped version of Numpy
+from autograd.tracer import Box
+from autograd.extend import primitive, defvjp
 import math
 
 from seldonian.utils.stats_utils import weighted_sum_gamma
+from seldonian.dataset import EpisodeStore
 
 stability_const = 1e-15
 
 
+class PredictionCache(object):
+    def __init__(self, max_entries=32):
+        """Cache of model predictions for a single value of
+        the model weights, so that every measure function
+        (and every parse tree) evaluated at the same theta
+        can reuse one forward pass through the model,
+        including its autograd node if theta is being traced.
+
+        Entries are keyed on the identity of the model and
+        the features. The whole cache is invalidated as soon
+        as predictions are requested for a different theta.
+
+        :param max_entries: The maximum number of
+                (model, features) pairs to store for one theta
+        :type max_entries: int
+        """
+        self.max_entries = max_entries
+        self.clear()
+
+    def clear(self):
+        """Drop all cached predictions"""
+        self.theta = None
+        self.entries = []
+
+    def _same_theta(self, theta):
+        """Check whether theta is the one the cached
+        predictions were made with. Autograd boxes are compared
+        by identity so that predictions are never shared across traces.
+        Arrays are compared by value because they can be
+        updated in place by the optimizer.
+        """
+        if self.theta is None:
+            return False
+        if isinstance(theta, Box) or isinstance(self.theta, Box):
+            return theta is self.theta
+        return (
+            isinstance(theta, np.ndarray)
+            and theta.shape == self.theta.shape
+            and np.array_equal(theta, self.theta)
+        )
+
+    def predict(self, model, theta, X):
+        """Get model.predict(theta,X), reusing the
+        cached result if available
+
+        :param model: SeldonianModel instance
+        :param theta: The parameter weights
+        :type theta: numpy ndarray
+        :param X: The features
+        :type X: numpy ndarray
+        """
+        if not self._same_theta(theta):
+            self.clear()
+            if isinstance(theta, Box):
+                self.theta = theta
+            elif isinstance(theta, np.ndarray):
+                # Store a copy since theta may be modified in place
+                self.theta = np.copy(theta)
+            else:
+                # Can't reliably tell when theta changes, so don't cache
+                return model.predict(theta, X)
+
+        for cached_model, cached_X, prediction in self.entries:
+            if cached_model is model and cached_X is X:
+                return prediction
+
+        prediction = model.predict(theta, X)
+        if len(self.entries) >= self.max_entries:
+            self.entries.pop(0)
+        # Keep references to model and X so their ids stay valid
+        self.entries.append((model, X, prediction))
+        return prediction
+
+    def store(self, model, theta, X, prediction):
+        """Add predictions that were computed elsewhere,
+        e.g. by :py:meth:`.LinearRegressionModel.predict_many`,
+        so that model.predict(theta,X) does not need to be called
+
+        :param model: SeldonianModel instance
+        :param theta: The parameter weights
+        :type theta: numpy ndarray
+        :param X: The features
+        :type X: numpy ndarray
+        :param prediction: model.predict(theta,X)
+        :type prediction: numpy ndarray
+        """
+        if not self._same_theta(theta):
+            self.clear()
+            self.theta = np.copy(theta)
+        if len(self.entries) >= self.max_entries:
+            self.entries.pop(0)
+        self.entries.append((model, X, prediction))
+
+
+prediction_cache = PredictionCache()
+
+
+def cached_predict(model, theta, X):
+    """Wrapper for model.predict(theta,X) that goes through
+    the module-level :py:class:`.PredictionCache`
+
+    :param model: SeldonianModel instance
+    :param theta: The parameter weights
+    :type theta: numpy ndarray
+    :param X: The features
+    :type X: numpy ndarray
+    """
+    return prediction_cache.predict(model, theta, X)
+
+
 def batcher(func, N, batch_size, num_batches):
     """Calls function num_batches times,
     batching up the inputs to the objective function
@@ -203,7 +316,7 @@ def Mean_Squared_Error(model, theta, X, Y, **kwargs):
     :rtype: float
     """
     n = len(Y)  # Y guaranteed to be a numpy array, X isn't.
-    prediction = model.predict(theta, X)  # vector of values
+    prediction = cached_predict(model, theta, X)  # vector of values
     res = sum(pow(prediction - Y, 2)) / n
 
     return res
@@ -230,7 +343,7 @@ def gradient_Mean_Squared_Error(model, theta, X, Y, **kwargs):
             " to get the gradient."
         )
     n = len(Y)
-    prediction = model.predict(theta, X)  # vector of values
+    prediction = cached_predict(model, theta, X)  # vector of values
     err = prediction - Y
     X_withintercept = np.hstack([np.ones((n, 1)), np.array(X)])
     return 2 / n * np.dot(err, X_withintercept)
@@ -252,7 +365,7 @@ def Mean_Error(model, theta, X, Y, **kwargs):
     :rtype: float
     """
     n = len(X)
-    prediction = model.predict(theta, X)  # vector of values
+    prediction = cached_predict(model, theta, X)  # vector of values
     res = sum(prediction - Y) / n
     return res
 
@@ -272,7 +385,7 @@ def vector_Squared_Error(model, theta, X, Y, **kwargs):
     :return: vector of mean squared error values
     :rtype: numpy ndarray(float)
     """
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     return pow(prediction - Y, 2)
 
 
@@ -291,7 +404,7 @@ def vector_Error(model, theta, X, Y, **kwargs):
     :return: vector of mean error values
     :rtype: numpy ndarray(float)
     """
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     return prediction - Y
 
 
@@ -320,7 +433,7 @@ def gradient_Bounded_Squared_Error(model, theta, X, Y, **kwargs):
     c1 = y_hat_max - y_hat_min
     c2 = -y_hat_min
 
-    Y_hat = model.predict(theta, X)  # vector of values
+    Y_hat = cached_predict(model, theta, X)  # vector of values
     Y_hat_old = (Y_hat - y_hat_min) / (y_hat_max - y_hat_min)
     sig = model._sigmoid(Y_hat_old)
 
@@ -348,7 +461,7 @@ def binary_logistic_loss(model, theta, X, Y, **kwargs):
     :return: logistic loss
     :rtype: float
     """
-    Y_pred = model.predict(theta, X)
+    Y_pred = cached_predict(model, theta, X)
     # Add stability constant. This guards against
     # predictions that are 0 or 1, which cause log(Y_pred) or
     # log(1.0-Y_pred) to be nan. If Y==0 and Y_pred == 1,
@@ -375,7 +488,7 @@ def gradient_binary_logistic_loss(model, theta, X, Y, **kwargs):
     :return: perceptron loss
     :rtype: float
     """
-    h = model.predict(theta, X)
+    h = cached_predict(model, theta, X)
     X_withintercept = np.hstack([np.ones((len(X), 1)), np.array(X)])
     res = (1 / len(X)) * np.dot(X_withintercept.T, (h - Y))
     return res
@@ -403,7 +516,7 @@ def multiclass_logistic_loss(model, theta, X, Y, **kwargs):
     # for the ith sample. We need to get the probability of predicting
     # the true class for each sample and then take the sum of the
     # logs of that.
-    Y_pred = model.predict(theta, X)
+    Y_pred = cached_predict(model, theta, X)
     N = len(Y)
     probs_trueclasses = Y_pred[np.arange(N), Y.astype("int")]
     return -1 / N * sum(np.log(probs_trueclasses))
@@ -435,12 +548,12 @@ def Positive_Rate(model, theta, X, Y, **kwargs):
 
 
 def _Positive_Rate_binary(model, theta, X, Y, **kwargs):
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     return np.sum(prediction) / len(X)  # if all 1s then PR=1.
 
 
 def _Positive_Rate_multiclass(model, theta, X, Y, class_index, **kwargs):
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     return np.sum(prediction[:, class_index]) / len(X)  # if all 1s then PR=1.
 
 
@@ -471,13 +584,13 @@ def Negative_Rate(model, theta, X, Y, **kwargs):
 
 def _Negative_Rate_binary(model, theta, X, Y, **kwargs):
     # Average probability of predicting the negative class
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     return np.sum(1.0 - prediction) / len(X)  # if all 1s then PR=1.
 
 
 def _Negative_Rate_multiclass(model, theta, X, Y, class_index, **kwargs):
     # Average probability of predicting class!=class_index
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     return np.sum(1.0 - prediction[:, class_index]) / len(X)
 
 
@@ -508,7 +621,7 @@ def False_Positive_Rate(model, theta, X, Y, **kwargs):
 def _False_Positive_Rate_binary(model, theta, X, Y, **kwargs):
     # Average probability of predicting positive class
     # subject to the truth being the other class
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     neg_mask = Y != 1.0
     return np.sum(prediction[neg_mask]) / len(X[neg_mask])
 
@@ -516,7 +629,7 @@ def _False_Positive_Rate_binary(model, theta, X, Y, **kwargs):
 def _False_Positive_Rate_multiclass(model, theta, X, Y, class_index, **kwargs):
     # Sum the probability of predicting class=class_index
     # subject to the true label being any other class
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
 
     neg_mask = Y != class_index
     return np.sum(prediction[:, class_index][neg_mask]) / len(X[neg_mask])
@@ -548,7 +661,7 @@ def False_Negative_Rate(model, theta, X, Y, **kwargs):
 def _False_Negative_Rate_binary(model, theta, X, Y, **kwargs):
     # Average probability of being in negative class
     # subject to the truth being the positive class
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     pos_mask = Y == 1.0
     return np.sum(1.0 - prediction[pos_mask]) / len(X[pos_mask])
 
@@ -556,7 +669,7 @@ def _False_Negative_Rate_binary(model, theta, X, Y, **kwargs):
 def _False_Negative_Rate_multiclass(model, theta, X, Y, class_index, **kwargs):
     # Average probability of not having class=class_index
     # subject to the truth being class=class_index
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     pos_mask = Y == class_index
     return np.sum(1.0 - prediction[:, class_index][pos_mask]) / len(X[pos_mask])
 
@@ -590,7 +703,7 @@ def True_Positive_Rate(model, theta, X, Y, **kwargs):
 def _True_Positive_Rate_binary(model, theta, X, Y, **kwargs):
     # Average probability of predicting the positive class
     # subject to the true label being the positive class
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     pos_mask = Y == 1.0
     return np.sum(prediction[pos_mask]) / len(X[pos_mask])
 
@@ -598,7 +711,7 @@ def _True_Positive_Rate_binary(model, theta, X, Y, **kwargs):
 def _True_Positive_Rate_multiclass(model, theta, X, Y, class_index, **kwargs):
     # Average probability of predicting class=class_index
     # subject to the true label having class=class_index
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     pos_mask = Y == class_index
     return np.sum(prediction[:, class_index][pos_mask]) / len(X[pos_mask])
 
@@ -632,7 +745,7 @@ def True_Negative_Rate(model, theta, X, Y, **kwargs):
 def _True_Negative_Rate_binary(model, theta, X, Y, **kwargs):
     # Average probability of being in negative class
     # subject to the truth being the negative class
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     neg_mask = Y != 1.0
     return np.sum(1.0 - prediction[neg_mask]) / len(X[neg_mask])
 
@@ -640,7 +753,7 @@ def _True_Negative_Rate_binary(model, theta, X, Y, **kwargs):
 def _True_Negative_Rate_multiclass(model, theta, X, Y, class_index, **kwargs):
     # Average probability of class!=class_index
     # subject to the truth being class!=class_index
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     neg_mask = Y != class_index
     return np.sum(1.0 - prediction[:, class_index][neg_mask]) / len(X[neg_mask])
 
@@ -711,7 +824,7 @@ def _Accuracy_binary(model, theta, X, Y, **kwargs):
     :rtype: float
     """
     n = len(X)
-    Y_pred_probs = model.predict(theta, X)
+    Y_pred_probs = cached_predict(model, theta, X)
     v = np.where(Y != 1, 1.0 - Y_pred_probs, Y_pred_probs)
     return np.sum(v) / n
 
@@ -732,7 +845,7 @@ def _Accuracy_multiclass(model, theta, X, Y, **kwargs):
     :rtype: float
     """
     n = len(X)
-    Y_pred_probs = model.predict(theta, X)
+    Y_pred_probs = cached_predict(model, theta, X)
     return np.sum(Y_pred_probs[np.arange(n), Y]) / n
 
 
@@ -762,7 +875,7 @@ def confusion_matrix(model, theta, X, Y, l_i, l_k, **kwargs):
     :return: The element
     :rtype: float
     """
-    Y_pred = model.predict(theta, X)  # i x k
+    Y_pred = cached_predict(model, theta, X)  # i x k
     true_mask = Y == l_i  # length i
     N_mask = sum(true_mask)
 
@@ -796,13 +909,13 @@ def vector_Positive_Rate(model, theta, X, Y, **kwargs):
 
 def _vector_Positive_Rate_binary(model, theta, X, Y, **kwargs):
     # probability of class 1 for each observation
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     return prediction
 
 
 def _vector_Positive_Rate_multiclass(model, theta, X, Y, class_index, **kwargs):
     # probability of class==class_index for each observation
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     return prediction[:, class_index]
 
 
@@ -832,13 +945,13 @@ def vector_Negative_Rate(model, theta, X, Y, **kwargs):
 
 def _vector_Negative_Rate_binary(model, theta, X, Y, **kwargs):
     # probability of class 0 for each observation
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     return 1.0 - prediction
 
 
 def _vector_Negative_Rate_multiclass(model, theta, X, Y, class_index, **kwargs):
     # probability of class!=class_index for each observation
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     return 1.0 - prediction[:, class_index]
 
 
@@ -870,7 +983,7 @@ def vector_False_Positive_Rate(model, theta, X, Y, **kwargs):
 def _vector_False_Positive_Rate_binary(model, theta, X, Y, **kwargs):
     # The probability the model predicts being in this class
     # subject to the truth being in any other class
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     neg_mask = Y != 1.0  # this includes false positives and true negatives
     return prediction[neg_mask]
 
@@ -878,7 +991,7 @@ def _vector_False_Positive_Rate_binary(model, theta, X, Y, **kwargs):
 def _vector_False_Positive_Rate_multiclass(model, theta, X, Y, class_index, **kwargs):
     # The probability the model predicts being in this class
     # subject to the truth being in any other class
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     other_mask = Y != class_index
     return prediction[:, class_index][other_mask]
 
@@ -911,7 +1024,7 @@ def vector_False_Negative_Rate(model, theta, X, Y, **kwargs):
 def _vector_False_Negative_Rate_binary(model, theta, X, Y, **kwargs):
     # The probability of being in positive class
     # subject to the truth being the other class
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     pos_mask = Y == 1.0  # this includes false positives and true negatives
     return 1.0 - prediction[pos_mask]
 
@@ -919,7 +1032,7 @@ def _vector_False_Negative_Rate_binary(model, theta, X, Y, **kwargs):
 def _vector_False_Negative_Rate_multiclass(model, theta, X, Y, class_index, **kwargs):
     # The probability the model predicts not being in this class
     # subject to the truth being in this class
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     pos_mask = Y == class_index  # this includes false positives and true negatives
     return (1.0 - prediction[:, class_index])[pos_mask]
 
@@ -951,7 +1064,7 @@ def _vector_True_Positive_Rate_binary(model, theta, X, Y, **kwargs):
     This is the probability of predicting positive
     subject to the label actually being positive
     """
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     pos_mask = Y == 1.0  # this includes false positives and true negatives
     return prediction[pos_mask]
 
@@ -961,7 +1074,7 @@ def _vector_True_Positive_Rate_multiclass(model, theta, X, Y, class_index, **kwa
     This is the probability of predicting this class
     subject to the label actually being this class
     """
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     pos_mask = Y == class_index  # this includes false positives and true negatives
     return (prediction[:, class_index])[pos_mask]
 
@@ -993,7 +1106,7 @@ def _vector_True_Negative_Rate_binary(model, theta, X, Y, **kwargs):
     This is the probability of predicting negative
     subject to the label actually being negative
     """
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     neg_mask = Y != 1.0
     return 1.0 - prediction[neg_mask]
 
@@ -1003,7 +1116,7 @@ def _vector_True_Negative_Rate_multiclass(model, theta, X, Y, class_index, **kwa
     This is the probability of predicting not this class
     subject to the true label not being this class
     """
-    prediction = model.predict(theta, X)
+    prediction = cached_predict(model, theta, X)
     neg_mask = Y != class_index
     return (1.0 - prediction[:, class_index])[neg_mask]
 
@@ -1043,7 +1156,7 @@ def _vector_Accuracy_binary(model, theta, X, Y, **kwargs):
     :return: logistic loss
     :rtype: float
     """
-    Y_pred_probs = model.predict(theta, X)
+    Y_pred_probs = cached_predict(model, theta, X)
     # Get probabilities of true positives and true negatives
     # Use the vector Y_pred as it already has the true positive
     # probs. Just need to replace the probabilites in the neg mask with 1-prob
@@ -1066,7 +1179,7 @@ def _vector_Accuracy_multiclass(model, theta, X, Y, **kwargs):
     :rtype: float
     """
     n = len(X)
-    Y_pred_probs = model.predict(theta, X)
+    Y_pred_probs = cached_predict(model, theta, X)
     return Y_pred_probs[np.arange(n), Y]
 
 
@@ -1096,7 +1209,7 @@ def vector_confusion_matrix(model, theta, X, Y, l_i, l_k, **kwargs):
     :return: Array of the C[l_i,l_k] for each observation
     :rtype: array of floats
     """
-    Y_pred = model.predict(theta, X)  # i x k
+    Y_pred = cached_predict(model, theta, X)  # i x k
     true_mask = Y == l_i  # length i
 
     N_mask = sum(true_mask)
@@ -1107,6 +1220,107 @@ def vector_confusion_matrix(model, theta, X, Y, l_i, l_k, **kwargs):
 """ RL """
 
 
+@primitive
+def segment_sum(x, offsets):
+    """Sum of x over each segment x[offsets[i]:offsets[i+1]]
+
+    :param x: The input array
+    :type x: numpy ndarray
+    :param offsets: Start of each segment, followed by len(x)
+    :type offsets: numpy ndarray(int)
+    :return: The sum of each segment
+    :rtype: numpy ndarray(float)
+    """
+    lengths = np.diff(offsets)
+    segment_ids = np.repeat(np.arange(len(lengths)), lengths)
+    return np.bincount(segment_ids, weights=x, minlength=len(lengths))
+
+
+@primitive
+def segment_cumsum(x, offsets):
+    """Cumulative sum of x restarting at each segment x[offsets[i]:offsets[i+1]]
+
+    :param x: The input array
+    :type x: numpy ndarray
+    :param offsets: Start of each segment, followed by len(x)
+    :type offsets: numpy ndarray(int)
+    :return: The cumulative sums
+    :rtype: numpy ndarray(float)
+    """
+    cumsums = np.concatenate([np.zeros(1), np.cumsum(x)])
+    return cumsums[1:] - np.repeat(cumsums[offsets[:-1]], np.diff(offsets))
+
+
+defvjp(segment_sum, lambda ans, x, offsets: lambda g: np.repeat(g, np.diff(offsets)))
+
+# The gradient of a cumulative sum is the reversed cumulative sum
+defvjp(
+    segment_cumsum,
+    lambda ans, x, offsets: lambda g: (
+        np.repeat(segment_sum(g, offsets), np.diff(offsets))
+        - segment_cumsum(g, offsets)
+        + g
+    ),
+)
+
+
+def get_pi_ratios(model, theta, episodes):
+    """Ratio of the action probabilities under the new policy
+    to those under the behavior policy, for every timestep
+    of every episode. The new policy probabilities are obtained
+    from a single call to the model on the flattened episodes.
+
+    :param model: SeldonianModel instance
+    :param theta: The parameter weights
+    :type theta: numpy ndarray
+    :param episodes: Episodes
+    :type episodes: :py:class:`.EpisodeStore`
+    :return: The probability ratios
+    :rtype: numpy ndarray(float)
+    """
+    pi_news = model.get_probs_from_observations_and_actions(
+        theta, episodes.observations, episodes.actions
+    )
+    return pi_news / episodes.action_probs
+
+
+def vector_pi_ratio_prod(model, theta, episodes):
+    """Product of the probability ratios over each episode,
+    computed as a segment sum in log space
+
+    :param model: SeldonianModel instance
+    :param theta: The parameter weights
+    :type theta: numpy ndarray
+    :param episodes: Episodes
+    :type episodes: :py:class:`.EpisodeStore`
+    :return: The product of the ratios of each episode
+    :rtype: numpy ndarray(float)
+    """
+    log_pi_ratios = np.log(get_pi_ratios(model, theta, episodes))
+    return np.exp(segment_sum(log_pi_ratios, episodes.offsets))
+
+
+def vector_PDIS_sum(model, theta, episodes, gamma):
+    """Discounted sum over each episode of the rewards weighted by the
+    cumulative product of the probability ratios, with the cumulative
+    products computed as segment cumulative sums in log space
+
+    :param model: SeldonianModel instance
+    :param theta: The parameter weights
+    :type theta: numpy ndarray
+    :param episodes: Episodes
+    :type episodes: :py:class:`.EpisodeStore`
+    :param gamma: The discount factor
+    :type gamma: float
+    :return: The PDIS sum of each episode
+    :rtype: numpy ndarray(float)
+    """
+    log_pi_ratios = np.log(get_pi_ratios(model, theta, episodes))
+    pi_ratio_prods = np.exp(segment_cumsum(log_pi_ratios, episodes.offsets))
+    discount = np.power(gamma, episodes.time_index)
+    return segment_sum(pi_ratio_prods * discount * episodes.rewards, episodes.offsets)
+
+
 def IS_estimate(model, theta, episodes, weighted_returns=None, **kwargs):
     """Calculate the unweighted importance sampling estimate
     on all episodes in the dataframe
@@ -1114,7 +1328,7 @@ def IS_estimate(model, theta, episodes, weighted_returns=None, **kwargs):
     :param model: SeldonianModel instance
     :param theta: The parameter weights
     :type theta: numpy ndarray
-    :param episodes: List of episodes
+    :param episodes: List of episodes or :py:class:`.EpisodeStore`
     :return: The IS estimate calculated over all episodes
     :rtype: float
     """
@@ -1129,6 +1343,10 @@ def IS_estimate(model, theta, episodes, weighted_returns=None, **kwargs):
             weighted_sum_gamma(ep.rewards, gamma=gamma) for ep in episodes
         ]
 
+    if isinstance(episodes, EpisodeStore):
+        pi_ratio_prods = vector_pi_ratio_prod(model, theta, episodes)
+        return np.sum(pi_ratio_prods * np.asarray(weighted_returns)) / len(episodes)
+
     IS_estimate = 0
     for ii, ep in enumerate(episodes):
         pi_news = model.get_probs_from_observations_and_actions(
@@ -1151,10 +1369,13 @@ def vector_IS_estimate(model, theta, episodes, weighted_returns, **kwargs):
     :param model: SeldonianModel instance
     :param theta: The parameter weights
     :type theta: numpy ndarray
-    :param episodes: List of episodes
+    :param episodes: List of episodes or :py:class:`.EpisodeStore`
     :return: A vector of IS estimates calculated for each episode
     :rtype: numpy ndarray(float)
     """
+    if isinstance(episodes, EpisodeStore):
+        pi_ratio_prods = vector_pi_ratio_prod(model, theta, episodes)
+        return pi_ratio_prods * np.asarray(weighted_returns)
 
     result = []
     for ii, ep in enumerate(episodes):
@@ -1196,12 +1417,15 @@ def PDIS_estimate(model, theta, episodes, weighted_returns=None, **kwargs)->floa
     :param model: SeldonianModel instance
     :param theta: The parameter weights
     :type theta: numpy ndarray
-    :param episodes: List of episodes
+    :param episodes: List of episodes or :py:class:`.EpisodeStore`
     :return: The PDIS estimate calculated over all episodes
     :rtype: float
     """
 
     gamma = model.env_kwargs["gamma"] if "gamma" in model.env_kwargs else 1.0
+    if isinstance(episodes, EpisodeStore):
+        return np.sum(vector_PDIS_sum(model, theta, episodes, gamma)) / len(episodes)
+
     PDIS_est = 0.
     for ep in episodes:
         discount = np.power(gamma, range(len(ep.rewards)))
@@ -1226,12 +1450,15 @@ def vector_PDIS_estimate(model, theta, episodes, weighted_returns, **kwargs):
     :param model: SeldonianModel instance
     :param theta: The parameter weights
     :type theta: numpy ndarray
-    :param episodes: List of episodes
+    :param episodes: List of episodes or :py:class:`.EpisodeStore`
     :return: A vector of PDIS estimates calculated for each episode
     :rtype: numpy ndarray(float)
     """
 
     gamma = model.env_kwargs["gamma"] if "gamma" in model.env_kwargs else 1.0
+    if isinstance(episodes, EpisodeStore):
+        return vector_PDIS_sum(model, theta, episodes, gamma)
+
     PDIS_vector = []
     for ep in episodes:
         discount = np.power(gamma, range(len(ep.rewards)))
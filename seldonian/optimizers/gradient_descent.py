@@ -1,6 +1,10 @@
 import copy
+import os
+import pickle
+from collections import deque
 import autograd.numpy as np  # Thinly-wrapped version of Numpy
-from autograd import grad, jacobian, elementwise_grad as egrad
+from autograd import grad, jacobian, value_and_grad, make_vjp, elementwise_grad as egrad
+from autograd.extend import vspace
 
 import warnings
 from seldonian.warnings.custom_warnings import *
@@ -28,6 +32,227 @@ def setup_gradients(gradient_library, primary_objective, upper_bounds_function):
     return grad_primary_theta, grad_upper_bound_theta
 
 
+def value_and_jacobian(fun):
+    """Like autograd's value_and_grad, but for vector-valued functions.
+    Returns a function that evaluates fun and its jacobian
+    from a single forward trace
+
+    :param fun: Function of a single (array) argument
+    :return: Function returning (fun(x), jacobian of fun at x)
+    """
+
+    def value_and_jacobian_fun(x):
+        vjp, ans = make_vjp(fun, argnum=0)(x)
+        ans_vspace = vspace(ans)
+        jacobian_shape = ans_vspace.shape + vspace(x).shape
+        grads = map(vjp, ans_vspace.standard_basis())
+        return ans, np.reshape(np.stack(grads), jacobian_shape)
+
+    return value_and_jacobian_fun
+
+
+def setup_fused_gradients(gradient_library, primary_objective, upper_bounds_function):
+    """Wrapper to obtain functions that return the values
+    of the primary objective and upper bounds function
+    together with their gradients, so that each is only
+    evaluated once per step
+
+    :param gradient_library: The name of the library to use for computing
+        automatic gradients.
+    :type gradient_library: str, defaults to "autograd"
+    :param primary_objective: Primary objective function
+    :param upper_bounds_function: Function for computing upper bounds
+        on the constraints
+    """
+    if gradient_library == "autograd":
+        primary_value_and_grad = value_and_grad(primary_objective, argnum=0)
+        upper_bounds_value_and_jacobian = value_and_jacobian(upper_bounds_function)
+    else:
+        raise NotImplementedError(
+            f"gradient library: {gradient_library}" " not supported"
+        )
+    return primary_value_and_grad, upper_bounds_value_and_jacobian
+
+
+class OptimizationHistory(object):
+    policies = ["all", "every", "last", "scalars", "none"]
+
+    def __init__(
+        self,
+        policy="last",
+        every=10,
+        size=1000,
+        store_theta=False,
+        logfile=None,
+        append_to_log=False,
+    ):
+        """Records the values of f, g, lambda and L (and optionally theta)
+        at the iterations of gradient descent selected by a policy:
+
+        - 'all': every iteration
+        - 'every': every k-th iteration, where k is every
+        - 'last': the last size iterations, in a ring buffer
+        - 'scalars': f and L at every iteration, but not the vectors g and lambda
+        - 'none': nothing
+
+        Every iteration can also be appended to an on-disk log,
+        whatever the policy, see :py:func:`load_history_log`.
+
+        :param policy: The history policy. The default, 'last',
+            keeps memory bounded whatever the number of iterations
+        :type policy: str, defaults to 'last'
+        :param every: Record every k-th iteration if policy is 'every'
+        :type every: int
+        :param size: Number of iterations to keep if policy is 'last'
+        :type size: int
+        :param store_theta: Whether to also record copies of theta,
+            which takes memory proportional to the number of
+            model weights per recorded iteration
+        :type store_theta: bool, defaults to False
+        :param logfile: If given, the file to which the values at every
+            iteration are appended as pickled records
+        :type logfile: str
+        :param append_to_log: Whether to keep the records already in
+            logfile, when resuming from a checkpoint. Otherwise the
+            file is overwritten
+        :type append_to_log: bool, defaults to False
+        """
+        if policy not in self.policies:
+            raise ValueError(
+                f"History policy: {policy} not supported. "
+                f"Choose one of {self.policies}"
+            )
+        self.policy = policy
+        self.every = every
+        self.store_theta = store_theta
+        self.records = deque(maxlen=size) if policy == "last" else []
+        self.logfile = None
+        if logfile is not None:
+            self.logfile = open(logfile, "ab" if append_to_log else "wb")
+
+    def append(self, iteration, theta, lamb, f, g, L):
+        """Record the values at an iteration, if the policy selects it"""
+        if self.logfile is not None:
+            record = {"iteration": iteration, "f": f, "g": g, "lamb": lamb, "L": L}
+            if self.store_theta:
+                record["theta"] = theta
+            pickle.dump(record, self.logfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+        if self.policy == "none":
+            return
+        if self.policy == "every" and iteration % self.every != 0:
+            return
+        if self.policy == "scalars":
+            self.records.append((iteration, f, L))
+            return
+        record = (iteration, f, g, np.copy(lamb), L)
+        if self.store_theta:
+            record += (np.copy(theta),)
+        self.records.append(record)
+
+    def close(self):
+        if self.logfile is not None:
+            self.logfile.close()
+
+    def get_state(self):
+        """The recorded values and the size of the log,
+        to be saved in a checkpoint
+
+        :rtype: dict
+        """
+        log_position = None
+        if self.logfile is not None:
+            self.logfile.flush()
+            log_position = self.logfile.tell()
+        return {"records": list(self.records), "log_position": log_position}
+
+    def set_state(self, state):
+        """Restore the recorded values from a checkpoint.
+        Records appended to the log after the checkpoint
+        was made are dropped, so they are not duplicated
+
+        :param state: State from :py:meth:`get_state`
+        :type state: dict
+        """
+        if self.policy == "last":
+            self.records = deque(state["records"], maxlen=self.records.maxlen)
+        else:
+            self.records = list(state["records"])
+        if self.logfile is not None and state["log_position"] is not None:
+            self.logfile.truncate(state["log_position"])
+
+    def to_dict(self):
+        """The recorded values as arrays, along with the
+        iterations they were recorded at
+
+        :rtype: dict
+        """
+        records = list(self.records)
+        history = {"history_iterations": np.array([r[0] for r in records], dtype=int)}
+        history["f_vals"] = np.array([r[1] for r in records])
+        if self.policy == "scalars":
+            history["g_vals"] = np.array([])
+            history["lamb_vals"] = np.array([])
+            history["L_vals"] = np.array([r[2] for r in records])
+        else:
+            history["g_vals"] = np.array([r[2] for r in records])
+            history["lamb_vals"] = np.array([r[3] for r in records])
+            history["L_vals"] = np.array([r[4] for r in records])
+            if self.store_theta:
+                history["theta_vals"] = np.array([r[5] for r in records])
+        return history
+
+
+def load_history_log(filename):
+    """Read the records appended to a history log by
+    :py:class:`OptimizationHistory`
+
+    :param filename: The log file
+    :type filename: str
+    :return: List of dicts with the iteration, f, g, lamb and L
+        (and theta if it was stored) of each iteration
+    """
+    records = []
+    with open(filename, "rb") as infile:
+        while True:
+            try:
+                records.append(pickle.load(infile))
+            except EOFError:
+                break
+    return records
+
+
+def save_checkpoint(state, filename):
+    """Pickle the state of gradient descent to filename.
+    The state is written to a temporary file which then
+    replaces filename, so a job that is stopped while
+    writing leaves the previous checkpoint intact
+
+    :param state: The state of gradient descent
+    :type state: dict
+    :param filename: The checkpoint file
+    :type filename: str
+    """
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as outfile:
+        pickle.dump(state, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def load_checkpoint(filename):
+    """Read a checkpoint written by :py:func:`save_checkpoint`
+
+    :param filename: The checkpoint file
+    :type filename: str
+    :return: The state of gradient descent
+    :rtype: dict
+    """
+    with open(filename, "rb") as infile:
+        return pickle.load(infile)
+
+
 def gradient_descent_adam(
     primary_objective,
     n_constraints,
@@ -43,6 +268,19 @@ def gradient_descent_adam(
     beta_velocity=0.9,
     beta_rmsprop=0.9,
     gradient_library="autograd",
+    fused_gradients=True,
+    history="last",
+    history_every=10,
+    history_size=1000,
+    history_theta=False,
+    history_logfile=None,
+    tol_grad_norm=None,
+    tol_rel_L=None,
+    patience=None,
+    checkpoint_file=None,
+    checkpoint_every=100,
+    resume=False,
+    checkpoint_extra=None,
     verbose=False,
     debug=False,
     **kwargs,
@@ -83,11 +321,62 @@ def gradient_descent_adam(
     :param gradient_library: The name of the library to use for computing
         automatic gradients.
     :type gradient_library: str, defaults to "autograd"
+    :param fused_gradients: Whether to obtain the values of f and g
+        from the same forward pass used to compute their gradients,
+        rather than evaluating them separately
+    :type fused_gradients: bool, defaults to True
+    :param history: Which iterations to keep the values of f, g,
+        lambda and L for, see :py:class:`OptimizationHistory`.
+        Only the best solutions found so far are kept otherwise,
+        so memory does not grow with the number of iterations
+        unless the history does. The default keeps the
+        last history_size iterations
+    :type history: str, defaults to 'last'
+    :param history_every: Keep every k-th iteration if history is 'every'
+    :param history_size: Number of iterations to keep if history is 'last'
+    :param history_theta: Whether the history also keeps theta
+    :type history_theta: bool, defaults to False
+    :param history_logfile: File to write the values
+        at every iteration to. Overwritten unless resuming
+    :type history_logfile: str
+    :param tol_grad_norm: Stop when the norm of the gradient of
+        the Lagrangian w.r.t. theta and lambda is at most this value.
+        Components of the lambda gradient that would push a
+        lambda of 0 below 0 do not count
+    :type tol_grad_norm: float
+    :param tol_rel_L: Stop when the mean of the Lagrangian over the
+        batches of an epoch changes by at most this fraction of its
+        value in the previous epoch. Checked at the end of each epoch,
+        so that the noise between minibatches does not stop
+        gradient descent. With a single batch (full-batch gradient descent),
+        consecutive iterations are compared
+    :type tol_rel_L: float
+    :param patience: Stop when the best feasible value of the
+        primary objective has not improved for this many iterations.
+        Only applies once a feasible solution has been found
+    :type patience: int
+    :param checkpoint_file: File to save the state of gradient descent
+        to, see :py:func:`save_checkpoint`
+    :type checkpoint_file: str
+    :param checkpoint_every: Save the state every k iterations
+    :type checkpoint_every: int
+    :param resume: Whether to continue from the state in checkpoint_file,
+        if the file exists. The iterations then give the same
+        results as if gradient descent had not been interrupted.
+        Raises ValueError if the checkpoint was made by a run with
+        weights of another shape, another number of constraints,
+        batches or batch size
+    :type resume: bool, defaults to False
+    :param checkpoint_extra: (get_state, set_state) functions
+        to save and restore state kept outside of this function,
+        e.g., the order of the batches
+    :type checkpoint_extra: tuple(function, function)
     :param verbose: Boolean flag to control verbosity
     :param debug: Boolean flag to print out info useful for debugging
 
     :return: solution, a dictionary containing the solution and metadata
-        about the gradient descent run
+        about the gradient descent run, including why it stopped:
+        'max_iterations', 'grad_norm', 'rel_L', 'patience' or 'nan_or_inf'
     :rtype: dict
     """
 
@@ -114,31 +403,95 @@ def gradient_descent_adam(
     # Initialize params for tracking best solution
     best_primary = np.inf  # minimizing f so want it to be lowest possible
     best_index = 0
+    best_lamb = None
+    best_g_vec = None
+    best_L = None
     candidate_solution = None
 
     # If we never enter feasible set, we still need to know what the solution was
     # when g was minimum
     found_feasible_solution = False
-    # Store values at each step in gradient descent, if requested
-    theta_vals = []
-    lamb_vals = []
-    L_vals = []
-    f_vals = []  # primary
-    g_vals = []  # constraint upper bound values
+    min_g_norm = np.inf
+    min_g_solution = None
+    resuming = (
+        resume and checkpoint_file is not None and os.path.exists(checkpoint_file)
+    )
+    # Store values at steps in gradient descent, as requested
+    optimization_history = OptimizationHistory(
+        policy=history,
+        every=history_every,
+        size=history_size,
+        store_theta=history_theta,
+        logfile=history_logfile,
+        append_to_log=resuming,
+    )
 
     # Get df/dtheta and dg/dtheta automatic gradients
     (grad_primary_theta, grad_upper_bound_theta) = setup_gradients(
         gradient_library, primary_objective, upper_bounds_function
     )
+    if fused_gradients:
+        (primary_value_and_grad, upper_bounds_value_and_jacobian) = setup_fused_gradients(
+            gradient_library, primary_objective, upper_bounds_function
+        )
 
     # It is possible that the user provided the function df/dtheta,
     # which can often speed up computing the gradients.
     # In that case, override the automatic gradient function
     if "primary_gradient" in kwargs:
         grad_primary_theta = kwargs["primary_gradient"]
+        if fused_gradients:
+
+            def primary_value_and_grad(theta):
+                return primary_objective(theta), grad_primary_theta(theta)
 
     # Start gradient descent
     gd_index = 0
+    n_iters = 0
+    # Sum of the Lagrangian over the batches of the current epoch
+    # and its mean in the previous epoch, for tol_rel_L
+    epoch_L_sum = 0.0
+    prev_L_val = None
+    stop_reason = "max_iterations"
+    start_epoch, start_batch_index = 0, 0
+    # Checkpoints record the run they were made by,
+    # so that a checkpoint of another run is not resumed
+    run_description = {
+        "theta_shape": np.shape(theta_init),
+        "n_constraints": n_constraints,
+        "n_batches": n_batches,
+        "batch_size": batch_size,
+    }
+    if resuming:
+        state = load_checkpoint(checkpoint_file)
+        if state.get("run_description") != run_description:
+            raise ValueError(
+                f"Checkpoint {checkpoint_file} was made by a run with "
+                f"{state.get('run_description')}, but this run has {run_description}"
+            )
+        start_epoch = state["epoch"]
+        start_batch_index = state["batch_index"]
+        gd_index = n_iters = state["gd_index"]
+        theta = state["theta"]
+        lamb = state["lamb"]
+        velocity_theta = state["velocity_theta"]
+        s_theta = state["s_theta"]
+        best_primary = state["best_primary"]
+        best_index = state["best_index"]
+        best_lamb = state["best_lamb"]
+        best_g_vec = state["best_g_vec"]
+        best_L = state["best_L"]
+        candidate_solution = state["candidate_solution"]
+        found_feasible_solution = state["found_feasible_solution"]
+        min_g_norm = state["min_g_norm"]
+        min_g_solution = state["min_g_solution"]
+        epoch_L_sum = state["epoch_L_sum"]
+        prev_L_val = state["prev_L_val"]
+        optimization_history.set_state(state["history"])
+        if checkpoint_extra is not None:
+            checkpoint_extra[1](state["extra"])
+        if verbose:
+            print(f"Resuming from iteration {gd_index} in {checkpoint_file}")
     if verbose:
         n_iters_tot = n_epochs * n_batches
         print(
@@ -146,14 +499,21 @@ def gradient_descent_adam(
             f"for a total of {n_iters_tot} iterations"
         )
 
-    for epoch in range(n_epochs):
-        for batch_index in range(n_batches):
+    for epoch in range(start_epoch, n_epochs):
+        first_batch_index = start_batch_index if epoch == start_epoch else 0
+        for batch_index in range(first_batch_index, n_batches):
             if verbose:
                 if batch_index % 10 == 0:
                     print(f"Epoch: {epoch}, batch iteration {batch_index}")
             is_small_batch = batch_calculator(batch_index, batch_size)
-            primary_val = primary_objective(theta)
-            g_vec = upper_bounds_function(theta)
+            if fused_gradients:
+                # Values and gradients from a single pass. The gradients
+                # are only used if no nan or inf shows up below
+                primary_val, grad_primary_theta_val = primary_value_and_grad(theta)
+                g_vec, gu_theta_vec = upper_bounds_value_and_jacobian(theta)
+            else:
+                primary_val = primary_objective(theta)
+                g_vec = upper_bounds_function(theta)
             L_val = primary_val + sum(lamb * g_vec)
 
             if debug:
@@ -180,11 +540,18 @@ def gradient_descent_adam(
                 candidate_solution = np.copy(theta)
 
             # store values
-            theta_vals.append(np.copy(theta))
-            lamb_vals.append(np.copy(lamb))
-            f_vals.append(primary_val)
-            g_vals.append(g_vec)
-            L_vals.append(L_val)
+            optimization_history.append(gd_index, theta, lamb, primary_val, g_vec, L_val)
+            g_norm = np.linalg.norm(g_vec)
+            if min_g_solution is None or g_norm < min_g_norm:
+                min_g_norm = g_norm
+                min_g_solution = (
+                    gd_index,
+                    primary_val,
+                    np.copy(lamb),
+                    g_vec,
+                    L_val,
+                    np.copy(theta),
+                )
 
             # if nans or infs appear in any quantities,
             # then stop gradient descent and return NSF
@@ -205,12 +572,15 @@ def gradient_descent_adam(
                 )
                 warnings.warn(warning_msg)
                 candidate_solution = "NSF"
+                stop_reason = "nan_or_inf"
+                n_iters = gd_index + 1
                 break
 
             # Obtain gradients of both terms in Lagrangian
             # at current values of theta and lambda
-            grad_primary_theta_val = grad_primary_theta(theta)
-            gu_theta_vec = grad_upper_bound_theta(theta)
+            if not fused_gradients:
+                grad_primary_theta_val = grad_primary_theta(theta)
+                gu_theta_vec = grad_upper_bound_theta(theta)
 
             grad_secondary_theta_val_vec = (
                 gu_theta_vec * lamb[:, None]
@@ -222,6 +592,40 @@ def gradient_descent_adam(
             # gradient w.r.t. to lambda is just g
             gradient_lamb_vec = g_vec
 
+            # Check the stopping criteria before updating theta and lambda
+            if tol_grad_norm is not None:
+                # lambda stays at 0 if g is negative
+                projected_gradient_lamb = np.where(
+                    (lamb <= 0) & (gradient_lamb_vec < 0), 0.0, gradient_lamb_vec
+                )
+                grad_norm = np.sqrt(
+                    np.sum(gradient_theta**2) + np.sum(projected_gradient_lamb**2)
+                )
+                if grad_norm <= tol_grad_norm:
+                    stop_reason = "grad_norm"
+            epoch_L_sum += L_val
+            if batch_index == n_batches - 1:
+                epoch_L_val = epoch_L_sum / n_batches
+                if (
+                    tol_rel_L is not None
+                    and prev_L_val is not None
+                    and abs(epoch_L_val - prev_L_val) <= tol_rel_L * abs(prev_L_val)
+                ):
+                    stop_reason = "rel_L"
+                prev_L_val = epoch_L_val
+                epoch_L_sum = 0.0
+            if (
+                patience is not None
+                and found_feasible_solution
+                and gd_index - best_index >= patience
+            ):
+                stop_reason = "patience"
+            if stop_reason != "max_iterations":
+                if verbose:
+                    print(f"Stopping at iteration {gd_index}: {stop_reason}")
+                n_iters = gd_index + 1
+                break
+
             # Momementum term
             velocity_theta = (
                 beta_velocity * velocity_theta + (1.0 - beta_velocity) * gradient_theta
@@ -246,6 +650,40 @@ def gradient_descent_adam(
             lamb[lamb < 0] = 0
 
             gd_index += 1
+            n_iters = gd_index
+
+            if checkpoint_file is not None and gd_index % checkpoint_every == 0:
+                next_epoch, next_batch_index = epoch, batch_index + 1
+                if next_batch_index == n_batches:
+                    next_epoch, next_batch_index = epoch + 1, 0
+                # Pickled in one go so that objects shared between
+                # entries, e.g., best_lamb and lamb, are still shared on resume
+                state = {
+                    "run_description": run_description,
+                    "epoch": next_epoch,
+                    "batch_index": next_batch_index,
+                    "gd_index": gd_index,
+                    "theta": theta,
+                    "lamb": lamb,
+                    "velocity_theta": velocity_theta,
+                    "s_theta": s_theta,
+                    "best_primary": best_primary,
+                    "best_index": best_index,
+                    "best_lamb": best_lamb,
+                    "best_g_vec": best_g_vec,
+                    "best_L": best_L,
+                    "candidate_solution": candidate_solution,
+                    "found_feasible_solution": found_feasible_solution,
+                    "min_g_norm": min_g_norm,
+                    "min_g_solution": min_g_solution,
+                    "epoch_L_sum": epoch_L_sum,
+                    "prev_L_val": prev_L_val,
+                    "history": optimization_history.get_state(),
+                    "extra": (
+                        checkpoint_extra[0]() if checkpoint_extra is not None else None
+                    ),
+                }
+                save_checkpoint(state, checkpoint_file)
         else:  # only executed if inner loop did not break
             continue
         break  # only executed if inner loop broke
@@ -270,12 +708,14 @@ def gradient_descent_adam(
                     "Returning solution with lowest sqrt(|g|**2)"
                 )
             # best g is when norm of g is minimized
-            best_index = np.argmin(np.linalg.norm(g_vals, axis=1))
-            best_primary = f_vals[best_index]
-            best_lamb = lamb_vals[best_index]
-            best_g_vec = g_vals[best_index]
-            best_L = L_vals[best_index]
-            candidate_solution = theta_vals[best_index]
+            (
+                best_index,
+                best_primary,
+                best_lamb,
+                best_g_vec,
+                best_L,
+                candidate_solution,
+            ) = min_g_solution
 
     solution["candidate_solution"] = candidate_solution
     solution["best_index"] = best_index
@@ -284,10 +724,9 @@ def gradient_descent_adam(
     solution["best_lamb"] = best_lamb
     solution["best_L"] = best_L
     solution["found_feasible_solution"] = found_feasible_solution
-    # solution["theta_vals"] = np.array(theta_vals) # takes up too much disk
-    solution["f_vals"] = np.array(f_vals)
-    solution["lamb_vals"] = np.array(lamb_vals)
-    solution["g_vals"] = np.array(g_vals)
-    solution["L_vals"] = np.array(L_vals)
+    solution["stop_reason"] = stop_reason
+    solution["n_iters"] = n_iters
+    optimization_history.close()
+    solution.update(optimization_history.to_dict())
 
     return solution
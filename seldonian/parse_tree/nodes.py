@@ -1,5 +1,6 @@
 from operator import itemgetter
 from functools import reduce, partial
+from collections import namedtuple
 import pandas as pd
 import autograd.numpy as np
 
@@ -123,6 +124,34 @@ class BaseNode(Node):
         """Overrides Node.__repr__()"""
         return super().__repr__() + ", " + "\u03B4" + f"={self.delta:g}"
 
+    def sample_key(self):
+        """
+        Key identifying the vector of estimates returned
+        by :py:meth:`zhat`, so that base nodes representing
+        the same quantity can share it, even across parse trees.
+
+        :return: Tuple of the measure function name, the conditional
+            columns and the class/confusion matrix indices, or None
+            if a child class overrides zhat() and the
+            samples cannot be shared, or overrides calculate_bounds()
+            or compute_HC_upper_and_lowerbound() and its bounds
+            may not come from the samples of zhat().
+        """
+        for method_name in [
+            "zhat",
+            "calculate_bounds",
+            "compute_HC_upper_and_lowerbound",
+        ]:
+            if getattr(type(self), method_name) is not getattr(BaseNode, method_name):
+                return None
+        return (
+            self.measure_function_name,
+            tuple(self.conditional_columns),
+            getattr(self, "class_index", None),
+            getattr(self, "cm_true_index", None),
+            getattr(self, "cm_pred_index", None),
+        )
+
     def calculate_value(self, **kwargs):
         """
         Calculate the value of the node
@@ -137,7 +166,9 @@ class BaseNode(Node):
     def mask_data(self, dataset, conditional_columns):
         """Mask features and labels using
         a joint AND mask where each of the
-        conditional columns is True.
+        conditional columns is True. See
+        :py:meth:`.SupervisedDataSet.get_masked_data`
+        and :py:meth:`.RLDataSet.get_masked_data`
 
         :param dataset:
             The candidate or safety dataset
@@ -150,43 +181,9 @@ class BaseNode(Node):
         :return: The masked dataframe
         :rtype: numpy ndarray
         """
-        # Figure out indices of sensitive attributes from their column names
-        sensitive_col_indices = [
-            dataset.sensitive_col_names.index(col) for col in conditional_columns
-        ]
-
-        joint_mask = reduce(
-            np.logical_and,
-            (
-                dataset.sensitive_attrs[:, col_index] == 1
-                for col_index in sensitive_col_indices
-            ),
-        )
-        if dataset.regime == "supervised_learning":
-            if type(dataset.features) == list:
-                masked_features = [x[joint_mask] for x in dataset.features]
-                masked_labels = [x[joint_mask] for x in dataset.labels]
-                # If possible, convert to numpy array. Not always possible,
-                # e.g., if features are of different dimensions.
-                try:
-                    masked_features = np.array(masked_features)
-                    masked_labels = np.array(masked_labels)
-                    n_masked = len(masked_features)
-                except Exception as e:
-                    # masked_features and masked_labels stay as lists
-                    n_masked = len(masked_features[0])
-            else:
-                # numpy array
-                masked_features = dataset.features[joint_mask]
-                masked_labels = dataset.labels[joint_mask]
-                n_masked = len(masked_features)
-
-            return masked_features, masked_labels, n_masked
-
-        elif dataset.regime == "reinforcement_learning":
-            masked_episodes = np.asarray(dataset.episodes)[joint_mask]
-            n_masked = len(masked_episodes)
-            return masked_episodes, n_masked
+        # The dataset caches the masked data for each
+        # combination of conditional columns
+        return dataset.get_masked_data(conditional_columns)
 
     def calculate_data_forbound(self, **kwargs):
         """
@@ -278,7 +275,12 @@ class BaseNode(Node):
                 # --TODO-- abstract away to support things like
                 # getting confidence intervals from bootstrap
                 # and RL cases
-                estimator_samples = self.zhat(**kwargs)
+                if kwargs.get("base_node_registry") is not None:
+                    estimator_samples = kwargs["base_node_registry"].get_samples(
+                        self, **kwargs
+                    )
+                else:
+                    estimator_samples = self.zhat(**kwargs)
 
                 branch = kwargs["branch"]
                 data_dict = kwargs["data_dict"]
@@ -368,9 +370,7 @@ class BaseNode(Node):
             bound_method = kwargs["bound_method"]
 
             if bound_method == "ttest":
-                lower = data.mean() - 2 * stddev(data) / np.sqrt(datasize) * tinv(
-                    1.0 - delta, datasize - 1
-                )
+                lower, _ = ttest_bounds(data, datasize, delta, upper=False, scale=2)
             else:
                 raise NotImplementedError(
                     f"Bounding method {bound_method} is not supported"
@@ -398,9 +398,7 @@ class BaseNode(Node):
         if "bound_method" in kwargs:
             bound_method = kwargs["bound_method"]
             if bound_method == "ttest":
-                lower = data.mean() + 2 * stddev(data) / np.sqrt(datasize) * tinv(
-                    1.0 - delta, datasize - 1
-                )
+                _, lower = ttest_bounds(data, datasize, delta, lower=False, scale=2)
             else:
                 raise NotImplementedError(
                     f"Bounding method {bound_method} is not supported"
@@ -433,6 +431,9 @@ class BaseNode(Node):
         if "bound_method" in kwargs:
             bound_method = kwargs["bound_method"]
             if bound_method == "ttest":
+                # Summarize the data once for both bounds
+                if not isinstance(data, SufficientStatistics):
+                    data = SufficientStatistics.from_samples(data)
                 lower = self.predict_HC_lowerbound(
                     data=data, datasize=datasize, delta=delta / 2, **kwargs
                 )
@@ -468,9 +469,7 @@ class BaseNode(Node):
         if "bound_method" in kwargs:
             bound_method = kwargs["bound_method"]
             if bound_method == "ttest":
-                lower = data.mean() - stddev(data) / np.sqrt(datasize) * tinv(
-                    1.0 - delta, datasize - 1
-                )
+                lower, _ = ttest_bounds(data, datasize, delta, upper=False)
             else:
                 raise NotImplementedError(
                     f"Bounding method {bound_method}" " is not supported"
@@ -496,9 +495,7 @@ class BaseNode(Node):
         if "bound_method" in kwargs:
             bound_method = kwargs["bound_method"]
             if bound_method == "ttest":
-                upper = data.mean() + stddev(data) / np.sqrt(datasize) * tinv(
-                    1.0 - delta, datasize - 1
-                )
+                _, upper = ttest_bounds(data, datasize, delta, lower=False)
             else:
                 raise NotImplementedError(
                     f"Bounding method {bound_method}" " is not supported"
@@ -530,6 +527,9 @@ class BaseNode(Node):
         if "bound_method" in kwargs:
             bound_method = kwargs["bound_method"]
             if bound_method == "ttest":
+                # Summarize the data once for both bounds
+                if not isinstance(data, SufficientStatistics):
+                    data = SufficientStatistics.from_samples(data)
                 lower = self.compute_HC_lowerbound(
                     data=data, datasize=datasize, delta=delta / 2, **kwargs
                 )
@@ -552,6 +552,45 @@ class BaseNode(Node):
         return lower, upper
 
 
+class BaseNodeRegistry(object):
+    def __init__(self):
+        """Registry of base node estimates shared by
+        all of the parse trees in a spec. Each unique base
+        variable (see :py:meth:`.BaseNode.sample_key`) has its vector
+        of estimates computed once and every tree
+        then calculates its own confidence bound
+        from the shared vector.
+
+        The estimates are only valid for a single value
+        of the model weights and a single dataset,
+        so :py:meth:`reset` must be called whenever either changes.
+
+        :ivar samples: The cached estimates,
+            keyed by base node sample key
+        :vartype samples: dict
+        """
+        self.samples = {}
+
+    def reset(self):
+        """Drop all cached estimates"""
+        self.samples = {}
+
+    def get_samples(self, node, **kwargs):
+        """Get the vector of estimates for a base node,
+        calculating them with node.zhat() if they are
+        not already in the registry
+
+        :param node: The base node
+        :type node: :py:class:`.BaseNode` object
+        """
+        key = node.sample_key()
+        if key is None:
+            return node.zhat(**kwargs)
+        if key not in self.samples:
+            self.samples[key] = node.zhat(**kwargs)
+        return self.samples[key]
+
+
 class ConfusionMatrixBaseNode(BaseNode):
     def __init__(
         self,
@@ -1115,3 +1154,60 @@ class InternalNode(Node):
         """
         super().__init__(name, lower, upper, **kwargs)
         self.node_type = "internal_node"
+
+
+class NodeSnapshot(
+    namedtuple(
+        "NodeSnapshot",
+        [
+            "name",
+            "index",
+            "node_type",
+            "lower",
+            "upper",
+            "will_lower_bound",
+            "will_upper_bound",
+            "delta",
+            "value",
+            "left",
+            "right",
+        ],
+    )
+):
+    """Immutable copy of the bounds, value and delta of a parse tree
+    node and of its children, without any of the data used to compute
+    them. Displayed like the node it was made from.
+    See :py:class:`.ParseTreeSnapshot`
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_node(cls, node):
+        """Snapshot of a node and its descendants
+
+        :param node: The node
+        :type node: :py:class:`.Node` object
+        """
+        if node is None:
+            return None
+        return cls(
+            name=node.name,
+            index=node.index,
+            node_type=getattr(node, "node_type", None),
+            lower=node.lower,
+            upper=node.upper,
+            will_lower_bound=node.will_lower_bound,
+            will_upper_bound=node.will_upper_bound,
+            delta=getattr(node, "delta", None),
+            value=getattr(node, "value", None),
+            left=cls.from_node(node.left),
+            right=cls.from_node(node.right),
+        )
+
+    def __repr__(self):
+        """Same as the repr of the node the snapshot was made from"""
+        if self.node_type == "base_node":
+            return Node.__repr__(self) + ", " + "\u03B4" + f"={self.delta:g}"
+        return Node.__repr__(self)
+
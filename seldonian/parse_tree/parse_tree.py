@@ -72,6 +72,11 @@ class ParseTree(object):
                 for supervised regression or "PR", i.e. Positive Rate
                 for supervised classification.
         :vartype available_measure_functions: int
+        :ivar tape:
+                Flat list of instructions used to propagate bounds,
+                created by :py:meth:`compile`. None if the tree
+                has not been compiled.
+        :vartype tape: list
         """
         if not (0.0 < delta < 1.0):
             raise ValueError("delta must be in (0,1)")
@@ -85,6 +90,7 @@ class ParseTree(object):
         self.n_base_nodes = 0
         self.base_node_dict = {}
         self.node_fontsize = 12
+        self.tape = None
         self.available_measure_functions = measure_functions_dict[self.regime][
             self.sub_regime
         ]
@@ -113,6 +119,8 @@ class ParseTree(object):
 
         self.assign_bounds_needed()
 
+        self.compile()
+
     def create_from_ast(self, s):
         """
         Create the node structure of the tree
@@ -127,6 +135,8 @@ class ParseTree(object):
         preprocessed_s = self._preprocess_constraint_str(s)
         self.constraint_str = preprocessed_s
         self.node_index = 0
+        # Any existing tape refers to the old nodes
+        self.tape = None
 
         tree = ast.parse(preprocessed_s)
         # makes sure this is a single expression
@@ -655,17 +665,131 @@ class ParseTree(object):
                 )
             return
 
+    def compile(self):
+        """
+        Lower the tree into a flat tape of interval operations
+        so that bounds can be propagated with a single loop
+        instead of a recursive walk through the nodes.
+        Must be called after the bounds needed by each node are assigned.
+
+        Each node gets a slot holding its (lower, upper) interval.
+        Base nodes with the same name share one slot, so their
+        bounds are computed once. Constant slots are filled in here,
+        the tape contains one instruction per unique base node
+        and per internal node, in postorder.
+        """
+        interval_ops = {
+            "add": self._add,
+            "sub": self._sub,
+            "mult": self._mult,
+            "div": self._div,
+            "pow": self._pow_with_warning,
+            "min": self._min,
+            "max": self._max,
+            "abs": self._abs,
+            "exp": self._exp,
+            "log": self._log,
+        }
+        self.tape = []
+        self.tape_slots = []
+        self.tape_nodes = []  # (node, slot) pairs to write bounds back to
+        base_node_slots = {}
+
+        def lower_node(node):
+            if isinstance(node, BaseNode):
+                if node.name in base_node_slots:
+                    slot = base_node_slots[node.name]
+                else:
+                    slot = len(self.tape_slots)
+                    self.tape_slots.append((node.lower, node.upper))
+                    base_node_slots[node.name] = slot
+                    self.tape.append((None, node, slot, None, None))
+            elif isinstance(node, ConstantNode):
+                slot = len(self.tape_slots)
+                self.tape_slots.append((node.lower, node.upper))
+            else:
+                if node.name not in interval_ops:
+                    raise NotImplementedError(
+                        "Encountered an operation we do not yet support", node.name
+                    )
+                left_slot = lower_node(node.left)
+                right_slot = lower_node(node.right) if node.right else None
+                slot = len(self.tape_slots)
+                self.tape_slots.append((node.lower, node.upper))
+                self.tape.append(
+                    (interval_ops[node.name], node, slot, left_slot, right_slot)
+                )
+            self.tape_nodes.append((node, slot))
+            return slot
+
+        if self.root:
+            lower_node(self.root)
+
+    def snapshot(self):
+        """
+        Record the bounds of the tree without the data
+        used to compute them
+
+        :rtype: :py:class:`.ParseTreeSnapshot`
+        """
+        return ParseTreeSnapshot(self)
+
+    def get_base_nodes(self):
+        """
+        Get the base nodes of the tree, one per
+        base node name, in postorder
+
+        :return: List of base nodes
+        :rtype: List(:py:class:`.BaseNode` objects)
+        """
+        base_nodes = {}
+
+        def helper(node):
+            if not node:
+                return
+            if isinstance(node, BaseNode):
+                base_nodes.setdefault(node.name, node)
+                return
+            helper(node.left)
+            helper(node.right)
+
+        helper(self.root)
+        return list(base_nodes.values())
+
     def propagate_bounds(self, **kwargs):
         """
         Postorder traverse (left, right, root)
         through the tree and calculate confidence
         bounds on base nodes,
-        then propagate bounds using propagation logic
+        then propagate bounds using propagation logic.
+        Uses the tape if the tree has been compiled.
         """
         if not self.root:
             return []
 
-        self._propagator_helper(self.root, **kwargs)
+        if getattr(self, "tape", None) is not None:
+            self._run_tape(**kwargs)
+        else:
+            self._propagator_helper(self.root, **kwargs)
+
+    def _run_tape(self, **kwargs):
+        """
+        Propagate bounds by executing the tape
+        created by :py:meth:`compile`
+        """
+        slots = list(self.tape_slots)
+        for op, node, slot, left_slot, right_slot in self.tape:
+            if op is None:
+                # base node
+                self._calculate_base_node_bounds(node, **kwargs)
+                slots[slot] = (node.lower, node.upper)
+            elif right_slot is None:
+                slots[slot] = op(slots[left_slot])
+            else:
+                slots[slot] = op(slots[left_slot], slots[right_slot])
+
+        for node, slot in self.tape_nodes:
+            node.lower, node.upper = slots[slot]
 
     def _propagator_helper(self, node, **kwargs):
         """
@@ -684,46 +808,7 @@ class ParseTree(object):
         # if we hit a BaseNode,
         # then calculate confidence bounds and return
         if isinstance(node, BaseNode):
-            # Check if bound has already been calculated for this node name
-            # If so, use precalculated bound
-            if self.base_node_dict[node.name]["bound_computed"] == True:
-                node.lower = self.base_node_dict[node.name]["lower"]
-                node.upper = self.base_node_dict[node.name]["upper"]
-                return
-            else:
-                # Need to calculate the bound
-                if "dataset" in kwargs:
-                    # Check if data has already been prepared
-                    # for this node name. If so, use precalculated data
-                    if self.base_node_dict[node.name]["data_dict"] != None:
-                        data_dict = self.base_node_dict[node.name]["data_dict"]
-                        datasize = self.base_node_dict[node.name]["datasize"]
-                    else:
-                        # Data not prepared already. Need to do that.
-                        data_dict, datasize = node.calculate_data_forbound(**kwargs)
-                        self.base_node_dict[node.name]["data_dict"] = data_dict
-                        self.base_node_dict[node.name]["datasize"] = datasize
-
-                    kwargs["data_dict"] = data_dict
-                    kwargs["datasize"] = datasize
-
-                bound_method = self.base_node_dict[node.name]["bound_method"]
-                if isinstance(node, ConfusionMatrixBaseNode):
-                    kwargs["cm_true_index"] = node.cm_true_index
-                    kwargs["cm_pred_index"] = node.cm_pred_index
-                bound_result = node.calculate_bounds(
-                    bound_method=bound_method, **kwargs
-                )
-                self.base_node_dict[node.name]["bound_computed"] = True
-
-                if node.will_lower_bound:
-                    node.lower = bound_result["lower"]
-                    self.base_node_dict[node.name]["lower"] = node.lower
-
-                if node.will_upper_bound:
-                    node.upper = bound_result["upper"]
-                    self.base_node_dict[node.name]["upper"] = node.upper
-
+            self._calculate_base_node_bounds(node, **kwargs)
             return
 
         # traverse to children first
@@ -733,6 +818,54 @@ class ParseTree(object):
         # Here we must be at an internal node and therefore need to propagate
         node.lower, node.upper = self.propagate(node)
 
+    def _calculate_base_node_bounds(self, node, **kwargs):
+        """
+        Calculate the confidence bounds on a base node and
+        store them on the node. Uses the bounds in
+        self.base_node_dict if they were already computed
+        for this node name.
+
+        :param node: base node in the parse tree
+        :type node: :py:class:`.BaseNode` object
+        """
+        # Check if bound has already been calculated for this node name
+        # If so, use precalculated bound
+        if self.base_node_dict[node.name]["bound_computed"] == True:
+            node.lower = self.base_node_dict[node.name]["lower"]
+            node.upper = self.base_node_dict[node.name]["upper"]
+            return
+
+        # Need to calculate the bound
+        if "dataset" in kwargs:
+            # Check if data has already been prepared
+            # for this node name. If so, use precalculated data
+            if self.base_node_dict[node.name]["data_dict"] != None:
+                data_dict = self.base_node_dict[node.name]["data_dict"]
+                datasize = self.base_node_dict[node.name]["datasize"]
+            else:
+                # Data not prepared already. Need to do that.
+                data_dict, datasize = node.calculate_data_forbound(**kwargs)
+                self.base_node_dict[node.name]["data_dict"] = data_dict
+                self.base_node_dict[node.name]["datasize"] = datasize
+
+            kwargs["data_dict"] = data_dict
+            kwargs["datasize"] = datasize
+
+        bound_method = self.base_node_dict[node.name]["bound_method"]
+        if isinstance(node, ConfusionMatrixBaseNode):
+            kwargs["cm_true_index"] = node.cm_true_index
+            kwargs["cm_pred_index"] = node.cm_pred_index
+        bound_result = node.calculate_bounds(bound_method=bound_method, **kwargs)
+        self.base_node_dict[node.name]["bound_computed"] = True
+
+        if node.will_lower_bound:
+            node.lower = bound_result["lower"]
+            self.base_node_dict[node.name]["lower"] = node.lower
+
+        if node.will_upper_bound:
+            node.upper = bound_result["upper"]
+            self.base_node_dict[node.name]["upper"] = node.upper
+
     def evaluate_constraint(self, **kwargs):
         """
         Evaluate the constraint itself (not bounds)
@@ -1062,6 +1195,19 @@ class ParseTree(object):
 
         return (lower, upper)
 
+    def _pow_with_warning(self, a, b):
+        """
+        Same as :py:meth:`_pow`, but warns
+        that the power operation is experimental.
+        Used by the tape created in :py:meth:`compile`
+        """
+        warning_msg = (
+            "Warning: Power operation "
+            "is an experimental feature. Use with caution."
+        )
+        warnings.warn(warning_msg)
+        return self._pow(a, b)
+
     def _min(self, a, b):
         """
         Get the minimum of two confidence intervals
@@ -1240,6 +1386,43 @@ class ParseTree(object):
             self.make_viz_helper(root.right, graph)
 
 
+class ParseTreeSnapshot(object):
+    def __init__(self, parse_tree):
+        """
+        Lightweight record of a parse tree after its bounds
+        have been propagated, e.g., in the safety test. Holds the
+        bounds, values and deltas of the nodes in an immutable
+        copy of the tree (see :py:class:`.NodeSnapshot`) and the entries of
+        base_node_dict, but none of the data used to compute the bounds.
+
+        Like a :py:class:`.ParseTree`, has a root whose lower and
+        upper attributes are the bounds on the constraint, and
+        can be visualized with :py:meth:`make_viz`.
+
+        :param parse_tree: The parse tree
+        :type parse_tree: :py:class:`.ParseTree` object
+        """
+        self.constraint_str = parse_tree.constraint_str
+        self.delta = parse_tree.delta
+        self.regime = parse_tree.regime
+        self.sub_regime = parse_tree.sub_regime
+        self.n_nodes = parse_tree.n_nodes
+        self.n_base_nodes = parse_tree.n_base_nodes
+        self.node_fontsize = parse_tree.node_fontsize
+        self.root = NodeSnapshot.from_node(parse_tree.root)
+        self.base_node_dict = {
+            node_name: {
+                key: value
+                for key, value in base_node_info.items()
+                if key != "data_dict"
+            }
+            for node_name, base_node_info in parse_tree.base_node_dict.items()
+        }
+
+    make_viz = ParseTree.make_viz
+    make_viz_helper = ParseTree.make_viz_helper
+
+
 def make_parse_trees_from_constraints(
     constraint_strs,
     deltas,
@@ -1,7 +1,11 @@
 """ Module for running safety test """
 
 import autograd.numpy as np  # Thinly-wrapped version of Numpy
-import copy
+
+from seldonian.models import objectives
+from seldonian.parse_tree.nodes import BaseNodeRegistry, ConfusionMatrixBaseNode
+from seldonian.dataset import EpisodeStore
+from seldonian.utils.stats_utils import SufficientStatistics, weighted_sum_gamma
 
 
 class SafetyTest(object):
@@ -29,9 +33,11 @@ class SafetyTest(object):
         self.model = model
         self.parse_trees = parse_trees
         self.regime = regime
+        # Shares base node estimates across parse trees
+        self.base_node_registry = BaseNodeRegistry()
         self.st_result = {}  # stores parse tree evaluated on safety test data
 
-    def run(self, solution, batch_size_safety=None, **kwargs):
+    def run(self, solution, batch_size_safety=None, stream_safety=False, **kwargs):
         """Loop over parse trees, calculate the bounds on leaf nodes
         and propagate to the root node. The safety test passes if
         the upper bounds of all parse tree root nodes are less than or equal to 0.
@@ -44,15 +50,37 @@ class SafetyTest(object):
                 to pass through the measure functions at a time
         :type batch_size_safety: int
 
+        :param stream_safety: Whether to compute the t-test bounds
+                from statistics accumulated over chunks of batch_size_safety
+                datapoints, see :py:meth:`stream_statistics`
+        :type stream_safety: bool, defaults to False
+
         :return: passed, whether the candidate solution passed the safety test
         :rtype: bool
 
         """
         passed = True
+        self.base_node_registry.reset()
+
+        if stream_safety:
+            statistics = self.stream_statistics(
+                solution, chunk_size=batch_size_safety, **kwargs
+            )
+            # The bounds are computed from the statistics in the registry
+            self.base_node_registry.samples.update(statistics)
 
         for tree_i, pt in enumerate(self.parse_trees):
             # before we propagate reset the tree
             pt.reset_base_node_dict()
+            if stream_safety:
+                # The data were already used. Skip preparing them
+                for node in pt.get_base_nodes():
+                    key = node.sample_key()
+                    if key in statistics:
+                        pt.base_node_dict[node.name]["data_dict"] = {}
+                        pt.base_node_dict[node.name]["datasize"] = statistics[
+                            key
+                        ].count
 
             bounds_kwargs = dict(
                 theta=solution,
@@ -61,20 +89,256 @@ class SafetyTest(object):
                 branch="safety_test",
                 regime=self.regime,
                 batch_size_safety=batch_size_safety,
+                base_node_registry=self.base_node_registry,
                 **kwargs
             )
 
             pt.propagate_bounds(**bounds_kwargs)
             # Check if the i-th behavioral constraint is satisfied
             upperBound = pt.root.upper
-            self.st_result[pt.constraint_str] = copy.deepcopy(pt)
+            # Keep the bounds, but not the data cached in the tree
+            self.st_result[pt.constraint_str] = pt.snapshot()
             if (
                 upperBound > 0.0
             ):  # If the current constraint was not satisfied, the safety test failed
                 passed = False
 
+        if stream_safety:
+            # Drop the placeholders so the data get prepared next time
+            for pt in self.parse_trees:
+                for node_name in pt.base_node_dict:
+                    pt.base_node_dict[node_name]["data_dict"] = None
+                    pt.base_node_dict[node_name]["datasize"] = 0
+        # Release the estimates and predictions cached for this solution,
+        # and the masked data and (RL) features cached for the dataset
+        self.base_node_registry.reset()
+        objectives.prediction_cache.clear()
+        self.safety_dataset.clear_masked_data_cache()
+        if hasattr(self.model, "clear_features_cache"):
+            self.model.clear_features_cache()
         return passed
 
+    def run_many(self, thetas, batch_size_safety=None, stream_safety=False, **kwargs):
+        """Run the safety test on a pool of candidate solutions,
+        e.g., the solutions found from several starting points.
+        The data for each base node are prepared once for all solutions.
+        If the model has a predict_many() method, the predictions
+        of all solutions are made up front with one call per
+        prepared feature array, and :py:meth:`run` reuses them
+        through :py:data:`.objectives.prediction_cache`.
+
+        After this method returns, self.st_result holds the
+        parse trees evaluated at the last solution.
+
+        :param thetas: The candidate solutions, all of the same shape
+        :type thetas: numpy ndarray or List(numpy ndarray)
+
+        :param batch_size_safety: The number of datapoints
+                to pass through the measure functions at a time.
+                Predictions are only made up front if this is None.
+        :type batch_size_safety: int
+
+        :param stream_safety: Whether to compute the t-test bounds
+                from statistics accumulated over chunks of batch_size_safety
+                datapoints, see :py:meth:`stream_statistics`.
+                Predictions are not made up front if True.
+        :type stream_safety: bool, defaults to False
+
+        :return: passed, upper_bounds. passed[i][j] is whether
+                solution i satisfies the j-th behavioral constraint,
+                and upper_bounds[i][j] is the upper bound
+                on the j-th parse tree root node at solution i
+        :rtype: Tuple(numpy ndarray, numpy ndarray),
+                each of shape (len(thetas),len(self.parse_trees))
+        """
+        thetas = np.asarray(thetas, dtype=float)
+        upper_bounds = np.zeros((len(thetas), len(self.parse_trees)))
+
+        stacked = []
+        if (
+            hasattr(self.model, "predict_many")
+            and batch_size_safety is None
+            and not stream_safety
+            and len(thetas) > 0
+        ):
+            stacked = [
+                (X, self.model.predict_many(thetas, X))
+                for X in self.prepare_features(thetas[0], **kwargs)
+            ]
+
+        for theta_i, theta in enumerate(thetas):
+            for X, predictions in stacked:
+                objectives.prediction_cache.store(
+                    self.model, theta, X, predictions[theta_i]
+                )
+            self.run(
+                theta,
+                batch_size_safety=batch_size_safety,
+                stream_safety=stream_safety,
+                **kwargs
+            )
+            for tree_i, pt in enumerate(self.parse_trees):
+                upper_bounds[theta_i, tree_i] = pt.root.upper
+
+        # Same criterion as run()
+        passed = ~(upper_bounds > 0.0)
+        return passed, upper_bounds
+
+    def prepare_features(self, solution, **kwargs):
+        """Prepare the data of every base node in the parse
+        trees, as :py:meth:`.ParseTree.propagate_bounds` would, and
+        collect the distinct feature arrays the model will predict on
+
+        :param solution: Any candidate solution
+        :type solution: numpy ndarray
+
+        :return: The feature arrays
+        :rtype: List(numpy ndarray)
+        """
+        features = []
+        for pt in self.parse_trees:
+            for node in pt.get_base_nodes():
+                node_dict = pt.base_node_dict[node.name]
+                if node_dict["data_dict"] is None:
+                    data_dict, datasize = node.calculate_data_forbound(
+                        theta=solution,
+                        dataset=self.safety_dataset,
+                        model=self.model,
+                        branch="safety_test",
+                        regime=self.regime,
+                        **kwargs
+                    )
+                    node_dict["data_dict"] = data_dict
+                    node_dict["datasize"] = datasize
+                X = node_dict["data_dict"].get("features")
+                # Masked features are cached by the dataset,
+                # so nodes with the same conditional columns share them
+                if isinstance(X, np.ndarray) and not any(X is F for F in features):
+                    features.append(X)
+        return features
+
+    def stream_statistics(self, solution, chunk_size=None, **kwargs):
+        """Make one pass over the safety dataset, chunk_size
+        datapoints (episodes for RL) at a time, and accumulate the
+        :py:class:`.SufficientStatistics` of the estimates of each base node
+        whose bound is a t-test. Only one chunk of the data and
+        of the estimates is in memory at a time, so the dataset
+        can be memory-mapped.
+
+        Base nodes without a sample key, e.g., those which override
+        zhat() or calculate_bounds() (see :py:meth:`.BaseNode.sample_key`),
+        are left out, and are bounded from the full dataset as usual.
+
+        :param solution:
+                The solution found by candidate selection
+        :type solution: numpy ndarray
+
+        :param chunk_size: The number of datapoints per chunk.
+                If None, the dataset is a single chunk
+        :type chunk_size: int
+
+        :return: Statistics keyed by base node sample key
+                (see :py:meth:`.BaseNode.sample_key`)
+        :rtype: dict
+        """
+        nodes = {}
+        for pt in self.parse_trees:
+            for node in pt.get_base_nodes():
+                key = node.sample_key()
+                bound_method = pt.base_node_dict[node.name]["bound_method"]
+                if key is not None and bound_method == "ttest":
+                    nodes.setdefault(key, node)
+        statistics = {key: SufficientStatistics() for key in nodes}
+
+        num_datapoints = self.safety_dataset.num_datapoints
+        if chunk_size is None:
+            chunk_size = num_datapoints
+        for start in range(0, num_datapoints, chunk_size):
+            rows = slice(start, start + chunk_size)
+            # Nodes with the same conditional columns share the chunk
+            chunk_data = {}
+            for key, node in nodes.items():
+                conditional_columns = tuple(node.conditional_columns)
+                if conditional_columns not in chunk_data:
+                    chunk_data[conditional_columns] = self.get_chunk_data(
+                        rows, conditional_columns
+                    )
+                data_dict, datasize = chunk_data[conditional_columns]
+                if datasize == 0:
+                    continue
+                node_kwargs = {}
+                if isinstance(node, ConfusionMatrixBaseNode):
+                    node_kwargs["cm_true_index"] = node.cm_true_index
+                    node_kwargs["cm_pred_index"] = node.cm_pred_index
+                samples = node.zhat(
+                    model=self.model,
+                    theta=solution,
+                    data_dict=data_dict,
+                    datasize=datasize,
+                    dataset=self.safety_dataset,
+                    branch="safety_test",
+                    regime=self.regime,
+                    **node_kwargs,
+                    **kwargs
+                )
+                statistics[key].update(samples)
+            objectives.prediction_cache.clear()
+
+        return statistics
+
+    def get_chunk_data(self, rows, conditional_columns=()):
+        """Get the data in some rows (episodes for RL)
+        of the safety dataset where each of the conditional columns is 1
+
+        :param rows: The rows
+        :type rows: slice
+        :param conditional_columns: Columns for which to create
+                the joint AND mask on the rows
+        :type conditional_columns: tuple(str)
+
+        :return: data_dict, datasize
+        """
+        dataset = self.safety_dataset
+        mask = None
+        if conditional_columns:
+            sensitive_col_indices = [
+                dataset.sensitive_col_names.index(col) for col in conditional_columns
+            ]
+            mask = np.all(
+                np.asarray(dataset.sensitive_attrs[rows])[:, sensitive_col_indices]
+                == 1,
+                axis=1,
+            )
+
+        if self.regime == "supervised_learning":
+            features = dataset.features
+            if type(features) == list:
+                features = [x[rows] for x in features]
+            else:
+                features = features[rows]
+            labels = dataset.labels[rows]
+            if mask is not None:
+                if type(features) == list:
+                    features = [x[mask] for x in features]
+                else:
+                    features = features[mask]
+                labels = labels[mask]
+            return {"features": features, "labels": labels}, len(labels)
+
+        elif self.regime == "reinforcement_learning":
+            episodes = dataset.episodes[rows]
+            if mask is not None:
+                if isinstance(episodes, EpisodeStore):
+                    episodes = episodes[mask]
+                else:
+                    episodes = list(np.asarray(episodes)[mask])
+            gamma = self.model.env_kwargs["gamma"]
+            weighted_returns = [
+                weighted_sum_gamma(ep.rewards, gamma) for ep in episodes
+            ]
+            data_dict = {"episodes": episodes, "weighted_returns": weighted_returns}
+            return data_dict, len(episodes)
+
     def evaluate_primary_objective(self, theta, primary_objective):
         """Get value of the primary objective given model weights,
         theta, on the safety dataset. Wrapper for primary_objective where
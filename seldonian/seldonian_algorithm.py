@@ -248,13 +248,15 @@ class SeldonianAlgorithm:
 
         return self.initial_solution
 
-    def run(self, write_cs_logfile=False, debug=False):
+    def run(self, write_cs_logfile=False, debug=False, resume=False):
         """
         Runs seldonian algorithm using spec object
 
         :param write_cs_logfile: Whether to write candidate selection
                 log file
         :param debug: Whether to print out debugging info
+        :param resume: Whether to resume candidate selection from the
+                checkpoint_file in the optimization hyperparameters
         :return: (passed_safety, solution). passed_safety
                 indicates whether solution found during candidate selection
                 passes the safety test. solution is the optimized
@@ -265,7 +267,7 @@ class SeldonianAlgorithm:
             verbose=debug
         )  # sets self.initial_solution so it can be used in candidate selection
         candidate_solution = self.run_candidate_selection(
-            write_logfile=write_cs_logfile, debug=debug
+            write_logfile=write_cs_logfile, debug=debug, resume=resume
         )
 
         if type(candidate_solution) == str and candidate_solution == "NSF":
@@ -279,15 +281,20 @@ class SeldonianAlgorithm:
         passed_safety, solution = self.run_safety_test(
             candidate_solution=candidate_solution,
             batch_size_safety=batch_size_safety,
+            # specs pickled before streaming existed
+            stream_safety=getattr(self.spec, "stream_safety", False),
             debug=debug,
         )
 
         return passed_safety, solution
 
-    def run_candidate_selection(self, write_logfile=False, debug=False):
+    def run_candidate_selection(self, write_logfile=False, debug=False, resume=False):
         cs = self.candidate_selection(write_logfile=write_logfile)
+        optimization_hyperparams = dict(self.spec.optimization_hyperparams)
+        if resume:
+            optimization_hyperparams["resume"] = True
         candidate_solution = cs.run(
-            **self.spec.optimization_hyperparams,
+            **optimization_hyperparams,
             use_builtin_primary_gradient_fn=self.spec.use_builtin_primary_gradient_fn,
             custom_primary_gradient_fn=self.spec.custom_primary_gradient_fn,
             debug=debug,
@@ -297,13 +304,23 @@ class SeldonianAlgorithm:
         self.cs_result = cs.optimization_result
         return candidate_solution
 
-    def run_safety_test(self, candidate_solution, batch_size_safety=None, debug=False):
+    def run_safety_test(
+        self,
+        candidate_solution,
+        batch_size_safety=None,
+        stream_safety=False,
+        debug=False,
+    ):
         """
         Runs safety test using solution from candidate selection
         or some other means
 
         :param candidate_solution: model weights from candidate selection
                 or other process
+        :param batch_size_safety: The number of datapoints
+                to pass through the measure functions at a time
+        :param stream_safety: Whether to stream the safety data,
+                see :py:meth:`.SafetyTest.run`
         :param debug: Whether to print out debugging info
         :return: (passed_safety, solution). passed_safety
                 indicates whether solution found during candidate selection
@@ -313,7 +330,11 @@ class SeldonianAlgorithm:
         """
 
         st = self.safety_test()
-        passed_safety = st.run(candidate_solution, batch_size_safety=batch_size_safety)
+        passed_safety = st.run(
+            candidate_solution,
+            batch_size_safety=batch_size_safety,
+            stream_safety=stream_safety,
+        )
         if not passed_safety:
             if debug:
                 print("Failed safety test")
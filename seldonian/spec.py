@@ -52,6 +52,14 @@ class Spec(object):
     :param regularization_hyperparams: Hyperparameters for
             regularization during candidate selection. See :ref:`candidate_selection`.
     :type regularization_hyperparams: dict
+    :param batch_size_safety: The number of datapoints to pass
+            through the measure functions at a time in the safety test
+    :type batch_size_safety: int, defaults to None
+    :param stream_safety: Whether the safety test accumulates
+            the statistics of the t-test bounds over chunks of
+            batch_size_safety datapoints, so that the estimates
+            for the whole safety dataset are never in memory at once
+    :type stream_safety: bool, defaults to False
     """
 
     def __init__(
@@ -80,6 +88,7 @@ class Spec(object):
         },
         regularization_hyperparams={},
         batch_size_safety=None,
+        stream_safety=False,
         verbose=False,
     ):
         self.dataset = dataset
@@ -96,6 +105,7 @@ class Spec(object):
         self.optimization_hyperparams = optimization_hyperparams
         self.regularization_hyperparams = regularization_hyperparams
         self.batch_size_safety = batch_size_safety
+        self.stream_safety = stream_safety
         self.verbose = verbose
 
 
@@ -170,6 +180,7 @@ class SupervisedSpec(Spec):
         },
         regularization_hyperparams={},
         batch_size_safety=None,
+        stream_safety=False,
         verbose=False,
     ):
         super().__init__(
@@ -187,6 +198,7 @@ class SupervisedSpec(Spec):
             optimization_hyperparams=optimization_hyperparams,
             regularization_hyperparams=regularization_hyperparams,
             batch_size_safety=batch_size_safety,
+            stream_safety=stream_safety,
             verbose=verbose,
         )
         self.sub_regime = sub_regime
@@ -277,6 +289,7 @@ class RLSpec(Spec):
         },
         regularization_hyperparams={},
         batch_size_safety=None,
+        stream_safety=False,
         verbose=False,
     ):
         super().__init__(
@@ -294,6 +307,7 @@ class RLSpec(Spec):
             optimization_hyperparams=optimization_hyperparams,
             regularization_hyperparams=regularization_hyperparams,
             batch_size_safety=batch_size_safety,
+            stream_safety=stream_safety,
             verbose=verbose,
         )
 
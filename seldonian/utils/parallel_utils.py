@@ -0,0 +1,28 @@
+""" Utilities for running work in several processes """
+
+import multiprocessing as mp
+import warnings
+
+
+def get_fork_context(n_workers):
+    """Get the multiprocessing context to run n_workers
+    worker processes with. Workers are started with fork so that
+    they inherit the data of this process instead of having
+    them pickled and sent to them.
+
+    :param n_workers: The number of worker processes requested
+    :type n_workers: int
+
+    :return: The fork context, or None if n_workers <= 1
+        or fork is not available on this platform (e.g., Windows),
+        in which case the work should be done in this process
+    """
+    if n_workers <= 1:
+        return None
+    if "fork" not in mp.get_all_start_methods():
+        warnings.warn(
+            "Starting processes with fork is not supported on this platform. "
+            "Running in a single process instead."
+        )
+        return None
+    return mp.get_context("fork")
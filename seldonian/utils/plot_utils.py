@@ -38,8 +38,12 @@ def plot_gradient_descent(
             Only relevant when save=False
     :type show: bool
     """
+    if len(solution["g_vals"]) == 0:
+        raise ValueError(
+            "The solution has no history of the constraints to plot. "
+            "Run gradient descent with history 'all', 'every' or 'last'"
+        )
     # Extract values from dictionary
-    theta_vals = solution["theta_vals"]
     lamb_vals = solution[
         "lamb_vals"
     ]  # i x j array where i is number of iterations, j is number of constraints
@@ -70,7 +74,8 @@ def plot_gradient_descent(
     g_vals_masked = g_vals[final_mask]
     lamb_vals_masked = np.array(lamb_vals)[final_mask]
     L_vals_masked = np.array(L_vals)[final_mask]
-    its = np.arange(len(f_vals))
+    # Iterations the values were recorded at
+    its = solution.get("history_iterations", np.arange(len(f_vals)))
     its_masked = its[final_mask]
 
     # Running average f and L
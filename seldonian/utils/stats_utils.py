@@ -1,5 +1,6 @@
 import autograd.numpy as np  # Thinly-wrapped version of Numpy
-from scipy.stats import t
+from functools import lru_cache
+from scipy.stats import t, norm
 
 
 def stddev(v):
@@ -7,14 +8,106 @@ def stddev(v):
     Sample standard deviation of the vector v,
     with Bessel's correction
 
-    :param v: vector of data
-    :type v: Numpy ndarray
+    :param v: vector of data, or its sufficient statistics
+    :type v: Numpy ndarray or :py:class:`.SufficientStatistics`
     :return: Standard deviation with Bessel's correction
     :rtype: float
     """
+    if isinstance(v, SufficientStatistics):
+        return v.std()
     return np.std(v, ddof=1)
 
 
+class SufficientStatistics(object):
+    def __init__(self):
+        """
+        Count, mean and sum of squared deviations from the mean
+        (n, mean, M2) of a sample, from which the t-test bounds are
+        computed. The statistics of batches of the sample, e.g. seen
+        one at a time or by different workers, can be merged with the
+        parallel algorithm of Chan et al., which is more stable than
+        accumulating the sum of squares. The sample itself need not be kept.
+
+        Works on autograd boxes, so bounds computed from the
+        statistics can be differentiated.
+        Like a numpy array of the sample, has a mean() method
+        and is accepted by :py:func:`stddev`.
+        """
+        self.count = 0
+        self.sample_mean = 0.0
+        self.m2 = 0.0
+
+    @classmethod
+    def from_samples(cls, samples):
+        """Sufficient statistics of a whole sample. Takes two passes
+        over the sample, one for the mean and one for the squared
+        deviations from it, which is more accurate than accumulating
+        the sum of squares. Only the statistics of separate batches
+        are combined without revisiting the data, see :py:meth:`merge`
+
+        :param samples: vector of data
+        :type samples: Numpy ndarray
+        """
+        samples = np.ravel(samples)
+        statistics = cls()
+        n = len(samples)
+        if n > 0:
+            statistics.count = n
+            statistics.sample_mean = np.mean(samples)
+            statistics.m2 = np.sum((samples - statistics.sample_mean) ** 2)
+        return statistics
+
+    def update(self, samples):
+        """Add a batch of data
+
+        :param samples: vector of data
+        :type samples: Numpy ndarray
+        """
+        self.merge(SufficientStatistics.from_samples(samples))
+
+    def merge(self, other):
+        """Add the data summarized by other
+
+        :param other: Statistics of another batch of data
+        :type other: :py:class:`.SufficientStatistics`
+        :return: self
+        """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.sample_mean, self.m2 = (
+                other.count,
+                other.sample_mean,
+                other.m2,
+            )
+            return self
+        count = self.count + other.count
+        delta = other.sample_mean - self.sample_mean
+        self.sample_mean = self.sample_mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        return self
+
+    def __add__(self, other):
+        return SufficientStatistics().merge(self).merge(other)
+
+    def mean(self):
+        """Mean of the data seen so far"""
+        if self.count == 0:
+            return np.nan
+        return self.sample_mean
+
+    def std(self):
+        """Sample standard deviation of the data seen so far,
+        with Bessel's correction"""
+        if self.count < 2:
+            return np.nan
+        return np.sqrt(self.m2 / (self.count - 1))
+
+    def __len__(self):
+        return self.count
+
+
 def tinv(p, nu):
     """
     Returns the inverse of Student's t CDF
@@ -24,6 +117,9 @@ def tinv(p, nu):
     Python implementation of Matlab's tinv function:
     https://www.mathworks.com/help/stats/tinv.html
 
+    The quantiles for scalar p and nu are memoized, since
+    the same few are needed at every step of candidate selection.
+
     :param p: Probability
     :type p: float
     :param nu: Degrees of freedom
@@ -31,9 +127,100 @@ def tinv(p, nu):
     :return: Inverse of the Student's t CDF
     :rtype: float
     """
+    if np.isscalar(p) and np.isscalar(nu):
+        return _tinv_scalar(p, nu)
+    return t.ppf(p, nu)
+
+
+@lru_cache(maxsize=1024)
+def _tinv_scalar(p, nu):
     return t.ppf(p, nu)
 
 
+def ttest_bounds(data, datasize, delta, lower=True, upper=True, scale=1.0):
+    """
+    Student's t-test confidence bounds on the mean of the
+    data, both computed from the same sufficient statistics
+    of the data (see :py:meth:`.SufficientStatistics.from_samples`)
+
+    :param data: vector of data, or its sufficient statistics
+    :type data: Numpy ndarray or :py:class:`.SufficientStatistics`
+    :param datasize: The number of observations the
+        bounds are for, e.g., in the safety dataset
+    :type datasize: int
+    :param delta: Confidence level of each bound, e.g. 0.05
+    :type delta: float
+    :param lower: Whether to compute the lower bound
+    :param upper: Whether to compute the upper bound
+    :param scale: Factor on the width of the bounds, e.g. 2
+        to inflate the bounds predicted in candidate selection
+    :return: (lower, upper), None for a bound not computed
+    :rtype: Tuple
+    """
+    if not isinstance(data, SufficientStatistics):
+        data = SufficientStatistics.from_samples(data)
+    half_width = scale * data.std() / np.sqrt(datasize) * tinv(1.0 - delta, datasize - 1)
+    mean = data.mean()
+    return (
+        mean - half_width if lower else None,
+        mean + half_width if upper else None,
+    )
+
+
+def wilson_interval(n_success, n, confidence=0.95):
+    """
+    Wilson score interval on the success probability
+    of a Bernoulli random variable
+
+    :param n_success: Number of successes
+    :type n_success: int
+    :param n: Number of trials
+    :type n: int
+    :param confidence: Confidence level of the interval
+    :type confidence: float
+    :return: (lower, upper)
+    :rtype: Tuple
+    """
+    if n == 0:
+        return 0.0, 1.0
+    z = norm.ppf(1 - (1 - confidence) / 2)
+    p = n_success / n
+    denominator = 1 + z**2 / n
+    center = (p + z**2 / (2 * n)) / denominator
+    half_width = z * np.sqrt(p * (1 - p) / n + z**2 / (4 * n**2)) / denominator
+    return center - half_width, center + half_width
+
+
+def diff_proportion_interval(n1_success, n1, n2_success, n2, confidence=0.95):
+    """
+    Newcombe's hybrid score interval on p1 - p2,
+    the difference between the success probabilities of two
+    independent Bernoulli random variables, built from the
+    Wilson intervals on p1 and p2
+
+    :param n1_success: Number of successes of the first variable
+    :type n1_success: int
+    :param n1: Number of trials of the first variable
+    :type n1: int
+    :param n2_success: Number of successes of the second variable
+    :type n2_success: int
+    :param n2: Number of trials of the second variable
+    :type n2: int
+    :param confidence: Confidence level of the interval
+    :type confidence: float
+    :return: (lower, upper)
+    :rtype: Tuple
+    """
+    p1 = n1_success / n1
+    p2 = n2_success / n2
+    lower1, upper1 = wilson_interval(n1_success, n1, confidence)
+    lower2, upper2 = wilson_interval(n2_success, n2, confidence)
+    diff = p1 - p2
+    lower = diff - np.sqrt((p1 - lower1) ** 2 + (upper2 - p2) ** 2)
+    upper = diff + np.sqrt((upper1 - p1) ** 2 + (p2 - lower2) ** 2)
+    return lower, upper
+
+
 def weighted_sum_gamma(arr, gamma=0.9):
     """Calculate weighted sum of an array,
     where weights are gamma**(index of arr).
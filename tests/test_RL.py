@@ -1,3 +1,4 @@
+import os
 import pytest
 from seldonian.RL.Agents.Function_Approximators.Table import *
 from seldonian.RL.Agents.Policies.Policy import *
@@ -7,8 +8,11 @@ from seldonian.RL.environments.n_step_mountaincar import N_step_mountaincar
 from seldonian.RL.environments.gridworld import Gridworld
 from seldonian.RL.Agents.Parameterized_non_learning_softmax_agent import *
 from seldonian.RL.Agents.Discrete_Random_Agent import *
-from seldonian.RL.RL_runner import run_trial
-from seldonian.dataset import RLDataSet
+from seldonian.RL.RL_runner import run_trial, run_vectorized_trial, _trial_worker_state
+from seldonian.utils import parallel_utils
+from seldonian.RL import RL_runner
+from seldonian.RL.RL_model import RL_model
+from seldonian.dataset import RLDataSet, EpisodeStore
 import autograd.numpy as np
 
 def test_tables():
@@ -72,6 +76,53 @@ def test_Softmax():
     assert np.allclose(sm.get_e_to_the_something_terms([1.1, -2.2, 3.3]), e_to_something_stable)
     assert np.allclose(sm.get_action_probs_from_action_values([1.1, -2.2, 3.3]), e_to_something_stable / sum(e_to_something_stable))
 
+def test_Softmax_get_probs():
+    """test that batched action probabilities, and their gradients,
+    match those computed one step at a time"""
+    from autograd import grad
+
+    # Discrete observations: Q table
+    observation_space = Discrete_Space(-1, 2)
+    action_space = Discrete_Space(-1, 1)
+    env_description = Env_Description(observation_space, action_space)
+    dsm = DiscreteSoftmax({}, env_description)
+    # Continuous observations: Fourier basis and linear FA
+    cont_observation_space = Continuous_Space(np.array([[-1.2, 0.5], [-0.07, 0.07]]))
+    cont_env_description = Env_Description(cont_observation_space, action_space)
+    sm = Softmax(
+        {"basis": "Fourier", "order": 2, "max_coupled_vars": -1},
+        cont_env_description)
+
+    np.random.seed(0)
+    actions = np.array([-1, 0, 1, 1, 0, -1])
+    discrete_observations = np.array([-1, 0, 1, 2, 2, 0])
+    cont_observations = np.random.uniform(
+        [-1.2, -0.07], [0.5, 0.07], size=(6, 2))
+
+    for policy, observations in [
+        (dsm, discrete_observations), (sm, cont_observations)]:
+        theta = np.random.normal(size=policy.get_params().shape)
+        probs = policy.get_probs(theta, observations, actions)
+        policy.set_new_params(theta)
+        single_probs = [
+            policy.get_prob_this_action(obs, action)
+            for obs, action in zip(observations, actions)]
+        assert np.allclose(probs, single_probs)
+        try:
+            policy._denom.cache_clear()
+            policy._arg.cache_clear()
+        except AttributeError:
+            pass
+
+        # Same gradient as going one step at a time
+        def batched_log_prob(theta):
+            return np.sum(np.log(policy.get_probs(theta, observations, actions)))
+        def looped_log_prob(theta):
+            return np.sum(np.log(
+                Policy.get_probs(policy, theta, observations, actions)))
+        assert np.allclose(
+            grad(batched_log_prob)(theta), grad(looped_log_prob)(theta))
+
 def test_Parameterized_non_learning_softmax_agent():
     """test Parameterized_non_learning_softmax_agent"""
     observation_space = Discrete_Space(-1, 2)
@@ -161,6 +212,47 @@ def test_Fourier():
     assert basis.num_features == 9
     assert np.array_equal(basis.basis_matrix, np.array([[0, 0], [0, 1], [0, 2], [1, 0], [1, 1], [1, 2], [2, 0], [2, 1], [2, 2]]))
 
+    # Batch of observations
+    np.random.seed(0)
+    observations = np.random.uniform(
+        env_desc.observation_space.bounds[:, 0],
+        env_desc.observation_space.bounds[:, 1],
+        size=(10, 2))
+    features = basis.get_features_batch(observations)
+    assert features.shape == (10, 9)
+    for obs, obs_features in zip(observations, features):
+        assert np.allclose(basis.get_features(obs), obs_features)
+
+    # Features of the same observations array are computed once
+    FA = Linear_state_action_value_FA(basis, env_desc)
+    cached_features = FA.get_features_batch(observations)
+    assert np.allclose(cached_features, features)
+    assert FA.get_features_batch(observations) is cached_features
+    assert FA.get_features_batch(np.copy(observations)) is not cached_features
+    FA.clear_features_cache()
+    assert FA.get_features_batch(observations) is not cached_features
+
+    # The cache is bounded by the total size of the features
+    FA.clear_features_cache()
+    FA.max_features_cache_bytes = 2 * features.nbytes
+    all_observations = [np.copy(observations) for _ in range(3)]
+    for obs in all_observations:
+        FA.get_features_batch(obs)
+    assert len(FA.features_cache) == 2
+    assert FA.features_cache[0][0] is all_observations[1]
+    assert FA.features_cache[1][0] is all_observations[2]
+    FA.max_features_cache_bytes = features.nbytes - 1
+    assert FA.get_features_batch(observations) is not FA.get_features_batch(observations)
+    assert len(FA.features_cache) == 2
+
+    # Models clear the cache of their policy's function approximator
+    hyperparam_and_setting_dict["basis"] = "Fourier"
+    policy = Softmax(hyperparam_and_setting_dict, env_desc)
+    model = RL_model(policy, {})
+    policy.FA.features_cache = [(observations, features)]
+    model.clear_features_cache()
+    assert policy.FA.features_cache == []
+
 def test_createRLSpec_gridworld(RL_gridworld_dataset):
     """ Test creating RLSpec object
     for default gridworld inputs """
@@ -238,6 +330,164 @@ def test_generate_gridworld_episodes():
     dataset = RLDataSet(episodes=episodes)
     assert len(dataset.episodes) == 10
 
+def test_vectorized_environments():
+    """ Test that stepping copies of gridworld and mountaincar
+    together gives the same transitions as stepping them one by one """
+    np.random.seed(0)
+    num_envs = 8
+    for env_class, action_choices in [
+        (Gridworld, [0, 1, 2, 3]), (Mountaincar, [-1, 0, 1])]:
+        envs = [env_class() for _ in range(num_envs)]
+        for env in envs:
+            env.max_time = 30
+        vec_env = envs[0].make_vectorized(num_envs)
+        assert vec_env.max_time == 30
+        while not vec_env.all_terminated():
+            actions = np.random.choice(action_choices, size=num_envs)
+            active = ~vec_env.terminated()
+            rewards = vec_env.transition(actions)
+            for ii, env in enumerate(envs):
+                if active[ii]:
+                    assert rewards[ii] == env.transition(actions[ii])
+                    assert np.allclose(
+                        vec_env.get_observation()[ii], env.get_observation())
+                else:
+                    assert rewards[ii] == 0
+                assert vec_env.terminated()[ii] == env.terminated()
+
+def test_generate_vectorized_gridworld_episodes():
+    """ Test that we can generate a columnar episode store
+    for gridworld by stepping many copies at once """
+    np.random.seed(0)
+    hyperparam_and_setting_dict = {}
+    hyperparam_and_setting_dict["env"] = Gridworld()
+    hyperparam_and_setting_dict["agent"] = "Parameterized_non_learning_softmax_agent"
+    hyperparam_and_setting_dict["num_episodes"] = 25
+    hyperparam_and_setting_dict["vis"] = False
+
+    episodes, agent = run_vectorized_trial(hyperparam_and_setting_dict, num_envs=10)
+
+    assert isinstance(episodes, EpisodeStore)
+    assert len(episodes) == 25
+    assert np.all(episodes.lengths >= 2)
+    assert np.all(episodes.lengths <= 100)
+    assert np.all(episodes.observations[episodes.offsets[:-1]] == 0)
+    assert np.all(np.isin(episodes.actions, [0, 1, 2, 3]))
+    assert np.all(episodes.action_probs == 0.25)
+    # Episodes that end before the time limit end in the goal
+    last_rewards = episodes.rewards[episodes.offsets[1:] - 1]
+    assert np.all(last_rewards[episodes.lengths < 100] == 1)
+
+    dataset = RLDataSet(episodes=episodes)
+    assert len(dataset.episodes) == 25
+
+def test_run_trial_parallel_chunks():
+    """ Test that parallel episode generation is reproducible
+    for a given seed, whatever the number of workers """
+    hyperparam_and_setting_dict = {}
+    hyperparam_and_setting_dict["env"] = Gridworld()
+    hyperparam_and_setting_dict["agent"] = "Parameterized_non_learning_softmax_agent"
+    hyperparam_and_setting_dict["num_episodes"] = 25
+    hyperparam_and_setting_dict["vis"] = False
+
+    stores = []
+    for n_workers in [1, 2]:
+        np.random.seed(0)
+        expected_draw = np.random.random()
+        np.random.seed(0)
+        episodes, agent = run_trial(
+            hyperparam_and_setting_dict,
+            parallel=True,
+            n_workers=n_workers,
+            seed=42,
+            chunk_size=10,
+        )
+        # Numpy's global random state is left alone,
+        # and the serial run doesn't keep its agent
+        assert np.random.random() == expected_draw
+        assert _trial_worker_state == {}
+        assert isinstance(episodes, EpisodeStore)
+        assert len(episodes) == 25
+        stores.append(episodes)
+
+    assert np.array_equal(stores[0].offsets, stores[1].offsets)
+    assert np.array_equal(stores[0].observations, stores[1].observations)
+    assert np.array_equal(stores[0].actions, stores[1].actions)
+    assert np.array_equal(stores[0].rewards, stores[1].rewards)
+    assert np.all(stores[0].observations[stores[0].offsets[:-1]] == 0)
+
+    # A different seed gives different episodes
+    episodes, agent = run_trial(
+        hyperparam_and_setting_dict, parallel=True, n_workers=1, seed=43, chunk_size=10
+    )
+    assert not np.array_equal(episodes.actions, stores[0].actions)
+
+def test_run_trial_parallel_without_fork(monkeypatch):
+    """ Test that the chunks are run in this process
+    on platforms that can't fork processes """
+    monkeypatch.setattr(
+        parallel_utils.mp, "get_all_start_methods", lambda: ["spawn"])
+    hyperparam_and_setting_dict = {}
+    hyperparam_and_setting_dict["env"] = Gridworld()
+    hyperparam_and_setting_dict["agent"] = "Parameterized_non_learning_softmax_agent"
+    hyperparam_and_setting_dict["num_episodes"] = 25
+    hyperparam_and_setting_dict["vis"] = False
+
+    with pytest.warns(UserWarning, match="fork"):
+        episodes, agent = run_trial(
+            hyperparam_and_setting_dict, parallel=True, n_workers=2, seed=42, chunk_size=10
+        )
+    serial_episodes, agent = run_trial(
+        hyperparam_and_setting_dict, parallel=True, n_workers=1, seed=42, chunk_size=10
+    )
+    assert np.array_equal(episodes.actions, serial_episodes.actions)
+
+def test_run_trial_to_episode_directory(tmp_path, monkeypatch):
+    """ Test that the episodes of a trial can be written
+    to disk as they are generated """
+    hyperparam_and_setting_dict = {}
+    hyperparam_and_setting_dict["env"] = Gridworld()
+    hyperparam_and_setting_dict["agent"] = "Parameterized_non_learning_softmax_agent"
+    hyperparam_and_setting_dict["num_episodes"] = 25
+    hyperparam_and_setting_dict["vis"] = False
+
+    in_memory, agent = run_trial(
+        hyperparam_and_setting_dict, parallel=True, n_workers=2, seed=42, chunk_size=10
+    )
+    dirname = str(tmp_path / "parallel")
+    episodes, agent = run_trial(
+        hyperparam_and_setting_dict,
+        parallel=True,
+        n_workers=2,
+        seed=42,
+        chunk_size=10,
+        episodes_dirname=dirname,
+    )
+    assert isinstance(episodes.actions, np.memmap)
+    assert np.array_equal(episodes.offsets, in_memory.offsets)
+    assert np.array_equal(episodes.actions, in_memory.actions)
+
+    np.random.seed(0)
+    episodes, agent = run_trial(
+        hyperparam_and_setting_dict, episodes_dirname=str(tmp_path / "serial")
+    )
+    assert len(episodes) == 25
+    assert np.all(episodes.observations[episodes.offsets[:-1]] == 0)
+
+    # A trial that fails keeps the episodes already written
+    def failing_run_episode(agent, env):
+        raise RuntimeError("Episode failed")
+    monkeypatch.setattr(RL_runner, "run_episode", failing_run_episode)
+    with pytest.raises(RuntimeError):
+        run_trial(
+            hyperparam_and_setting_dict, episodes_dirname=str(tmp_path / "serial")
+        )
+    assert not any(
+        filename.endswith(".partial")
+        for filename in os.listdir(str(tmp_path / "serial"))
+    )
+    assert len(EpisodeStore.from_directory(str(tmp_path / "serial"))) == 25
+
 def test_generate_n_step_mountaincar_episodes():
     """ Test that we can generate proper episodes for n_step_mountaincar
     with the behavior policy (uniform random). """
@@ -1,10 +1,11 @@
 import pytest
+import os
 import importlib
 import autograd.numpy as np
 
 from seldonian.utils.io_utils import load_json
 from seldonian.dataset import (DataSetLoader,
-SupervisedDataSet,RLDataSet)
+SupervisedDataSet,RLDataSet,Episode,EpisodeStore,EpisodeWriter)
 
 ### Begin tests
 
@@ -161,3 +162,248 @@ def test_load_RL_dataset():
 	assert np.allclose(episodes[0].actions[0:5],np.array([0,1,2,1,3]))
 	assert np.allclose(episodes[0].rewards[0:5],np.array([0,0,0,0,0]))
 	assert np.allclose(episodes[0].action_probs[0:5],np.array([0.25,0.25,0.25,0.25,0.25]))
+
+def test_load_supervised_dataset_binary_formats(tmp_path):
+	""" Test that supervised learning datasets can be loaded
+	from npy, npz and parquet files and with dtype hints """
+	from seldonian.utils.io_utils import save_json
+	metadata_pth = 'static/datasets/supervised/GPA/metadata_regression.json'
+	data_pth_csv = 'static/datasets/supervised/GPA/gpa_regression_dataset.csv'
+	loader = DataSetLoader(regime='supervised_learning')
+	dataset_fromcsv = loader.load_supervised_dataset(
+		filename=data_pth_csv,
+		metadata_filename=metadata_pth,
+		file_type='csv')
+	table = np.hstack([
+		dataset_fromcsv.sensitive_attrs,
+		dataset_fromcsv.features,
+		dataset_fromcsv.labels[:,None]])
+
+	# Memory-mapped npy, features are a view
+	data_pth_npy = str(tmp_path / 'gpa.npy')
+	np.save(data_pth_npy,table)
+	dataset_fromnpy = loader.load_supervised_dataset(
+		filename=data_pth_npy,
+		metadata_filename=metadata_pth,
+		file_type='npy')
+	assert isinstance(dataset_fromnpy.features,np.memmap)
+	assert np.array_equal(dataset_fromnpy.features,dataset_fromcsv.features)
+	assert np.array_equal(dataset_fromnpy.labels,dataset_fromcsv.labels)
+	assert np.array_equal(
+		dataset_fromnpy.sensitive_attrs,dataset_fromcsv.sensitive_attrs)
+	assert dataset_fromnpy.num_datapoints == 43303
+
+	# npz, with float32 features
+	data_pth_npz = str(tmp_path / 'gpa.npz')
+	np.savez(data_pth_npz,
+		features=dataset_fromcsv.features,
+		labels=dataset_fromcsv.labels,
+		sensitive_attrs=dataset_fromcsv.sensitive_attrs)
+	dataset_fromnpz = loader.load_supervised_dataset(
+		filename=data_pth_npz,
+		metadata_filename=metadata_pth,
+		file_type='npz',
+		feature_dtype='float32')
+	assert dataset_fromnpz.features.dtype == np.float32
+	assert np.allclose(dataset_fromnpz.features,dataset_fromcsv.features)
+	assert np.array_equal(dataset_fromnpz.labels,dataset_fromcsv.labels)
+
+	# dtype hints in the metadata
+	metadata_dict = load_json(metadata_pth)
+	metadata_dict['dtypes'] = {'M':'int8','F':'int8','Physics':'float32'}
+	metadata_pth_dtypes = str(tmp_path / 'metadata.json')
+	save_json(metadata_pth_dtypes,metadata_dict)
+	dataset_dtypes = loader.load_supervised_dataset(
+		filename=data_pth_csv,
+		metadata_filename=metadata_pth_dtypes,
+		file_type='csv')
+	assert dataset_dtypes.sensitive_attrs.dtype == np.int8
+	assert np.allclose(dataset_dtypes.features,dataset_fromcsv.features)
+
+	if importlib.util.find_spec('pyarrow') is not None:
+		import pandas as pd
+		data_pth_parquet = str(tmp_path / 'gpa.parquet')
+		pd.DataFrame(table,columns=metadata_dict['all_col_names']).to_parquet(
+			data_pth_parquet)
+		dataset_fromparquet = loader.load_supervised_dataset(
+			filename=data_pth_parquet,
+			metadata_filename=metadata_pth,
+			file_type='parquet')
+		assert np.array_equal(
+			dataset_fromparquet.features,dataset_fromcsv.features)
+
+def test_load_RL_dataset_from_csv_grouping(tmp_path):
+	""" Test that rows of RL CSVs are grouped into episodes
+	in order of first appearance, also when read in chunks """
+	rows = [
+		[7,0,1,0.0,0.25],
+		[3,5,2,1.0,0.5],
+		[7,1,3,0.0,0.25],
+		[3,6,0,2.0,0.5],
+		[7,2,1,1.0,0.25],
+		[1,9,2,0.5,0.75],
+	]
+	filename = str(tmp_path / "episodes.csv")
+	with open(filename,'w') as f:
+		for row in rows:
+			f.write(','.join(str(x) for x in row) + '\n')
+
+	loader = DataSetLoader(regime="reinforcement_learning")
+	for chunksize in [None,4]:
+		dataset = loader.load_RL_dataset_from_csv(filename,chunksize=chunksize)
+		episodes = dataset.episodes
+		assert dataset.meta_information['sensitive_col_names'] == []
+		assert len(episodes) == 3
+		assert np.array_equal(episodes.lengths,[3,2,1])
+		assert np.array_equal(episodes[0].observations,[0,1,2])
+		assert np.array_equal(episodes[1].actions,[2,0])
+		assert np.array_equal(episodes[1].rewards,[1.0,2.0])
+		assert np.array_equal(episodes[2].action_probs,[0.75])
+		assert episodes.rewards.dtype == np.float64
+
+def test_masked_data_cached():
+	""" Test that datasets compute the masked data
+	for each combination of conditional columns once
+	and hand out slices when the selected rows are contiguous """
+	meta_information = {
+		'feature_col_names': ['x1','x2'],
+		'label_col_names': ['y'],
+		'sensitive_col_names': ['M','F','A']}
+	features = np.arange(12,dtype='float').reshape(6,2)
+	labels = np.arange(6,dtype='float')
+	M = np.array([1,0,1,0,1,1])
+	sensitive_attrs = np.vstack([M,1-M,np.array([1,1,1,0,0,0])]).T
+	dataset = SupervisedDataSet(
+		features=features,
+		labels=labels,
+		sensitive_attrs=sensitive_attrs,
+		num_datapoints=6,
+		meta_information=meta_information)
+
+	masked_features,masked_labels,n_masked = dataset.get_masked_data(['M'])
+	assert n_masked == 4
+	assert np.allclose(masked_labels,np.array([0,2,4,5]))
+	assert np.allclose(masked_features,features[[0,2,4,5]])
+	# Same arrays handed out the second time
+	assert dataset.get_masked_data(['M'])[0] is masked_features
+
+	masked_features,masked_labels,n_masked = dataset.get_masked_data(['M','A'])
+	assert n_masked == 2
+	assert np.allclose(masked_labels,np.array([0,2]))
+
+	# Contiguous rows give a view of the features
+	assert dataset.get_conditional_indices(['A']) == slice(0,3)
+	masked_features,masked_labels,n_masked = dataset.get_masked_data(['A'])
+	assert n_masked == 3
+	assert np.shares_memory(masked_features,features)
+
+	# RL
+	episodes = [Episode([0],[0],[float(ii)],[0.5]) for ii in range(6)]
+	RL_dataset = RLDataSet(
+		episodes=episodes,
+		sensitive_attrs=sensitive_attrs,
+		meta_information={
+			'episode_col_names': ['O', 'A', 'R', 'pi_b'],
+			'sensitive_col_names': ['M','F','A']})
+	masked_episodes,n_masked = RL_dataset.get_masked_data(['F'])
+	assert n_masked == 2
+	assert [ep.rewards[0] for ep in masked_episodes] == [1.0,3.0]
+	assert RL_dataset.get_masked_data(['F'])[0] is masked_episodes
+
+	# Clearing the cache releases the masked data but keeps the indices
+	dataset.clear_masked_data_cache()
+	RL_dataset.clear_masked_data_cache()
+	assert dataset.masked_data_cache == {}
+	assert RL_dataset.masked_data_cache == {}
+	assert dataset.get_conditional_indices(['A']) == slice(0,3)
+	masked_features,masked_labels,n_masked = dataset.get_masked_data(['M'])
+	assert np.allclose(masked_labels,np.array([0,2,4,5]))
+
+def test_episode_store():
+	""" Test that the columnar episode store behaves
+	like a list of episodes """
+	episodes = [
+		Episode(
+			observations=[ii]*(ii+1),
+			actions=[0]*(ii+1),
+			rewards=[float(ii)]*(ii+1),
+			action_probs=[0.5]*(ii+1)) for ii in range(5)]
+	store = EpisodeStore.from_episodes(episodes)
+	assert len(store) == 5
+	assert np.array_equal(store.offsets,[0,1,3,6,10,15])
+	assert np.array_equal(store.lengths,[1,2,3,4,5])
+	assert np.array_equal(store.episode_index[0:6],[0,1,1,2,2,2])
+
+	# Episode views
+	assert np.array_equal(store[2].rewards,[2.0,2.0,2.0])
+	assert np.array_equal(store[-1].observations,[4]*5)
+	assert np.shares_memory(store[3].rewards,store.rewards)
+	assert [len(ep.rewards) for ep in store] == [1,2,3,4,5]
+	with pytest.raises(IndexError):
+		store[5]
+
+	# Slicing does not copy
+	sliced = store[1:3]
+	assert len(sliced) == 2
+	assert np.array_equal(sliced.offsets,[0,2,5])
+	assert np.shares_memory(sliced.rewards,store.rewards)
+	assert np.array_equal(sliced[1].rewards,[2.0,2.0,2.0])
+
+	# Fancy indexing and boolean masks
+	selected = store[[4,0]]
+	assert np.array_equal(selected.lengths,[5,1])
+	assert np.array_equal(selected.rewards,[4.0]*5+[0.0])
+	masked = store[np.array([False,True,False,True,False])]
+	assert [ep.rewards[0] for ep in masked] == [1.0,3.0]
+
+	# RLDataSet stores lists of episodes in a store
+	dataset = RLDataSet(episodes=episodes)
+	assert isinstance(dataset.episodes,EpisodeStore)
+	assert dataset.num_datapoints == 5
+
+def test_episode_writer(tmp_path):
+	""" Test that episodes written incrementally to a directory
+	can be opened memory-mapped """
+	episodes = [
+		Episode(
+			observations=np.full((ii+1,2),ii),
+			actions=[1]*(ii+1),
+			rewards=[float(ii)]*(ii+1),
+			action_probs=[0.25]*(ii+1)) for ii in range(5)]
+	dirname = str(tmp_path / "episodes")
+	with EpisodeWriter(dirname) as writer:
+		writer.append(episodes[0])
+		writer.append(episodes[1:3])
+		writer.append(EpisodeStore.from_episodes(episodes[3:]))
+		with pytest.raises(ValueError):
+			writer.append(Episode([0.0],[1],[0.0],[0.25]))
+
+	store = EpisodeStore.from_directory(dirname)
+	assert isinstance(store.rewards,np.memmap)
+	assert len(store) == 5
+	assert np.array_equal(store.offsets,[0,1,3,6,10,15])
+	assert store.observations.shape == (15,2)
+	assert np.array_equal(store[4].observations,np.full((5,2),4))
+	assert np.array_equal(store[2].rewards,[2.0,2.0,2.0])
+
+	loader = DataSetLoader(regime="reinforcement_learning")
+	dataset = loader.load_RL_dataset_from_episode_file(dirname)
+	assert isinstance(dataset.episodes,EpisodeStore)
+	assert dataset.num_datapoints == 5
+
+	# Saving a store and opening it in memory
+	store[1:4].save(dirname)
+	reloaded = EpisodeStore.from_directory(dirname,mmap=False)
+	assert not isinstance(reloaded.rewards,np.memmap)
+	assert np.array_equal(reloaded.lengths,[2,3,4])
+	assert np.array_equal(reloaded.rewards,store[1:4].rewards)
+
+	# Failing while writing leaves the episodes in the directory as they were
+	with pytest.raises(RuntimeError):
+		with EpisodeWriter(dirname) as writer:
+			writer.append(episodes[0])
+			raise RuntimeError("Failed to generate episodes")
+	assert not any(filename.endswith('.partial') for filename in os.listdir(dirname))
+	reloaded = EpisodeStore.from_directory(dirname)
+	assert np.array_equal(reloaded.lengths,[2,3,4])
+	assert np.array_equal(reloaded.rewards,store[1:4].rewards)
@@ -0,0 +1,219 @@
+import autograd.numpy as np
+import pytest
+
+from seldonian.dataset import Episode, RLDataSet
+from seldonian.hyperparam_search import (HyperparamSearch,
+	_init_bootstrap_worker,_run_bootstrap_trial_in_worker)
+from seldonian.utils.stats_utils import diff_proportion_interval
+
+
+class StubModel(object):
+	def __init__(self):
+		self.env_kwargs = {'gamma': 1.0}
+
+
+class StubSpec(object):
+	def __init__(self):
+		self.model = StubModel()
+
+
+def make_RL_hyperparam_search(n_episodes=20):
+	""" Make a search over an RL dataset of n_episodes one-step
+	episodes without a full spec. run_core is replaced by a stub which
+	records the rewards of the bootstrapped candidate episodes
+	and passes if their sum is even """
+	episodes = [Episode([0],[0],[float(ii)],[0.5]) for ii in range(n_episodes)]
+	dataset = RLDataSet(episodes=episodes)
+
+	hyperparam_search = HyperparamSearch.__new__(HyperparamSearch)
+	hyperparam_search.spec = StubSpec()
+	hyperparam_search.dataset = dataset
+	hyperparam_search.regime = dataset.regime
+	hyperparam_search.column_names = dataset.meta_information
+	hyperparam_search.all_frac_data_in_candidate_selection = [0.3,0.6,0.9]
+
+	hyperparam_search.bootstrapped_rewards = []
+	def run_core(candidate_dataset,safety_dataset,n_safety,
+		frac_data_in_safety,write_cs_logfile=False,debug=False):
+		rewards = [ep.rewards[0] for ep in candidate_dataset.episodes]
+		hyperparam_search.bootstrapped_rewards.append(rewards)
+		return sum(rewards) % 2 == 0, None
+	hyperparam_search.run_core = run_core
+	return hyperparam_search
+
+def stub_bootstrap_trials(hyperparam_search,prob_pass):
+	""" Replace the bootstrap trials of hyperparam_search
+	with draws determined by the trial seed that pass with
+	probability prob_pass[rho]. Returns the list of (rho,trial_seed)
+	of the trials run in this process """
+	trials = []
+	def run_bootstrap_trial(trial_seed,candidate_dataset,frac_data_in_safety,
+		bs_n_candidate,bs_n_safety,write_cs_logfile=False):
+		rho = round(1-frac_data_in_safety,6)
+		trials.append((rho,trial_seed))
+		return trial_seed % 1000 < 1000*prob_pass[rho]
+	hyperparam_search.run_bootstrap_trial = run_bootstrap_trial
+	return trials
+
+def test_run_bootstrap_trial():
+	""" Test that a bootstrap trial is determined by its seed
+	and leaves numpy's global random state alone """
+	hyperparam_search = make_RL_hyperparam_search()
+	trial_kwargs = dict(
+		candidate_dataset=hyperparam_search.dataset,
+		frac_data_in_safety=0.5,
+		bs_n_candidate=10,
+		bs_n_safety=10)
+
+	np.random.seed(42)
+	expected_draw = np.random.random()
+	np.random.seed(42)
+	passed = hyperparam_search.run_bootstrap_trial(7,**trial_kwargs)
+	assert np.random.random() == expected_draw
+
+	# Same seed, same bootstrap samples
+	assert hyperparam_search.run_bootstrap_trial(7,**trial_kwargs) == passed
+	assert hyperparam_search.bootstrapped_rewards[0] == hyperparam_search.bootstrapped_rewards[1]
+	assert len(hyperparam_search.bootstrapped_rewards[0]) == 10
+	hyperparam_search.run_bootstrap_trial(8,**trial_kwargs)
+	assert hyperparam_search.bootstrapped_rewards[2] != hyperparam_search.bootstrapped_rewards[0]
+
+	# Same trial from the worker state
+	_init_bootstrap_worker(hyperparam_search,[{},trial_kwargs])
+	assert _run_bootstrap_trial_in_worker(1,7) == passed
+	assert hyperparam_search.bootstrapped_rewards[3] == hyperparam_search.bootstrapped_rewards[0]
+
+def test_prob_pass_estimate_seeds():
+	""" Test that the trial seeds of an estimate are spawned
+	from its seed, independently of the number of workers """
+	hyperparam_search = make_RL_hyperparam_search()
+	estimates = []
+	for n_workers in [1,2]:
+		estimate = hyperparam_search.new_prob_pass_estimate(
+			0.6,hyperparam_search.dataset,n_workers=n_workers,seed=0)
+		# Sizes of the bootstrapped datasets come from the dataset size
+		assert estimate['trial_kwargs']['bs_n_candidate'] == 12
+		assert estimate['trial_kwargs']['bs_n_safety'] == 8
+		hyperparam_search.extend_prob_pass_estimate(estimate,20)
+		assert estimate['n_trials'] == 20
+		estimates.append(estimate)
+	assert estimates[0]['n_pass'] == estimates[1]['n_pass']
+	assert 0 < estimates[0]['n_pass'] < 20
+
+	estimate = hyperparam_search.new_prob_pass_estimate(
+		0.6,hyperparam_search.dataset,seed=1)
+	hyperparam_search.extend_prob_pass_estimate(estimate,20)
+	assert estimate['n_pass'] != estimates[0]['n_pass']
+
+def test_extend_prob_pass_estimate_in_steps():
+	""" Test that extending an estimate in several steps
+	runs the same trials as extending it once """
+	hyperparam_search = make_RL_hyperparam_search()
+	trials = stub_bootstrap_trials(hyperparam_search,{0.6:0.5})
+
+	estimate = hyperparam_search.new_prob_pass_estimate(
+		0.6,hyperparam_search.dataset,seed=3)
+	for n_new_trials in [7,0,13,10]:
+		hyperparam_search.extend_prob_pass_estimate(estimate,n_new_trials)
+	stepped_trials = list(trials)
+
+	trials.clear()
+	estimate_once = hyperparam_search.new_prob_pass_estimate(
+		0.6,hyperparam_search.dataset,seed=3)
+	hyperparam_search.extend_prob_pass_estimate(estimate_once,30)
+	assert trials == stepped_trials
+	assert estimate['n_trials'] == estimate_once['n_trials'] == 30
+	assert estimate['n_pass'] == estimate_once['n_pass']
+	assert estimate['prob_pass'] == estimate_once['n_pass']/30
+
+def test_sequential_prob_pass_better():
+	""" Test the decision and stopping point of the
+	sequential comparison of two probabilities of passing """
+	hyperparam_search = make_RL_hyperparam_search()
+	trials = stub_bootstrap_trials(hyperparam_search,
+		{0.3:0.0,0.6:0.5,0.9:1.0})
+	def new_estimate(rho,seed,n_workers=1):
+		return hyperparam_search.new_prob_pass_estimate(
+			rho,hyperparam_search.dataset,n_workers=n_workers,seed=seed)
+
+	# A clear difference stops at the first check
+	rho_estimate = new_estimate(0.3,0)
+	rho_prime_estimate = new_estimate(0.9,1)
+	assert hyperparam_search.sequential_prob_pass_better(
+		rho_estimate,rho_prime_estimate,max_iter=50,batch_iter=10) == True
+	assert rho_estimate['n_trials'] == rho_prime_estimate['n_trials'] == 10
+
+	# Trials already in rho's estimate are reused,
+	# only rho_prime's estimate is extended
+	trials.clear()
+	rho_estimate = new_estimate(0.3,0)
+	hyperparam_search.extend_prob_pass_estimate(rho_estimate,20)
+	rho_prime_estimate = new_estimate(0.9,1)
+	assert hyperparam_search.sequential_prob_pass_better(
+		rho_estimate,rho_prime_estimate,max_iter=50,batch_iter=10) == True
+	assert rho_estimate['n_trials'] == 20
+	assert rho_prime_estimate['n_trials'] == 10
+	assert len(trials) == 30
+	assert [rho for rho,_ in trials[20:]] == [0.9]*10
+
+	# Equal probabilities are not decided early, so it runs
+	# max_iter trials each. The decision and stopping point are the
+	# same every time and with a pool of workers
+	results = []
+	for n_workers in [1,1,2]:
+		rho_estimate = new_estimate(0.6,4,n_workers)
+		rho_prime_estimate = new_estimate(0.6,5,n_workers)
+		pool = hyperparam_search.make_bootstrap_pool(
+			[rho_estimate,rho_prime_estimate],n_workers)
+		try:
+			better = hyperparam_search.sequential_prob_pass_better(
+				rho_estimate,rho_prime_estimate,max_iter=45,batch_iter=10,
+				pool=pool)
+		finally:
+			if pool is not None:
+				pool.shutdown()
+		results.append((better,rho_estimate['n_trials'],
+			rho_estimate['n_pass'],rho_prime_estimate['n_pass']))
+	assert results[0] == results[1] == results[2]
+	assert results[0][1] == 45
+	assert results[0][0] == (results[0][3] > results[0][2])
+
+def test_sequential_confidence_spent_over_checks():
+	""" Test that each check uses a Bonferroni-corrected confidence,
+	so a difference that would stop a single check at 95% confidence
+	does not stop one of many checks """
+	hyperparam_search = make_RL_hyperparam_search()
+	stub_bootstrap_trials(hyperparam_search,{0.3:0.0,0.9:0.5})
+	# 0/10 vs 5/10 excludes zero at 95% confidence but not at 99.5%
+	lower,_ = diff_proportion_interval(5,10,0,10,confidence=0.95)
+	assert lower > 0
+	lower,_ = diff_proportion_interval(5,10,0,10,confidence=0.995)
+	assert lower < 0
+
+	def compare(max_iter):
+		rho_estimate = hyperparam_search.new_prob_pass_estimate(
+			0.3,hyperparam_search.dataset,seed=0)
+		rho_prime_estimate = hyperparam_search.new_prob_pass_estimate(
+			0.9,hyperparam_search.dataset,seed=1)
+		# Fix rho_prime's first 10 trials to 5 passes
+		rho_prime_estimate['n_pass'] = 5
+		rho_prime_estimate['n_trials'] = 10
+		hyperparam_search.sequential_prob_pass_better(
+			rho_estimate,rho_prime_estimate,max_iter=max_iter,batch_iter=10)
+		return rho_estimate['n_trials']
+
+	# One check stops at 10 trials, 10 checks do not
+	assert compare(10) == 10
+	assert compare(100) > 10
+
+def test_find_best_hyperparams_sequential():
+	""" Test that the sequential search picks the split
+	with the highest probability of passing, independently
+	of the number of workers """
+	hyperparam_search = make_RL_hyperparam_search()
+	stub_bootstrap_trials(hyperparam_search,{0.3:0.1,0.6:0.9,0.9:0.3})
+	for n_workers in [1,2]:
+		frac_data_in_safety,candidate_dataset,safety_dataset = \
+			hyperparam_search.find_best_hyperparams(
+				n_workers=n_workers,seed=0,bootstrap_iter=50,sequential=True)
+		assert frac_data_in_safety == pytest.approx(0.4)
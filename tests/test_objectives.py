@@ -60,6 +60,46 @@ def test_binary_classification_measure_functions():
 	arcomp_ACC = np.array([0.5, 0.4378235 , 0.62245933, 0.6791787 ])
 	assert np.allclose(vector_ACC,arcomp_ACC)
 
+def test_prediction_cache():
+	""" Test that measure functions evaluated at the same
+	theta and features share a single call to model.predict
+	and that changing theta invalidates the cache
+	"""
+	class CountingModel(BinaryLogisticRegressionModel):
+		def __init__(self):
+			super().__init__()
+			self.n_predict_calls = 0
+
+		def predict(self,theta,X):
+			self.n_predict_calls += 1
+			return super().predict(theta,X)
+
+	model = CountingModel()
+	Y = np.array([0,0,1,1])
+	X = np.array([
+		[0.0,0.0],
+		[0.25,0.5],
+		[0.5,1.0],
+		[0.75,1.5]
+		])
+	theta = np.array([0.0,-1.0,1.0])
+	objectives.prediction_cache.clear()
+	vector_FPR = objectives.vector_False_Positive_Rate(model,theta,X,Y)
+	vector_FNR = objectives.vector_False_Negative_Rate(model,theta,X,Y)
+	PR = objectives.Positive_Rate(model,theta,X,Y)
+	assert model.n_predict_calls == 1
+	# Different features, same theta
+	X2 = np.copy(X)
+	objectives.vector_Positive_Rate(model,theta,X2,Y)
+	assert model.n_predict_calls == 2
+	# Updating theta in place must invalidate the cache
+	theta += 1.0
+	new_PR = objectives.Positive_Rate(model,theta,X,Y)
+	assert model.n_predict_calls == 3
+	assert new_PR != pytest.approx(PR)
+	assert new_PR == pytest.approx(np.mean(BinaryLogisticRegressionModel().predict(theta,X)))
+	objectives.prediction_cache.clear()
+
 def test_multiclass_classification_measure_functions():
 	# i = 4 datapoints
 	# j = 2 features
@@ -143,4 +183,39 @@ def test_multiclass_classification_measure_functions():
 		vector_TNR = objectives.vector_True_Negative_Rate(
 			model,theta,X,Y,
 			class_index=class_index)
-		assert np.allclose(vector_TNR,1.0-arcomp_FPR)
\ No newline at end of file
+		assert np.allclose(vector_TNR,1.0-arcomp_FPR)
+
+def test_batched_RL_estimates(RL_gridworld_dataset):
+	""" Test that the IS and PDIS estimates computed on 
+	an EpisodeStore in a single batch match the estimates
+	computed episode by episode, as do their gradients
+	"""
+	from autograd import grad
+	from seldonian.dataset import EpisodeStore
+	from seldonian.utils.stats_utils import weighted_sum_gamma
+
+	from seldonian.RL.RL_model import RL_model
+
+	(dataset,policy,env_kwargs,
+		primary_objective) = RL_gridworld_dataset()
+	model = RL_model(policy=policy,env_kwargs=env_kwargs)
+	episodes = dataset.episodes
+	assert isinstance(episodes,EpisodeStore)
+	episode_list = episodes.to_episodes()
+	gamma = model.env_kwargs['gamma']
+	weighted_returns = np.array(
+		[weighted_sum_gamma(ep.rewards,gamma=gamma) for ep in episode_list])
+	np.random.seed(0)
+	theta = np.random.normal(scale=0.5,size=model.policy.get_params().shape)
+
+	for func in [objectives.vector_IS_estimate,objectives.vector_PDIS_estimate]:
+		assert np.allclose(
+			func(model,theta,episodes,weighted_returns),
+			func(model,theta,episode_list,weighted_returns))
+
+	for func in [objectives.IS_estimate,objectives.PDIS_estimate]:
+		assert func(model,theta,episodes) == pytest.approx(
+			func(model,theta,episode_list))
+		batched_grad = grad(func,argnum=1)(model,theta,episodes)
+		looped_grad = grad(func,argnum=1)(model,theta,episode_list)
+		assert np.allclose(batched_grad,looped_grad)
@@ -1809,6 +1809,88 @@ def test_build_tree():
 	assert pt2.base_node_dict['FNR']['upper'] == float('inf')
 	assert pt2.base_node_dict['FNR']['bound_computed'] == False
 
+def test_compiled_tape(gpa_regression_dataset):
+	""" Test that propagating bounds with the tape
+	made by compile() gives the same bounds as 
+	the recursive traversal and that duplicate base nodes 
+	only get one instruction on the tape """
+	np.random.seed(0)
+	constraint_str = 'max(abs((Mean_Error | [M]) - (Mean_Error | [F])),(Mean_Error | [M])/2.0) - 0.1'
+	deltas = [0.05]
+	(dataset,model,
+		primary_objective,parse_trees) = gpa_regression_dataset(
+			[constraint_str],deltas)
+	columns = dataset.meta_information['sensitive_col_names']
+
+	# build_tree() compiles the tree
+	pt = ParseTree(deltas[0],regime='supervised_learning',
+		sub_regime='regression',columns=columns)
+	pt.build_tree(constraint_str)
+	assert pt.tape is not None
+	# 2 unique base nodes and 5 internal nodes
+	assert len(pt.tape) == 7
+
+	# Same tree without compiling
+	pt2 = ParseTree(deltas[0],regime='supervised_learning',
+		sub_regime='regression',columns=columns)
+	pt2.create_from_ast(constraint_str)
+	pt2.assign_deltas(weight_method='equal')
+	pt2.assign_bounds_needed()
+	assert pt2.tape is None
+
+	theta = np.random.uniform(-0.05,0.05,10)
+	for tree in [pt,pt2]:
+		tree.propagate_bounds(theta=theta,dataset=dataset,
+			model=model,branch='safety_test',
+			regime='supervised_learning')
+
+	assert pt.root.upper == pytest.approx(pt2.root.upper)
+	assert pt.root.lower == pytest.approx(pt2.root.lower)
+	assert pt.root.left.left.upper == pytest.approx(pt2.root.left.left.upper)
+	assert pt.root.left.right.left.upper == pytest.approx(
+		pt2.root.left.right.left.upper)
+
+	# Rebuilding the tree from a new string discards the tape
+	pt.create_from_ast('Mean_Error - 0.1')
+	assert pt.tape is None
+
+def test_base_node_registry(gpa_regression_dataset):
+	""" Test that base nodes representing the same quantity
+	share their estimates across parse trees when
+	a registry is provided and that each tree still gets
+	the bounds it would get on its own """
+	np.random.seed(0)
+	constraint_strs = [
+		'abs((Mean_Error | [M]) - (Mean_Error | [F])) - 0.1',
+		'(Mean_Error | [M]) - 0.2']
+	deltas = [0.05,0.1]
+	(dataset,model,
+		primary_objective,parse_trees) = gpa_regression_dataset(
+			constraint_strs,deltas)
+	theta = np.random.uniform(-0.05,0.05,10)
+	bounds_kwargs = dict(theta=theta,dataset=dataset,
+		model=model,branch='safety_test',
+		regime='supervised_learning')
+
+	# Without the registry
+	expected_bounds = []
+	for pt in parse_trees:
+		pt.propagate_bounds(**bounds_kwargs)
+		expected_bounds.append((pt.root.lower,pt.root.upper))
+		pt.reset_base_node_dict(reset_data=True)
+
+	registry = BaseNodeRegistry()
+	for ii,pt in enumerate(parse_trees):
+		pt.propagate_bounds(base_node_registry=registry,**bounds_kwargs)
+		assert pt.root.lower == pytest.approx(expected_bounds[ii][0])
+		assert pt.root.upper == pytest.approx(expected_bounds[ii][1])
+
+	# Mean_Error | [M] is shared between the two trees
+	assert len(registry.samples) == 2
+	assert ('Mean_Error',('M',),None,None,None) in registry.samples
+	registry.reset()
+	assert registry.samples == {}
+
 def test_bad_delta():
 	""" Test that supplying delta not in (0,1) raises a ValueError
 	"""
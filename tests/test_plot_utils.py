@@ -1,3 +1,5 @@
+import pytest
+import numpy as np
 from seldonian.utils.io_utils import load_pickle
 from seldonian.utils.plot_utils import plot_gradient_descent
 
@@ -33,4 +35,18 @@ def test_plot_gradient_descent():
 		primary_objective_name='logistic loss',
 		save=False,
 		show=False)
-	assert len(fig.axes) == 4
\ No newline at end of file
+	assert len(fig.axes) == 4
+def test_plot_gradient_descent_without_constraint_history():
+	""" Test that a solution without the history of the
+	constraints is refused rather than crashing the plot """
+	path_single_constraint = "static/gradient_descent_logs/candidate_selection_single_constraint.p"
+	solution = load_pickle(path_single_constraint)
+	solution['g_vals'] = np.array([])
+	solution['lamb_vals'] = np.array([])
+	with pytest.raises(ValueError) as excinfo:
+		plot_gradient_descent(
+			solution=solution,
+			primary_objective_name='logistic loss',
+			save=False,
+			show=False)
+	assert "no history of the constraints" in str(excinfo.value)
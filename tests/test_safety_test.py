@@ -59,6 +59,168 @@ def test_run_safety_test_regression(
     upper_bound_batching = parse_trees[0].root.upper
     assert upper_bound_batching == pytest.approx(
         -0.947692744102955)
+    # Now streaming the statistics over chunks
+    passed_safety_streaming = st.run(candidate_solution,
+        batch_size_safety=int(round(numPoints/7)),stream_safety=True)
+    assert passed_safety_streaming == True
+    upper_bound_streaming = parse_trees[0].root.upper
+    assert upper_bound_streaming == pytest.approx(
+        -0.947692744102955)
+    assert parse_trees[0].base_node_dict['Mean_Squared_Error']['data_dict'] is None
+
+def test_run_safety_test_streaming_custom_bounds(
+    simulated_regression_dataset):
+    """ Test that base nodes with their own bounds, like CVaR,
+    are bounded from the full safety dataset when the
+    t-test statistics of the other base nodes are streamed """
+    constraint_strs = ['CVaRSQE - 10.0','Mean_Squared_Error - 2.0']
+    deltas = [0.05,0.05]
+    numPoints=1000
+    (dataset,model,primary_objective,
+        parse_trees) = simulated_regression_dataset(
+            constraint_strs,deltas,numPoints=numPoints)
+
+    (candidate_features, safety_features,
+        candidate_labels, safety_labels) = train_test_split(
+            dataset.features, dataset.labels,test_size=0.6, shuffle=False)
+    safety_dataset = SupervisedDataSet(
+        features=safety_features,
+        labels=safety_labels,
+        sensitive_attrs=[],
+        num_datapoints=len(safety_features),
+        meta_information=dataset.meta_information)
+
+    cvar_node = parse_trees[0].root.left
+    assert cvar_node.sample_key() is None
+    assert parse_trees[1].root.left.sample_key() is not None
+
+    candidate_solution = np.array([0,1])
+    st = SafetyTest(safety_dataset,model,parse_trees)
+    passed_safety = st.run(candidate_solution)
+    upper_bounds = [pt.root.upper for pt in parse_trees]
+
+    statistics = st.stream_statistics(candidate_solution,chunk_size=50)
+    assert list(statistics.keys()) == [parse_trees[1].root.left.sample_key()]
+    passed_safety_streaming = st.run(candidate_solution,
+        batch_size_safety=50,stream_safety=True)
+    assert passed_safety_streaming == passed_safety
+    for pt,upper_bound in zip(parse_trees,upper_bounds):
+        assert pt.root.upper == pytest.approx(upper_bound)
+
+def test_safety_test_result_snapshot(
+    gpa_regression_dataset):
+    """ Test that the safety test records snapshots
+    of the parse trees without the data used for the bounds """
+    constraint_strs = ['abs((Mean_Error | [M]) - (Mean_Error | [F])) - 0.1']
+    deltas = [0.05]
+    (dataset,model,primary_objective,
+        parse_trees) = gpa_regression_dataset(constraint_strs,deltas)
+    st = SafetyTest(dataset,model,parse_trees)
+    st.run(np.zeros(10))
+
+    pt = parse_trees[0]
+    snapshot = st.st_result[pt.constraint_str]
+    assert isinstance(snapshot,ParseTreeSnapshot)
+    assert snapshot.root.upper == pt.root.upper
+    assert snapshot.root.left.name == 'abs'
+    assert repr(snapshot.root) == repr(pt.root)
+    base_node_info = snapshot.base_node_dict['Mean_Error | [M]']
+    assert 'data_dict' not in base_node_info
+    assert base_node_info['upper'] == pt.base_node_dict['Mean_Error | [M]']['upper']
+    assert base_node_info['datasize'] > 0
+    with pytest.raises(AttributeError):
+        snapshot.root.upper = 0.0
+
+    # Running again does not change the recorded snapshot
+    st.run(np.ones(10))
+    assert snapshot.root.upper != pt.root.upper
+    assert snapshot.make_viz(pt.constraint_str) is not None
+
+def test_run_safety_test_streaming_conditional(
+    gpa_regression_dataset,tmp_path):
+    """ Test that streaming the safety test over chunks of a
+    memory-mapped dataset gives the same bounds as the full dataset,
+    also for base nodes conditioned on columns """
+    constraint_strs = [
+        'abs((Mean_Error | [M]) - (Mean_Error | [F])) - 0.1',
+        'Mean_Squared_Error - 2.0']
+    deltas = [0.05,0.05]
+    (dataset,model,primary_objective,
+        parse_trees) = gpa_regression_dataset(constraint_strs,deltas)
+
+    # Memory-map the features
+    features_pth = str(tmp_path / 'features.npy')
+    np.save(features_pth,dataset.features)
+    safety_dataset = SupervisedDataSet(
+        features=np.load(features_pth,mmap_mode='r'),
+        labels=dataset.labels,
+        sensitive_attrs=dataset.sensitive_attrs,
+        num_datapoints=dataset.num_datapoints,
+        meta_information=dataset.meta_information)
+
+    solution = np.zeros(10)
+    solution[0] = 3.0
+    st = SafetyTest(safety_dataset,model,parse_trees)
+    passed_safety = st.run(solution)
+    # The masked data are released at the end of the run
+    assert safety_dataset.masked_data_cache == {}
+    bounds = [(pt.root.lower,pt.root.upper) for pt in parse_trees]
+    base_node_bounds = [pt.base_node_dict['Mean_Error | [M]']['upper']
+        for pt in parse_trees[:1]]
+
+    passed_safety_streaming = st.run(solution,
+        batch_size_safety=5000,stream_safety=True)
+    assert passed_safety_streaming == passed_safety
+    for pt,(lower,upper) in zip(parse_trees,bounds):
+        assert pt.root.upper == pytest.approx(upper)
+    assert parse_trees[0].base_node_dict['Mean_Error | [M]']['upper'] == pytest.approx(
+        base_node_bounds[0])
+
+def test_run_safety_test_many(
+    gpa_regression_dataset):
+    """ Test that running the safety test on a pool of
+    candidate solutions gives the same results as running
+    it on each solution, and predicts once per feature array """
+    constraint_strs = [
+        'abs((Mean_Error | [M]) - (Mean_Error | [F])) - 0.1',
+        'Mean_Squared_Error - 2.0']
+    deltas = [0.05,0.05]
+    (dataset,model,primary_objective,
+        parse_trees) = gpa_regression_dataset(constraint_strs,deltas)
+
+    rng = np.random.default_rng(0)
+    thetas = 0.01*rng.normal(size=(5,10))
+    thetas[:,0] = [3.0,2.5,2.9,0.0,3.1]
+    st = SafetyTest(dataset,model,parse_trees)
+    expected_bounds = []
+    expected_passed = []
+    for theta in thetas:
+        passed = st.run(theta)
+        expected_passed.append(passed)
+        expected_bounds.append([pt.root.upper for pt in parse_trees])
+
+    # Count the calls to the model
+    n_predict_calls = []
+    predict = model.predict
+    def counting_predict(theta,X):
+        n_predict_calls.append(1)
+        return predict(theta,X)
+    model.predict = counting_predict
+
+    st = SafetyTest(dataset,model,parse_trees)
+    passed,upper_bounds = st.run_many(thetas)
+    assert passed.shape == (5,2)
+    assert upper_bounds.shape == (5,2)
+    assert np.allclose(upper_bounds,np.array(expected_bounds))
+    assert list(np.all(passed,axis=1)) == expected_passed
+    assert len(n_predict_calls) == 0
+
+    # Batching does not use the stacked predictions
+    passed_batching,upper_bounds_batching = st.run_many(
+        thetas,batch_size_safety=10000)
+    assert np.array_equal(passed_batching,passed)
+    assert np.allclose(upper_bounds_batching,upper_bounds)
+    assert len(n_predict_calls) > 0
 
 def test_evaluate_primary_objective_regression(
     simulated_regression_dataset):
@@ -1616,6 +1616,370 @@ def test_lambda_init(gpa_regression_dataset):
 		"but shape is (1, 1)")
 	assert str(excinfo.value) == error_str
 
+def test_fused_gradients(gpa_regression_dataset):
+	""" Test that evaluating f and g in the same pass as
+	their gradients gives the same gradient descent
+	trajectory as evaluating them separately
+	"""
+	rseed=0
+	np.random.seed(rseed) 
+	constraint_strs = ['Mean_Squared_Error - 2.0','2.0 - Mean_Squared_Error'] 
+	deltas = [0.05,0.1]
+	frac_data_in_safety=0.6
+
+	results = []
+	for fused_gradients in [True,False]:
+		(dataset,model,
+			primary_objective,parse_trees) = gpa_regression_dataset(
+			constraint_strs=constraint_strs,
+			deltas=deltas)
+
+		spec = SupervisedSpec(
+			dataset=dataset,
+			model=model,
+			parse_trees=parse_trees,
+			sub_regime='regression',
+			frac_data_in_safety=frac_data_in_safety,
+			primary_objective=primary_objective,
+			use_builtin_primary_gradient_fn=False,
+			initial_solution_fn=model.fit,
+			optimization_technique='gradient_descent',
+			optimizer='adam',
+			optimization_hyperparams={
+				'lambda_init'   : np.array([0.5,0.5]),
+				'alpha_theta'   : 0.005,
+				'alpha_lamb'    : 0.005,
+				'beta_velocity' : 0.9,
+				'beta_rmsprop'  : 0.95,
+				'num_iters'     : 5,
+				'use_batches'   : False,
+				'gradient_library': "autograd",
+				'fused_gradients': fused_gradients,
+				'hyper_search'  : None,
+				'verbose'       : False,
+			}
+		)
+		SA = SeldonianAlgorithm(spec)
+		SA.run()
+		results.append(SA.get_cs_result())
+
+	fused_res,unfused_res = results
+	assert np.allclose(fused_res['candidate_solution'],unfused_res['candidate_solution'])
+	for key in ['f_vals','g_vals','lamb_vals','L_vals']:
+		assert np.allclose(fused_res[key],unfused_res[key])
+
+def test_multistart_candidate_selection(simulated_regression_dataset,monkeypatch):
+	""" Test that candidate selection can run gradient descent
+	from several starting points, in parallel or not, and keeps
+	the best solution predicted to pass the safety test.
+	Without fork, the starts run in this process
+	"""
+	from seldonian.utils import parallel_utils
+	rseed=0
+	np.random.seed(rseed) 
+	constraint_strs = ['Mean_Squared_Error - 2.0']
+	deltas = [0.05]
+
+	results = []
+	for n_workers,can_fork in [(1,True),(2,True),(2,False)]:
+		if not can_fork:
+			monkeypatch.setattr(
+				parallel_utils.mp,"get_all_start_methods",lambda: ["spawn"])
+		(dataset,model,
+			primary_objective,parse_trees) = simulated_regression_dataset(
+			constraint_strs=constraint_strs,
+			deltas=deltas,numPoints=1000)
+
+		spec = SupervisedSpec(
+			dataset=dataset,
+			model=model,
+			parse_trees=parse_trees,
+			sub_regime='regression',
+			frac_data_in_safety=0.6,
+			primary_objective=primary_objective,
+			use_builtin_primary_gradient_fn=False,
+			initial_solution_fn=model.fit,
+			optimization_technique='gradient_descent',
+			optimizer='adam',
+			optimization_hyperparams={
+				'lambda_init'   : np.array([0.5]),
+				'alpha_theta'   : 0.005,
+				'alpha_lamb'    : 0.005,
+				'beta_velocity' : 0.9,
+				'beta_rmsprop'  : 0.95,
+				'num_iters'     : 20,
+				'use_batches'   : False,
+				'gradient_library': "autograd",
+				'hyper_search'  : None,
+				'verbose'       : False,
+				'n_starts'      : 4,
+				'start_scale'   : 0.5,
+				'start_hyperparams': [{'alpha_theta':0.005},{'alpha_theta':0.01}],
+				'n_workers'     : n_workers,
+				'seed'          : rseed,
+			}
+		)
+		SA = SeldonianAlgorithm(spec)
+		if can_fork:
+			passed_safety,solution = SA.run()
+		else:
+			with pytest.warns(UserWarning,match="fork"):
+				passed_safety,solution = SA.run()
+		results.append(SA.get_cs_result())
+
+	serial_res = results[0]
+	assert passed_safety == True
+	for parallel_res in results[1:]:
+		assert np.allclose(serial_res['candidate_solution'],parallel_res['candidate_solution'])
+		assert serial_res['start_index'] == parallel_res['start_index']
+		assert np.allclose(serial_res['start_f_vals'],parallel_res['start_f_vals'])
+	f_vals = serial_res['start_f_vals']
+	g_vals = serial_res['start_g_vals']
+	assert g_vals.shape == (4,1)
+	feasible = np.all(g_vals <= 0,axis=1)
+	assert feasible[serial_res['start_index']]
+	assert f_vals[serial_res['start_index']] == np.min(f_vals[feasible])
+
+	# The starts do not change the initial solution
+	spec.optimization_hyperparams['n_workers'] = 1
+	SA = SeldonianAlgorithm(spec)
+	initial_solution = SA.set_initial_solution()
+	initial_solution_copy = np.copy(initial_solution)
+	cs = SA.candidate_selection()
+	cs.run(**spec.optimization_hyperparams,
+		use_builtin_primary_gradient_fn=False,
+		custom_primary_gradient_fn=None,
+		debug=False)
+	assert cs.initial_solution is initial_solution
+	assert np.array_equal(initial_solution,initial_solution_copy)
+
+def test_checkpoint_resume(simulated_regression_dataset,tmp_path):
+	""" Test that candidate selection resumed from a
+	checkpoint gives the same results as an uninterrupted run
+	"""
+	from seldonian.optimizers.gradient_descent import (
+		load_checkpoint,load_history_log)
+	rseed=0
+	constraint_strs = ['Mean_Squared_Error - 2.0']
+	deltas = [0.05]
+	checkpoint_file = str(tmp_path / 'checkpoint.p')
+
+	def make_SA(n_epochs,history_logfile,batch_size=150):
+		(dataset,model,
+			primary_objective,parse_trees) = simulated_regression_dataset(
+			constraint_strs=constraint_strs,
+			deltas=deltas,numPoints=1000)
+		spec = SupervisedSpec(
+			dataset=dataset,
+			model=model,
+			parse_trees=parse_trees,
+			sub_regime='regression',
+			frac_data_in_safety=0.6,
+			primary_objective=primary_objective,
+			use_builtin_primary_gradient_fn=False,
+			initial_solution_fn=model.fit,
+			optimization_technique='gradient_descent',
+			optimizer='adam',
+			optimization_hyperparams={
+				'lambda_init'   : np.array([0.5]),
+				'alpha_theta'   : 0.01,
+				'alpha_lamb'    : 0.01,
+				'beta_velocity' : 0.9,
+				'beta_rmsprop'  : 0.95,
+				'use_batches'   : True,
+				'batch_size'    : batch_size,
+				'n_epochs'      : n_epochs,
+				'shuffle_batches': True,
+				'seed'          : rseed,
+				'gradient_library': "autograd",
+				'hyper_search'  : None,
+				'verbose'       : False,
+				'history_logfile': history_logfile,
+				'checkpoint_file': checkpoint_file,
+				'checkpoint_every': 2,
+			}
+		)
+		return SeldonianAlgorithm(spec)
+
+	# Uninterrupted run, 3 batches per epoch
+	full_logfile = str(tmp_path / 'full_history.p')
+	SA = make_SA(n_epochs=4,history_logfile=full_logfile)
+	passed_safety,solution = SA.run()
+	full_res = SA.get_cs_result()
+	assert len(full_res['f_vals']) == 12
+	assert load_checkpoint(checkpoint_file)['gd_index'] == 12
+
+	# A run that stops after 6 iterations, in the middle of
+	# the second epoch, when the last checkpoint was made after 4
+	os.remove(checkpoint_file)
+	resumed_logfile = str(tmp_path / 'resumed_history.p')
+	SA = make_SA(n_epochs=2,history_logfile=resumed_logfile)
+	SA.spec.optimization_hyperparams['checkpoint_every'] = 4
+	SA.run()
+	state = load_checkpoint(checkpoint_file)
+	assert state['gd_index'] == 4
+	assert (state['epoch'],state['batch_index']) == (1,1)
+	assert len(load_history_log(resumed_logfile)) == 6
+	assert state['run_description'] == {
+		'theta_shape':(2,),'n_constraints':1,'n_batches':3,'batch_size':150}
+
+	# A checkpoint made by another run is not resumed
+	SA = make_SA(n_epochs=4,history_logfile=None,batch_size=100)
+	with pytest.raises(ValueError) as excinfo:
+		SA.run(resume=True)
+	assert "was made by a run with" in str(excinfo.value)
+	assert load_checkpoint(checkpoint_file)['gd_index'] == 4
+
+	# Resume and finish
+	SA = make_SA(n_epochs=4,history_logfile=resumed_logfile)
+	passed_safety_resumed,solution_resumed = SA.run(resume=True)
+	resumed_res = SA.get_cs_result()
+	assert passed_safety_resumed == passed_safety
+	assert np.allclose(solution_resumed,solution)
+	assert np.allclose(resumed_res['candidate_solution'],full_res['candidate_solution'])
+	assert resumed_res['best_index'] == full_res['best_index']
+	for key in ['f_vals','g_vals','lamb_vals','L_vals']:
+		assert np.allclose(resumed_res[key],full_res[key])
+	assert np.array_equal(resumed_res['history_iterations'],np.arange(12))
+	# Iterations after the checkpoint are not duplicated in the log
+	full_records = load_history_log(full_logfile)
+	resumed_records = load_history_log(resumed_logfile)
+	assert [r['iteration'] for r in resumed_records] == list(range(12))
+	assert np.allclose([r['f'] for r in resumed_records],[r['f'] for r in full_records])
+
+def test_candidate_selection_releases_batches(simulated_regression_dataset):
+	""" Test that candidate selection does not keep
+	the last batch, or the data cached for it, once done
+	"""
+	rseed=0
+	np.random.seed(rseed)
+	(dataset,model,
+		primary_objective,parse_trees) = simulated_regression_dataset(
+		constraint_strs=['Mean_Squared_Error - 2.0'],
+		deltas=[0.05],numPoints=1000)
+	spec = SupervisedSpec(
+		dataset=dataset,
+		model=model,
+		parse_trees=parse_trees,
+		sub_regime='regression',
+		frac_data_in_safety=0.6,
+		primary_objective=primary_objective,
+		use_builtin_primary_gradient_fn=False,
+		initial_solution_fn=model.fit,
+		optimization_technique='gradient_descent',
+		optimizer='adam',
+		optimization_hyperparams={
+			'lambda_init'   : np.array([0.5]),
+			'alpha_theta'   : 0.01,
+			'alpha_lamb'    : 0.01,
+			'beta_velocity' : 0.9,
+			'beta_rmsprop'  : 0.95,
+			'use_batches'   : True,
+			'batch_size'    : 150,
+			'n_epochs'      : 2,
+			'gradient_library': "autograd",
+			'hyper_search'  : None,
+			'verbose'       : False,
+		}
+	)
+	SA = SeldonianAlgorithm(spec)
+	SA.set_initial_solution()
+	cs = SA.candidate_selection()
+	cs.run(**spec.optimization_hyperparams,
+		use_builtin_primary_gradient_fn=False,
+		custom_primary_gradient_fn=None,
+		debug=False)
+	assert cs.batch_dataset is None
+	assert cs.batch_datasets is None
+	assert cs.batch_features is None
+	assert cs.batch_labels is None
+	assert cs.batch_sensitive_attrs is None
+	assert cs.candidate_dataset.masked_data_cache == {}
+
+def test_batch_datasets_reused(gpa_regression_dataset):
+	""" Test that batch datasets are made once per batch size
+	and reused across epochs, and that the full batch 
+	is the candidate dataset itself
+	"""
+	rseed=0
+	np.random.seed(rseed) 
+	constraint_strs = ['Mean_Squared_Error - 2.0']
+	deltas = [0.05]
+	(dataset,model,
+		primary_objective,parse_trees) = gpa_regression_dataset(
+		constraint_strs=constraint_strs,
+		deltas=deltas)
+
+	spec = SupervisedSpec(
+		dataset=dataset,
+		model=model,
+		parse_trees=parse_trees,
+		sub_regime='regression',
+		frac_data_in_safety=0.6,
+		primary_objective=primary_objective,
+		use_builtin_primary_gradient_fn=False,
+		initial_solution_fn=model.fit,
+		optimization_technique='gradient_descent',
+		optimizer='adam',
+		optimization_hyperparams={
+			'lambda_init'   : np.array([0.5]),
+			'alpha_theta'   : 0.005,
+			'alpha_lamb'    : 0.005,
+			'beta_velocity' : 0.9,
+			'beta_rmsprop'  : 0.95,
+			'use_batches'   : True,
+			'batch_size'    : 500,
+			'n_epochs'      : 2,
+			'shuffle_batches': True,
+			'seed'          : rseed,
+			'gradient_library': "autograd",
+			'hyper_search'  : None,
+			'verbose'       : False,
+		}
+	)
+	SA = SeldonianAlgorithm(spec)
+	# Full run with shuffled minibatches 
+	passed_safety,solution = SA.run()
+	cs_result = SA.get_cs_result()
+	cs = SA.candidate_selection()
+	n_cand = cs.candidate_dataset.num_datapoints
+	n_batches = int(np.ceil(n_cand/500))
+	assert len(cs_result['f_vals']) == 2*n_batches
+
+	# Full batch
+	assert cs.calculate_batches(batch_index=0,batch_size=n_cand) == False
+	assert cs.batch_dataset is cs.candidate_dataset
+	assert cs.batch_features is cs.features
+	assert cs.batch_datasets is None
+
+	# Minibatches
+	batch_size = 500
+	first_epoch = []
+	for batch_index in range(n_batches):
+		is_small_batch = cs.calculate_batches(batch_index,batch_size)
+		assert is_small_batch == (batch_index == n_batches-1)
+		first_epoch.append(cs.batch_dataset)
+	assert len(cs.batch_datasets) == n_batches
+	assert sum(d.num_datapoints for d in cs.batch_datasets) == n_cand
+	for batch_index in range(n_batches):
+		cs.calculate_batches(batch_index,batch_size)
+		assert cs.batch_dataset is first_epoch[batch_index]
+
+	# Shuffled rows are a permutation of the candidate rows
+	cs.shuffle_batches = True
+	batch_size = 400
+	n_batches = int(np.ceil(n_cand/batch_size))
+	cs.calculate_batches(0,batch_size)
+	assert len(cs.batch_datasets) == n_batches
+	shuffled_labels = np.concatenate([d.labels for d in cs.batch_datasets])
+	assert not np.array_equal(shuffled_labels,cs.labels)
+	assert np.allclose(np.sort(shuffled_labels),np.sort(cs.labels))
+	visited = set()
+	for batch_index in range(n_batches):
+		cs.calculate_batches(batch_index,batch_size)
+		visited.add(id(cs.batch_dataset))
+	assert len(visited) == n_batches
+
 def test_no_primary_provided(gpa_regression_dataset,
 	gpa_classification_dataset,RL_gridworld_dataset):
 	""" Test that if the user does not provide a primary objective,
@@ -2097,3 +2461,139 @@ def test_RL_gridworld_black_box(RL_gridworld_dataset):
 				"Use gradient_descent instead.")
 
 	assert error_str in str(excinfo.value)
+
+def test_gradient_descent_history_policies(tmp_path):
+	""" Test that the history of gradient descent can be thinned,
+	bounded or turned off without changing the solution,
+	and streamed to a log """
+	from seldonian.optimizers.gradient_descent import (
+		gradient_descent_adam,load_history_log)
+
+	def primary_objective(theta):
+		return np.sum((theta - 2.0)**2)
+
+	# Infeasible everywhere, so the solution is where g is smallest
+	def upper_bounds_function(theta):
+		return np.array([np.sum(theta**2) + 1.0])
+
+	def run(**kwargs):
+		return gradient_descent_adam(
+			primary_objective=primary_objective,
+			n_constraints=1,
+			upper_bounds_function=upper_bounds_function,
+			theta_init=np.array([1.0,-1.0]),
+			lambda_init=0.5,
+			batch_calculator=lambda batch_index,batch_size: False,
+			n_batches=1,
+			n_epochs=50,
+			**kwargs)
+
+	res_all = run(history='all',history_theta=True)
+	assert res_all['found_feasible_solution'] == False
+	assert len(res_all['f_vals']) == 50
+	assert res_all['theta_vals'].shape == (50,2)
+	best_index = np.argmin(np.linalg.norm(res_all['g_vals'],axis=1))
+	assert res_all['best_index'] == best_index
+	assert np.allclose(res_all['candidate_solution'],res_all['theta_vals'][best_index])
+	assert 'theta_vals' not in run()
+
+	res_every = run(history='every',history_every=10)
+	assert np.array_equal(res_every['history_iterations'],[0,10,20,30,40])
+	assert np.allclose(res_every['f_vals'],res_all['f_vals'][::10])
+
+	res_last = run(history='last',history_size=5)
+	assert np.array_equal(res_last['history_iterations'],np.arange(45,50))
+	assert np.allclose(res_last['lamb_vals'],res_all['lamb_vals'][-5:])
+
+	res_scalars = run(history='scalars')
+	assert np.allclose(res_scalars['L_vals'],res_all['L_vals'])
+	assert len(res_scalars['g_vals']) == 0
+
+	logfile = str(tmp_path / 'history.p')
+	res_none = run(history='none',history_logfile=logfile)
+	assert len(res_none['f_vals']) == 0
+	for res in [res_every,res_last,res_scalars,res_none]:
+		assert res['best_index'] == res_all['best_index']
+		assert np.allclose(res['candidate_solution'],res_all['candidate_solution'])
+	records = load_history_log(logfile)
+	assert [r['iteration'] for r in records] == list(range(50))
+	assert np.allclose([r['f'] for r in records],res_all['f_vals'])
+
+	# A new run overwrites the log
+	run(history='none',history_logfile=logfile)
+	assert len(load_history_log(logfile)) == 50
+
+	# By default, the last history_size iterations are kept
+	res_default = run(history_size=5)
+	assert np.array_equal(res_default['history_iterations'],np.arange(45,50))
+
+	with pytest.raises(ValueError) as excinfo:
+		run(history='sometimes')
+	assert "History policy: sometimes not supported" in str(excinfo.value)
+
+def test_gradient_descent_early_stopping():
+	""" Test that gradient descent stops when the stopping
+	criteria are met, reports why, and follows the same
+	trajectory as a run without them until then """
+	from seldonian.optimizers.gradient_descent import gradient_descent_adam
+
+	def primary_objective(theta):
+		return np.sum((theta - 2.0)**2) + 1.0
+
+	def upper_bounds_function(theta):
+		return np.array([np.sum(theta**2) - 100.0])
+
+	def run(n_batches=1,n_epochs=500,**kwargs):
+		return gradient_descent_adam(
+			primary_objective=primary_objective,
+			n_constraints=1,
+			upper_bounds_function=upper_bounds_function,
+			theta_init=np.array([1.5,2.5]),
+			lambda_init=0.0,
+			batch_calculator=lambda batch_index,batch_size: False,
+			n_batches=n_batches,
+			n_epochs=n_epochs,
+			alpha_theta=0.001,
+			alpha_lamb=0.01,
+			**kwargs)
+
+	res_full = run()
+	assert res_full['stop_reason'] == 'max_iterations'
+	assert res_full['n_iters'] == 500
+
+	res_grad = run(tol_grad_norm=0.5,history_theta=True)
+	res_rel_L = run(tol_rel_L=1e-5)
+	res_patience = run(patience=20)
+	for res,stop_reason in [
+		(res_grad,'grad_norm'),
+		(res_rel_L,'rel_L'),
+		(res_patience,'patience')]:
+		assert res['stop_reason'] == stop_reason
+		n_iters = res['n_iters']
+		assert n_iters < 500
+		assert len(res['f_vals']) == n_iters
+		assert np.allclose(res['f_vals'],res_full['f_vals'][:n_iters])
+		assert res['found_feasible_solution'] == True
+
+	# The gradient of f vanishes at the stopping point
+	# since lambda stays at 0
+	last_theta = res_grad['theta_vals'][-1]
+	assert np.linalg.norm(2*(last_theta - 2.0)) <= 0.5
+	# The best solution does not change after the Lagrangian
+	# stops changing or the primary objective stops improving
+	for res in [res_rel_L,res_patience]:
+		assert res['best_index'] == res_full['best_index']
+		assert np.allclose(res['candidate_solution'],res_full['candidate_solution'])
+	assert res_patience['n_iters'] == res_full['best_index'] + 20 + 1
+
+	# With minibatches, the mean Lagrangian of each epoch
+	# is compared with that of the previous epoch
+	res_epochs = run(n_batches=4,n_epochs=125,tol_rel_L=1e-3)
+	assert res_epochs['stop_reason'] == 'rel_L'
+	n_iters = res_epochs['n_iters']
+	assert n_iters % 4 == 0
+	assert np.allclose(res_epochs['L_vals'],res_full['L_vals'][:n_iters])
+	epoch_L_vals = res_epochs['L_vals'].reshape(-1,4).mean(axis=1)
+	rel_changes = np.abs(np.diff(epoch_L_vals))/np.abs(epoch_L_vals[:-1])
+	assert rel_changes[-1] <= 1e-3
+	assert np.all(rel_changes[:-1] > 1e-3)
@@ -2,7 +2,8 @@ import pytest
 import autograd.numpy as np
 
 from seldonian.utils.stats_utils import (stddev,
-	tinv,weighted_sum_gamma)
+	tinv,wilson_interval,diff_proportion_interval,
+	weighted_sum_gamma,SufficientStatistics,ttest_bounds)
 
 ### Begin tests
 
@@ -24,6 +25,79 @@ def test_tinv():
 	
 	assert tinv(0.95,1000) == pytest.approx(1.646379)
 	assert tinv(0.1, 1000) == pytest.approx(-1.282399)
+	# Arrays are not memoized
+	assert np.allclose(tinv(np.array([0.95,0.1]),1000),[1.646379,-1.282399])
+
+def test_wilson_interval():
+	""" Test the Wilson score interval on a proportion """
+	
+	lower,upper = wilson_interval(0,10)
+	assert lower == pytest.approx(0.0)
+	assert upper == pytest.approx(0.277533,abs=1e-6)
+
+	lower,upper = wilson_interval(50,100)
+	assert lower == pytest.approx(0.403832,abs=1e-6)
+	assert upper == pytest.approx(0.596168,abs=1e-6)
+
+	# No trials: nothing is known
+	assert wilson_interval(0,0) == (0.0,1.0)
+
+def test_diff_proportion_interval():
+	""" Test Newcombe's interval on the difference 
+	between two proportions """
+	
+	# Example from Newcombe (1998): 56/70 vs 48/80
+	lower,upper = diff_proportion_interval(56,70,48,80)
+	assert lower == pytest.approx(0.0524,abs=1e-4)
+	assert upper == pytest.approx(0.3339,abs=1e-4)
+
+	# Equal proportions: interval contains zero
+	lower,upper = diff_proportion_interval(5,10,5,10)
+	assert lower < 0 < upper
+
+def test_sufficient_statistics():
+	""" Test that statistics accumulated over batches give
+	the same mean and standard deviation as the whole sample """
+	np.random.seed(0)
+	v = np.random.normal(loc=1e6,scale=2.0,size=1001)
+	statistics = SufficientStatistics()
+	for start in range(0,len(v),100):
+		statistics.update(v[start:start+100])
+	statistics.update(np.array([]))
+	assert statistics.count == 1001
+	assert statistics.mean() == pytest.approx(v.mean())
+	assert stddev(statistics) == pytest.approx(stddev(v))
+	assert SufficientStatistics.from_samples(v).std() == pytest.approx(stddev(v))
+	assert np.isnan(SufficientStatistics().mean())
+	assert np.isnan(SufficientStatistics.from_samples([1.0]).std())
+
+	# Merging statistics of parts of the sample
+	merged = (SufficientStatistics.from_samples(v[:300])
+		+ SufficientStatistics.from_samples(v[300:]))
+	assert merged.count == 1001
+	assert merged.mean() == pytest.approx(v.mean())
+	assert merged.std() == pytest.approx(stddev(v))
+
+def test_ttest_bounds():
+	""" Test the t-test bounds from data and from statistics """
+	from autograd import grad
+	np.random.seed(0)
+	v = np.random.normal(size=100)
+	half_width = stddev(v)/np.sqrt(100)*tinv(0.95,99)
+	lower,upper = ttest_bounds(v,100,0.05)
+	assert lower == pytest.approx(v.mean() - half_width)
+	assert upper == pytest.approx(v.mean() + half_width)
+	lower,upper = ttest_bounds(
+		SufficientStatistics.from_samples(v),100,0.05,lower=False,scale=2)
+	assert lower is None
+	assert upper == pytest.approx(v.mean() + 2*half_width)
+
+	# Differentiable through the statistics
+	def upper_bound(theta):
+		return ttest_bounds(theta*v,100,0.05,lower=False)[1]
+	def upper_bound_direct(theta):
+		return np.mean(theta*v) + np.std(theta*v,ddof=1)/10*tinv(0.95,99)
+	assert grad(upper_bound)(1.5) == pytest.approx(grad(upper_bound_direct)(1.5))
 
 def test_weighted_sum_gamma():
 	""" Test the function to calculate the 